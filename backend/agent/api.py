@@ -20,7 +20,12 @@ from services.billing import check_billing_status, can_use_model
 from utils.config import config
 from sandbox.sandbox import create_sandbox, delete_sandbox, get_or_start_sandbox
 from services.llm import make_llm_api_call
-from run_agent_background import run_agent_background, _cleanup_redis_response_list, update_agent_run_status
+from services.llm_scheduler import PRIORITY_LOW
+from run_agent_background import enqueue_agent_run, _cleanup_redis_response_list, update_agent_run_status
+from services.run_responses import compact_responses
+from services.run_queue import get_run_queue_tier
+from services import tool_output_store
+from services.admission import check_admission, publish_queued_status, AdmissionDecision
 from utils.constants import MODEL_NAME_ALIASES
 from flags.flags import is_enabled
 
@@ -131,28 +136,11 @@ def initialize(
     # Note: Redis will be initialized in the lifespan function in api.py
 
 async def cleanup():
-    """Clean up resources and stop running agents on shutdown."""
+    """Clean up resources on shutdown."""
     logger.info("Starting cleanup of agent API resources")
 
-    # Use the instance_id to find and clean up this instance's keys
-    try:
-        if instance_id: # Ensure instance_id is set
-            running_keys = await redis.keys(f"active_run:{instance_id}:*")
-            logger.info(f"Found {len(running_keys)} running agent runs for instance {instance_id} to clean up")
-
-            for key in running_keys:
-                # Key format: active_run:{instance_id}:{agent_run_id}
-                parts = key.split(":")
-                if len(parts) == 3:
-                    agent_run_id = parts[2]
-                    await stop_agent_run(agent_run_id, error_message=f"Instance {instance_id} shutting down")
-                else:
-                    logger.warning(f"Unexpected key format found: {key}")
-        else:
-            logger.warning("Instance ID not set, cannot clean up instance-specific agent runs.")
-
-    except Exception as e:
-        logger.error(f"Failed to clean up running agent runs: {str(e)}")
+    # Runs belong to the worker that holds their lease (it registers them under its own
+    # active_run:{worker id}:{run} key), so shutting down the API leaves them running
 
     # Close Redis connection
     await redis.close()
@@ -177,7 +165,7 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
 
     # Update the agent run status in the database
     update_success = await update_agent_run_status(
-        client, agent_run_id, final_status, error=error_message, responses=all_responses
+        client, agent_run_id, final_status, error=error_message, responses=compact_responses(all_responses)
     )
 
     if not update_success:
@@ -341,6 +329,20 @@ Transform this basic information into a comprehensive, effective system prompt t
         # Return the original prompt if enhancement fails
         return user_system_prompt
 
+async def admit_agent_run(subscription) -> AdmissionDecision:
+    """Admission control for a new agent run; raises 429 with Retry-After when workers are saturated."""
+    decision = await check_admission(get_run_queue_tier(subscription))
+    if not decision.admitted:
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "message": f"All agent workers are busy. Please try again in about {decision.retry_after}s.",
+                "retry_after": decision.retry_after,
+            },
+            headers={"Retry-After": str(decision.retry_after)},
+        )
+    return decision
+
 @router.post("/thread/{thread_id}/agent/start")
 async def start_agent(
     thread_id: str,
@@ -426,6 +428,7 @@ async def start_agent(
     can_run, message, subscription = await check_billing_status(client, account_id)
     if not can_run:
         raise HTTPException(status_code=402, detail={"message": message, "subscription": subscription})
+    admission = await admit_agent_run(subscription)
 
     active_run_id = await check_for_active_project_agent_run(client, project_id)
     if active_run_id:
@@ -457,16 +460,11 @@ async def start_agent(
     agent_run_id = agent_run.data[0]['id']
     logger.info(f"Created new agent run: {agent_run_id}")
 
-    # Register this run in Redis with TTL using instance ID
-    instance_key = f"active_run:{instance_id}:{agent_run_id}"
-    try:
-        await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
-    except Exception as e:
-        logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
-
-    # Run the agent in the background
-    run_agent_background.send(
-        agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
+    # Queue the agent run by subscription tier; a worker picks it up in the background
+    await publish_queued_status(agent_run_id, admission)
+    await enqueue_agent_run(
+        get_run_queue_tier(subscription), account_id,
+        agent_run_id=agent_run_id, thread_id=thread_id,
         project_id=project_id,
         model_name=model_name,  # Already resolved above
         enable_thinking=body.enable_thinking, reasoning_effort=body.reasoning_effort,
@@ -497,6 +495,24 @@ async def get_agent_runs(thread_id: str, user_id: str = Depends(get_current_user
     logger.debug(f"Found {len(agent_runs.data)} agent runs for thread: {thread_id}")
     return {"agent_runs": agent_runs.data}
 
+@router.get("/thread/{thread_id}/messages/{message_id}/output")
+async def get_message_output(thread_id: str, message_id: str, user_id: str = Depends(get_current_user_id_from_jwt)):
+    """Get the full output of a tool result message whose output was offloaded to object storage."""
+    client = await db.client
+    await verify_thread_access(client, thread_id, user_id)
+    message = await client.table('messages').select('metadata').eq('message_id', message_id).eq('thread_id', thread_id).maybe_single().execute()
+    if not message or not message.data:
+        raise HTTPException(status_code=404, detail="Message not found")
+    output_ref = (message.data.get('metadata') or {}).get('output_ref')
+    if not output_ref:
+        raise HTTPException(status_code=404, detail="Message has no offloaded output")
+    try:
+        output = await tool_output_store.load_output(output_ref)
+    except Exception as e:
+        logger.error(f"Failed to load offloaded output of message {message_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to load message output")
+    return {"message_id": message_id, "output": output}
+
 @router.get("/agent-run/{agent_run_id}")
 async def get_agent_run(agent_run_id: str, user_id: str = Depends(get_current_user_id_from_jwt)):
     """Get agent run status and responses."""
@@ -788,7 +804,7 @@ async def generate_and_update_project_name(project_id: str, prompt: str):
         messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}]
 
         logger.debug(f"Calling LLM ({model_name}) for project {project_id} naming.")
-        response = await make_llm_api_call(messages=messages, model_name=model_name, max_tokens=20, temperature=0.7)
+        response = await make_llm_api_call(messages=messages, model_name=model_name, max_tokens=20, temperature=0.7, priority=PRIORITY_LOW)
 
         generated_name = None
         if response and response.get('choices') and response['choices'][0].get('message'):
@@ -879,6 +895,7 @@ async def initiate_agent_with_files(
     can_run, message, subscription = await check_billing_status(client, account_id)
     if not can_run:
         raise HTTPException(status_code=402, detail={"message": message, "subscription": subscription})
+    admission = await admit_agent_run(subscription)
 
     try:
         # 1. Create Project
@@ -1034,16 +1051,11 @@ async def initiate_agent_with_files(
         agent_run_id = agent_run.data[0]['id']
         logger.info(f"Created new agent run: {agent_run_id}")
 
-        # Register run in Redis
-        instance_key = f"active_run:{instance_id}:{agent_run_id}"
-        try:
-            await redis.set(instance_key, "running", ex=redis.REDIS_KEY_TTL)
-        except Exception as e:
-            logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
-
-        # Run agent in background
-        run_agent_background.send(
-            agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
+        # Queue the agent run by subscription tier; a worker picks it up in the background
+        await publish_queued_status(agent_run_id, admission)
+        await enqueue_agent_run(
+            get_run_queue_tier(subscription), account_id,
+            agent_run_id=agent_run_id, thread_id=thread_id,
             project_id=project_id,
             model_name=model_name,  # Already resolved above
             enable_thinking=enable_thinking, reasoning_effort=reasoning_effort,
@@ -0,0 +1,96 @@
+"""
+Per-iteration state of the agent loop, and timing of the iteration's phases.
+
+Before each LLM call the loop needs the type of the latest assistant/tool/user
+message (an assistant message ends the run), the latest browser_state and the
+latest image_context message. These used to be three sequential queries, after
+a sequential billing check. Now:
+
+- the three lookups are one call to the get_agent_iteration_state SQL function
+- run_agent runs it concurrently with the billing check
+
+If the function is not deployed yet, the lookups fall back to separate queries,
+which run concurrently.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Dict, Optional
+
+from utils.logger import logger
+
+
+@dataclass
+class IterationState:
+    latest_message_type: Optional[str] = None
+    browser_state: Optional[Dict[str, Any]] = None  # Latest browser_state message row
+    image_context: Optional[Dict[str, Any]] = None  # Latest image_context message row
+
+
+async def fetch_iteration_state(client, thread_id: str) -> IterationState:
+    """Fetch the state the agent loop needs before an LLM call, in one round trip."""
+    try:
+        result = await client.rpc('get_agent_iteration_state', {'p_thread_id': thread_id}).execute()
+        data = result.data or {}
+        return IterationState(
+            latest_message_type=data.get('latest_message_type'),
+            browser_state=data.get('browser_state'),
+            image_context=data.get('image_context'),
+        )
+    except Exception as e:
+        logger.warning(f"get_agent_iteration_state failed, falling back to separate queries: {e}")
+
+    def latest(*types: str):
+        return (
+            client.table('messages')
+            .select('*')
+            .eq('thread_id', thread_id)
+            .in_('type', list(types))
+            .order('created_at', desc=True)
+            .limit(1)
+            .execute()
+        )
+
+    latest_message, browser_state, image_context = await asyncio.gather(
+        latest('assistant', 'tool', 'user'),
+        latest('browser_state'),
+        latest('image_context'),
+    )
+    return IterationState(
+        latest_message_type=latest_message.data[0]['type'] if latest_message.data else None,
+        browser_state=browser_state.data[0] if browser_state.data else None,
+        image_context=image_context.data[0] if image_context.data else None,
+    )
+
+
+class PhaseTimer:
+    """Records how long each phase of an agent loop iteration took, in milliseconds."""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self._started: Dict[str, float] = {}
+
+    def start(self, name: str):
+        self._started[name] = time.monotonic()
+
+    def stop(self, name: str):
+        started = self._started.pop(name, None)
+        if started is not None:
+            self.phases[name] = round((time.monotonic() - started) * 1000, 1)
+
+    @contextmanager
+    def phase(self, name: str):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    async def timed(self, name: str, awaitable: Awaitable):
+        with self.phase(name):
+            return await awaitable
+
+    def summary(self) -> str:
+        return ", ".join(f"{name}={ms:.0f}ms" for name, ms in self.phases.items())
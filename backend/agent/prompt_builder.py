@@ -0,0 +1,230 @@
+"""
+Memoized system prompt assembly for agent runs.
+
+The final system message depends only on:
+- the model family (which base prompt, and whether the sample response is appended)
+- the agent (agent_id + updated_at, which covers edits to its custom prompt)
+- the registered tools (which XML examples are appended)
+- the MCP tool schemas (which MCP tools are listed)
+
+Runs with the same inputs reuse the same string instead of rebuilding it. The prompt
+is byte-identical across runs, which also keeps the provider's prompt cache warm.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from agent.agent_builder_prompt import get_agent_builder_prompt
+from agent.gemini_prompt import get_gemini_system_prompt
+from agent.o3_prompt import get_system_prompt as get_o3_system_prompt
+from agent.prompt import get_system_prompt
+from agentpress.thread_manager import ThreadManager
+from agentpress.tool import SchemaType
+from utils.logger import logger
+
+MAX_CACHED_PROMPTS = 256
+
+_prompt_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+def get_model_family(model_name: str) -> str:
+    """The part of the model name that decides which default prompt is used."""
+    model = model_name.lower()
+    if "o3" in model:
+        return "o3"
+    if "gemini-2.5-flash" in model:
+        return "gemini-2.5-flash"
+    if "anthropic" in model:
+        return "anthropic"
+    return "default"
+
+
+@lru_cache(maxsize=1)
+def _get_sample_response() -> str:
+    sample_response_path = os.path.join(
+        os.path.dirname(__file__), "sample_responses/1.txt"
+    )
+    with open(sample_response_path, "r") as file:
+        return file.read()
+
+
+def _get_default_system_prompt(model_family: str) -> str:
+    if model_family == "o3":
+        default_system_content = get_o3_system_prompt()
+        logger.info("Using O3-optimized system prompt for reasoning model")
+    elif model_family == "gemini-2.5-flash":
+        default_system_content = get_gemini_system_prompt()
+        logger.info("Using Gemini-optimized system prompt")
+    else:
+        # Use the original prompt - the LLM can only use tools that are registered
+        default_system_content = get_system_prompt()
+        logger.info("Using standard system prompt")
+
+    # Add sample response for non-anthropic models
+    if model_family != "anthropic":
+        default_system_content = (
+            default_system_content
+            + "\n\n <sample_assistant_response>"
+            + _get_sample_response()
+            + "</sample_assistant_response>"
+        )
+    return default_system_content
+
+
+def _get_mcp_schemas(mcp_wrapper_instance) -> Dict[str, Dict[str, Any]]:
+    """OpenAPI schemas of the dynamic MCP tools, keyed by method name."""
+    schemas = {}
+    for method_name, schema_list in mcp_wrapper_instance.get_schemas().items():
+        if method_name == "call_mcp_tool":
+            continue  # Skip the fallback method
+        for schema in schema_list:
+            if schema.schema_type == SchemaType.OPENAPI:
+                schemas[method_name] = schema.schema
+    return schemas
+
+
+def _get_mcp_tools_prompt(mcp_schemas: Optional[Dict[str, Dict[str, Any]]]) -> str:
+    mcp_info = "\n\n--- MCP Tools Available ---\n"
+    mcp_info += (
+        "You have access to external MCP (Model Context Protocol) server tools.\n"
+    )
+    mcp_info += "MCP tools can be called directly using their native function names in the standard function calling format:\n"
+    mcp_info += "<function_calls>\n"
+    mcp_info += '<invoke name="{tool_name}">\n'
+    mcp_info += '<parameter name="param1">value1</parameter>\n'
+    mcp_info += '<parameter name="param2">value2</parameter>\n'
+    mcp_info += "</invoke>\n"
+    mcp_info += "</function_calls>\n\n"
+
+    # List available MCP tools
+    mcp_info += "Available MCP tools:\n"
+    if mcp_schemas is None:
+        mcp_info += "- Error loading MCP tool list\n"
+    else:
+        for method_name, schema in mcp_schemas.items():
+            func_info = schema.get("function", {})
+            description = func_info.get("description", "No description available")
+            mcp_info += f"- **{method_name}**: {description}\n"
+
+            # Show parameter info
+            params = func_info.get("parameters", {})
+            props = params.get("properties", {})
+            if props:
+                mcp_info += f"  Parameters: {', '.join(props.keys())}\n"
+
+    # Add critical instructions for using search results
+    mcp_info += "\n🚨 CRITICAL MCP TOOL RESULT INSTRUCTIONS 🚨\n"
+    mcp_info += "When you use ANY MCP (Model Context Protocol) tools:\n"
+    mcp_info += (
+        "1. ALWAYS read and use the EXACT results returned by the MCP tool\n"
+    )
+    mcp_info += "2. For search tools: ONLY cite URLs, sources, and information from the actual search results\n"
+    mcp_info += "3. For any tool: Base your response entirely on the tool's output - do NOT add external information\n"
+    mcp_info += "4. DO NOT fabricate, invent, hallucinate, or make up any sources, URLs, or data\n"
+    mcp_info += "5. If you need more information, call the MCP tool again with different parameters\n"
+    mcp_info += "6. When writing reports/summaries: Reference ONLY the data from MCP tool results\n"
+    mcp_info += "7. If the MCP tool doesn't return enough information, explicitly state this limitation\n"
+    mcp_info += "8. Always double-check that every fact, URL, and reference comes from the MCP tool output\n"
+    mcp_info += "\nIMPORTANT: MCP tool results are your PRIMARY and ONLY source of truth for external data!\n"
+    mcp_info += "NEVER supplement MCP results with your training data or make assumptions beyond what the tools provide.\n"
+    return mcp_info
+
+
+def _hash(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _get_agent_key(agent_config: Optional[dict], is_agent_builder: bool) -> str:
+    if is_agent_builder:
+        agent_key = "agent_builder"
+    else:
+        agent_key = "default"
+    if agent_config:
+        if agent_config.get("agent_id") and agent_config.get("updated_at"):
+            agent_key += f":{agent_config['agent_id']}:{agent_config['updated_at']}"
+        else:
+            agent_key += f":{_hash(agent_config.get('system_prompt'))}"
+    return agent_key
+
+
+def build_system_prompt(
+    thread_manager: ThreadManager,
+    model_name: str,
+    agent_config: Optional[dict] = None,
+    is_agent_builder: bool = False,
+    mcp_wrapper_instance=None,
+) -> Dict[str, Any]:
+    """Build (or reuse) the system message for an agent run, including the XML tool examples.
+
+    Call this after all tools, including the dynamic MCP tools, are registered.
+
+    Args:
+        thread_manager: Thread manager whose tool registry the run uses
+        model_name: Model the run uses
+        agent_config: Agent record, if the run uses a custom agent
+        is_agent_builder: Whether the run is the agent builder
+        mcp_wrapper_instance: Initialized MCP tool wrapper, if any
+
+    Returns:
+        The system message
+    """
+    model_family = get_model_family(model_name)
+
+    mcp_schemas = None
+    include_mcp_info = bool(
+        agent_config
+        and (agent_config.get("configured_mcps") or agent_config.get("custom_mcps"))
+        and mcp_wrapper_instance
+        and mcp_wrapper_instance._initialized
+    )
+    if include_mcp_info:
+        try:
+            # Get the actual registered schemas from the wrapper
+            mcp_schemas = _get_mcp_schemas(mcp_wrapper_instance)
+        except Exception as e:
+            logger.error(f"Error listing MCP tools: {e}")
+
+    cache_key = "|".join([
+        model_family,
+        _get_agent_key(agent_config, is_agent_builder),
+        _hash(sorted(thread_manager.tool_registry.tools.keys())),
+        _hash(mcp_schemas) if include_mcp_info else "no_mcp",
+    ])
+
+    system_content = _prompt_cache.get(cache_key)
+    if system_content is not None:
+        _prompt_cache.move_to_end(cache_key)
+        logger.info(f"Reusing cached system prompt ({len(system_content)} chars)")
+        return {"role": "system", "content": system_content}
+
+    # Handle custom agent system prompt
+    if agent_config and agent_config.get("system_prompt"):
+        # Completely replace the default system prompt with the custom one
+        # This prevents confusion and tool hallucination
+        system_content = agent_config["system_prompt"].strip()
+        logger.info(
+            f"Using ONLY custom agent system prompt for: {agent_config.get('name', 'Unknown')}"
+        )
+    elif is_agent_builder:
+        system_content = get_agent_builder_prompt()
+        logger.info("Using agent builder system prompt")
+    else:
+        # Use just the default system prompt
+        system_content = _get_default_system_prompt(model_family)
+        logger.info("Using default system prompt only")
+
+    # Add MCP tool information to system prompt if MCP tools are configured
+    if include_mcp_info:
+        system_content += _get_mcp_tools_prompt(mcp_schemas)
+
+    system_content += thread_manager.get_xml_examples_prompt()
+
+    _prompt_cache[cache_key] = system_content
+    if len(_prompt_cache) > MAX_CACHED_PROMPTS:
+        _prompt_cache.popitem(last=False)
+
+    return {"role": "system", "content": system_content}
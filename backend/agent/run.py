@@ -1,5 +1,5 @@
-import os
 import json
+import asyncio
 import re
 from uuid import uuid4
 from typing import Optional
@@ -12,7 +12,6 @@ from agent.tools.web_search_tool import SandboxWebSearchTool
 from dotenv import load_dotenv
 from utils.config import config
 
-from agent.agent_builder_prompt import get_agent_builder_prompt
 from agentpress.thread_manager import ThreadManager
 from agentpress.response_processor import ProcessorConfig
 from agent.tools.sb_shell_tool import SandboxShellTool
@@ -21,7 +20,8 @@ from agent.tools.sb_browser_tool import SandboxBrowserTool
 from agent.tools.data_providers_tool import DataProvidersTool
 from agent.tools.clado_tool import CladoTool
 from agent.tools.expand_msg_tool import ExpandMessageTool
-from agent.prompt import get_system_prompt
+from agent.prompt_builder import build_system_prompt
+from agent.iteration_state import PhaseTimer, fetch_iteration_state
 from utils.logger import logger
 from utils.auth_utils import get_account_id_from_thread
 from services.billing import check_billing_status
@@ -29,14 +29,26 @@ from agent.tools.sb_vision_tool import SandboxVisionTool
 from services.langfuse import langfuse
 from langfuse.client import StatefulTraceClient
 from services.langfuse import langfuse
-from agent.gemini_prompt import get_gemini_system_prompt
-from agent.o3_prompt import get_system_prompt as get_o3_system_prompt
 from agent.tools.mcp_tool_wrapper import MCPToolWrapper
 from agentpress.tool import SchemaType
+from services.run_checkpoints import RunCheckpoint
 
 load_dotenv()
 
 
+def _is_turn_end(chunk: dict) -> bool:
+    """Whether a yielded message is the status that closes a completed LLM/tool turn."""
+    if chunk.get("type") != "status":
+        return False
+    content = chunk.get("content", {})
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except json.JSONDecodeError:
+            return False
+    return isinstance(content, dict) and content.get("status_type") == "thread_run_end"
+
+
 async def run_agent(
     thread_id: str,
     project_id: str,
@@ -52,8 +64,13 @@ async def run_agent(
     trace: Optional[StatefulTraceClient] = None,
     is_agent_builder: Optional[bool] = False,
     target_agent_id: Optional[str] = None,
+    checkpoint: Optional[RunCheckpoint] = None,
 ):
-    """Run the development agent with specified configuration."""
+    """Run the development agent with specified configuration.
+
+    With a checkpoint, progress is saved after every completed turn, and a resumed
+    run continues from the last saved turn instead of starting over.
+    """
     logger.info(f"🚀 Starting agent with model: {model_name}")
     if agent_config:
         logger.info(f"Using custom agent: {agent_config.get('name', 'Unknown')}")
@@ -256,10 +273,9 @@ async def run_agent(
                             # Register each dynamic tool in the registry
                             for schema in schema_list:
                                 if schema.schema_type == SchemaType.OPENAPI:
-                                    thread_manager.tool_registry.tools[method_name] = {
-                                        "instance": mcp_wrapper_instance,
-                                        "schema": schema,
-                                    }
+                                    thread_manager.tool_registry.register_function(
+                                        method_name, mcp_wrapper_instance, schema
+                                    )
                                     logger.debug(
                                         f"Registered dynamic MCP tool: {method_name}"
                                     )
@@ -268,128 +284,19 @@ async def run_agent(
                     logger.error(f"Failed to initialize MCP tools: {e}")
                     # Continue without MCP tools if initialization fails
 
-    # Prepare system prompt
-    # First, get the default system prompt
-    if "o3" in model_name.lower():
-        default_system_content = get_o3_system_prompt()
-        logger.info("Using O3-optimized system prompt for reasoning model")
-    elif "gemini-2.5-flash" in model_name.lower():
-        default_system_content = get_gemini_system_prompt()
-        logger.info("Using Gemini-optimized system prompt")
-    else:
-        # Use the original prompt - the LLM can only use tools that are registered
-        default_system_content = get_system_prompt()
-        logger.info("Using standard system prompt")
-
-    # Add sample response for non-anthropic models
-    if "anthropic" not in model_name.lower():
-        sample_response_path = os.path.join(
-            os.path.dirname(__file__), "sample_responses/1.txt"
-        )
-        with open(sample_response_path, "r") as file:
-            sample_response = file.read()
-        default_system_content = (
-            default_system_content
-            + "\n\n <sample_assistant_response>"
-            + sample_response
-            + "</sample_assistant_response>"
-        )
-
-    # Handle custom agent system prompt
-    if agent_config and agent_config.get("system_prompt"):
-        custom_system_prompt = agent_config["system_prompt"].strip()
-
-        # Completely replace the default system prompt with the custom one
-        # This prevents confusion and tool hallucination
-        system_content = custom_system_prompt
-        logger.info(
-            f"Using ONLY custom agent system prompt for: {agent_config.get('name', 'Unknown')}"
-        )
-    elif is_agent_builder:
-        system_content = get_agent_builder_prompt()
-        logger.info("Using agent builder system prompt")
-    else:
-        # Use just the default system prompt
-        system_content = default_system_content
-        logger.info("Using default system prompt only")
-
-    # Add MCP tool information to system prompt if MCP tools are configured
-    if (
-        agent_config
-        and (agent_config.get("configured_mcps") or agent_config.get("custom_mcps"))
-        and mcp_wrapper_instance
-        and mcp_wrapper_instance._initialized
-    ):
-        mcp_info = "\n\n--- MCP Tools Available ---\n"
-        mcp_info += (
-            "You have access to external MCP (Model Context Protocol) server tools.\n"
-        )
-        mcp_info += "MCP tools can be called directly using their native function names in the standard function calling format:\n"
-        mcp_info += "<function_calls>\n"
-        mcp_info += '<invoke name="{tool_name}">\n'
-        mcp_info += '<parameter name="param1">value1</parameter>\n'
-        mcp_info += '<parameter name="param2">value2</parameter>\n'
-        mcp_info += "</invoke>\n"
-        mcp_info += "</function_calls>\n\n"
-
-        # List available MCP tools
-        mcp_info += "Available MCP tools:\n"
-        try:
-            # Get the actual registered schemas from the wrapper
-            registered_schemas = mcp_wrapper_instance.get_schemas()
-            for method_name, schema_list in registered_schemas.items():
-                if method_name == "call_mcp_tool":
-                    continue  # Skip the fallback method
-
-                # Get the schema info
-                for schema in schema_list:
-                    if schema.schema_type == SchemaType.OPENAPI:
-                        func_info = schema.schema.get("function", {})
-                        description = func_info.get(
-                            "description", "No description available"
-                        )
-                        # Extract server name from description if available
-                        server_match = description.find("(MCP Server: ")
-                        if server_match != -1:
-                            server_end = description.find(")", server_match)
-                            server_info = description[server_match : server_end + 1]
-                        else:
-                            server_info = ""
-
-                        mcp_info += f"- **{method_name}**: {description}\n"
-
-                        # Show parameter info
-                        params = func_info.get("parameters", {})
-                        props = params.get("properties", {})
-                        if props:
-                            mcp_info += f"  Parameters: {', '.join(props.keys())}\n"
-
-        except Exception as e:
-            logger.error(f"Error listing MCP tools: {e}")
-            mcp_info += "- Error loading MCP tool list\n"
-
-        # Add critical instructions for using search results
-        mcp_info += "\n🚨 CRITICAL MCP TOOL RESULT INSTRUCTIONS 🚨\n"
-        mcp_info += "When you use ANY MCP (Model Context Protocol) tools:\n"
-        mcp_info += (
-            "1. ALWAYS read and use the EXACT results returned by the MCP tool\n"
-        )
-        mcp_info += "2. For search tools: ONLY cite URLs, sources, and information from the actual search results\n"
-        mcp_info += "3. For any tool: Base your response entirely on the tool's output - do NOT add external information\n"
-        mcp_info += "4. DO NOT fabricate, invent, hallucinate, or make up any sources, URLs, or data\n"
-        mcp_info += "5. If you need more information, call the MCP tool again with different parameters\n"
-        mcp_info += "6. When writing reports/summaries: Reference ONLY the data from MCP tool results\n"
-        mcp_info += "7. If the MCP tool doesn't return enough information, explicitly state this limitation\n"
-        mcp_info += "8. Always double-check that every fact, URL, and reference comes from the MCP tool output\n"
-        mcp_info += "\nIMPORTANT: MCP tool results are your PRIMARY and ONLY source of truth for external data!\n"
-        mcp_info += "NEVER supplement MCP results with your training data or make assumptions beyond what the tools provide.\n"
-
-        system_content += mcp_info
-
-    system_message = {"role": "system", "content": system_content}
+    # Prepare system prompt (memoized per model family, agent version, tools and MCP schemas)
+    system_message = build_system_prompt(
+        thread_manager,
+        model_name,
+        agent_config=agent_config,
+        is_agent_builder=is_agent_builder,
+        mcp_wrapper_instance=mcp_wrapper_instance,
+    )
 
-    iteration_count = 0
-    continue_execution = True
+    iteration_count = checkpoint.iteration_count if checkpoint else 0
+    continue_execution = checkpoint.continue_execution if checkpoint else True
+    # Turns of the interrupted iteration that already completed (only when resuming)
+    completed_auto_continues = checkpoint.auto_continue_count if checkpoint else 0
 
     latest_user_message = (
         await client.table("messages")
@@ -406,12 +313,83 @@ async def run_agent(
             data = json.loads(data)
         trace.update(input=data["content"])
 
+    if checkpoint and checkpoint.is_resumed:
+        # Drop what the interrupted turn had persisted; it is redone from the last checkpoint
+        resume_after = checkpoint.last_message_created_at or (
+            latest_user_message.data[0]["created_at"] if latest_user_message.data else None
+        )
+        if resume_after:
+            await client.table("messages").delete().eq("thread_id", thread_id).in_(
+                "type", ["assistant", "tool", "status"]
+            ).gt("created_at", resume_after).execute()
+        trace.event(
+            name="agent_run_resumed",
+            level="WARNING",
+            status_message=f"Resumed after {iteration_count} iterations",
+        )
+
+    try:
+        async for chunk in _run_iterations(
+            client=client,
+            account_id=account_id,
+            thread_id=thread_id,
+            thread_manager=thread_manager,
+            trace=trace,
+            system_message=system_message,
+            model_name=model_name,
+            stream=stream,
+            enable_thinking=enable_thinking,
+            reasoning_effort=reasoning_effort,
+            enable_context_manager=enable_context_manager,
+            native_max_auto_continues=native_max_auto_continues,
+            max_iterations=max_iterations,
+            checkpoint=checkpoint,
+            iteration_count=iteration_count,
+            continue_execution=continue_execution,
+            completed_auto_continues=completed_auto_continues,
+        ):
+            yield chunk
+    finally:
+        # Close pooled MCP sessions opened during this run
+        if mcp_wrapper_instance:
+            await mcp_wrapper_instance.cleanup()
+
+    langfuse.flush()  # Flush Langfuse events at the end of the run
+
+
+async def _run_iterations(
+    client,
+    account_id: str,
+    thread_id: str,
+    thread_manager: ThreadManager,
+    trace: StatefulTraceClient,
+    system_message: dict,
+    model_name: str,
+    stream: bool,
+    enable_thinking: Optional[bool],
+    reasoning_effort: Optional[str],
+    enable_context_manager: bool,
+    native_max_auto_continues: int,
+    max_iterations: int,
+    checkpoint: Optional[RunCheckpoint],
+    iteration_count: int,
+    continue_execution: bool,
+    completed_auto_continues: int,
+):
+    """The agent loop of run_agent, one LLM turn (plus auto-continues) per iteration."""
     while continue_execution and iteration_count < max_iterations:
         iteration_count += 1
         logger.info(f"🔄 Running iteration {iteration_count} of {max_iterations}...")
 
-        # Billing check on each iteration - still needed within the iterations
-        can_run, message, subscription = await check_billing_status(client, account_id)
+        timer = PhaseTimer()
+
+        # Billing check on each iteration - still needed within the iterations -
+        # runs concurrently with fetching the thread state
+        with timer.phase("state"):
+            (can_run, message, subscription), state = await asyncio.gather(
+                timer.timed("billing", check_billing_status(client, account_id)),
+                timer.timed("messages", fetch_iteration_state(client, thread_id)),
+            )
         if not can_run:
             error_msg = f"Billing limit reached: {message}"
             trace.event(
@@ -422,47 +400,28 @@ async def run_agent(
             # Yield a special message to indicate billing limit reached
             yield {"type": "status", "status": "stopped", "message": error_msg}
             break
-        # Check if last message is from assistant using direct Supabase query
-        latest_message = (
-            await client.table("messages")
-            .select("*")
-            .eq("thread_id", thread_id)
-            .in_("type", ["assistant", "tool", "user"])
-            .order("created_at", desc=True)
-            .limit(1)
-            .execute()
-        )
-        if latest_message.data and len(latest_message.data) > 0:
-            message_type = latest_message.data[0].get("type")
-            if message_type == "assistant":
-                logger.info(f"Last message was from assistant, stopping execution")
-                trace.event(
-                    name="last_message_from_assistant",
-                    level="DEFAULT",
-                    status_message=(
-                        f"Last message was from assistant, stopping execution"
-                    ),
-                )
-                continue_execution = False
-                break
+        # Check if last message is from assistant
+        if state.latest_message_type == "assistant":
+            logger.info(f"Last message was from assistant, stopping execution")
+            trace.event(
+                name="last_message_from_assistant",
+                level="DEFAULT",
+                status_message=(
+                    f"Last message was from assistant, stopping execution"
+                ),
+            )
+            continue_execution = False
+            break
 
         # ---- Temporary Message Handling (Browser State & Image Context) ----
+        timer.start("prepare")
         temporary_message = None
         temp_message_content_list = []  # List to hold text/image blocks
 
-        # Get the latest browser_state message
-        latest_browser_state_msg = (
-            await client.table("messages")
-            .select("*")
-            .eq("thread_id", thread_id)
-            .eq("type", "browser_state")
-            .order("created_at", desc=True)
-            .limit(1)
-            .execute()
-        )
-        if latest_browser_state_msg.data and len(latest_browser_state_msg.data) > 0:
+        # Latest browser_state message
+        if state.browser_state:
             try:
-                browser_content = latest_browser_state_msg.data[0]["content"]
+                browser_content = state.browser_state["content"]
                 if isinstance(browser_content, str):
                     browser_content = json.loads(browser_content)
                 screenshot_base64 = browser_content.get("screenshot_base64")
@@ -513,22 +472,13 @@ async def run_agent(
                     status_message=(f"{e}"),
                 )
 
-        # Get the latest image_context message (NEW)
-        latest_image_context_msg = (
-            await client.table("messages")
-            .select("*")
-            .eq("thread_id", thread_id)
-            .eq("type", "image_context")
-            .order("created_at", desc=True)
-            .limit(1)
-            .execute()
-        )
-        if latest_image_context_msg.data and len(latest_image_context_msg.data) > 0:
+        # Latest image_context message
+        if state.image_context:
             try:
                 image_context_content = (
-                    latest_image_context_msg.data[0]["content"]
-                    if isinstance(latest_image_context_msg.data[0]["content"], dict)
-                    else json.loads(latest_image_context_msg.data[0]["content"])
+                    state.image_context["content"]
+                    if isinstance(state.image_context["content"], dict)
+                    else json.loads(state.image_context["content"])
                 )
                 base64_image = image_context_content.get("base64")
                 mime_type = image_context_content.get("mime_type")
@@ -555,7 +505,7 @@ async def run_agent(
                     )
 
                 await client.table("messages").delete().eq(
-                    "message_id", latest_image_context_msg.data[0]["message_id"]
+                    "message_id", state.image_context["message_id"]
                 ).execute()
             except Exception as e:
                 logger.error(f"Error parsing image context: {e}")
@@ -569,6 +519,7 @@ async def run_agent(
         if temp_message_content_list:
             temporary_message = {"role": "user", "content": temp_message_content_list}
             # logger.debug(f"Constructed temporary message with {len(temp_message_content_list)} content blocks.")
+        timer.stop("prepare")
         # ---- End Temporary Message Handling ----
 
         # Set max_tokens based on model
@@ -581,6 +532,8 @@ async def run_agent(
         generation = trace.generation(name="thread_manager.run_thread")
         try:
             # Make the LLM call and process the response
+            timer.start("first_chunk")
+            timer.start("stream")
             response = await thread_manager.run_thread(
                 thread_id=thread_id,
                 system_prompt=system_message,
@@ -599,8 +552,9 @@ async def run_agent(
                     tool_execution_strategy="parallel",
                     xml_adding_strategy="user_message",
                 ),
-                native_max_auto_continues=native_max_auto_continues,
-                include_xml_examples=True,
+                native_max_auto_continues=max(1, native_max_auto_continues - completed_auto_continues)
+                if completed_auto_continues else native_max_auto_continues,
+                include_xml_examples=False,  # Already part of the built system prompt
                 enable_thinking=enable_thinking,
                 reasoning_effort=reasoning_effort,
                 enable_context_manager=enable_context_manager,
@@ -632,6 +586,7 @@ async def run_agent(
             try:
                 full_response = ""
                 async for chunk in response:
+                    timer.stop("first_chunk")  # No-op after the first chunk
                     # If we receive an error chunk, we should stop after this iteration
                     if (
                         isinstance(chunk, dict)
@@ -743,6 +698,20 @@ async def run_agent(
 
                     yield chunk
 
+                    if checkpoint:
+                        checkpoint.track_message(chunk)
+                        if _is_turn_end(chunk):
+                            checkpoint.auto_continue_count += 1
+                            await checkpoint.save()
+
+                timer.stop("stream")
+                logger.info(f"Iteration {iteration_count} timing: {timer.summary()}")
+                trace.event(
+                    name="iteration_timing",
+                    level="DEFAULT",
+                    status_message=timer.summary(),
+                )
+
                 # Check if we should stop based on the last tool call or error
                 if error_detected:
                     logger.info(f"Stopping due to error detected in response")
@@ -804,7 +773,12 @@ async def run_agent(
             break
         generation.end(output=full_response)
 
-    langfuse.flush()  # Flush Langfuse events at the end of the run
+        completed_auto_continues = 0
+        if checkpoint:
+            checkpoint.iteration_count = iteration_count
+            checkpoint.auto_continue_count = 0
+            checkpoint.continue_execution = continue_execution
+            await checkpoint.save()
 
 
 # # TESTING
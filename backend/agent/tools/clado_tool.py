@@ -1,13 +1,52 @@
 import os
 import json
+import time
 import asyncio
 import httpx
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Union, Tuple
 from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
+from utils.circuit_breaker import CircuitOpenError, get_breaker
+from utils.http_client import get_shared_client
 from utils.logger import logger
 from utils.config import config
 
 
+# Short-lived response cache TTLs (seconds) by endpoint prefix; other endpoints are not cached
+DEEP_RESEARCH_STATUS_ENDPOINT = "/api/search/deep_research/"
+CACHE_TTLS = {
+    DEEP_RESEARCH_STATUS_ENDPOINT: 10,  # Status polls within a few seconds see the same job state
+    "/api/enrich/": 600,
+}
+FINISHED_JOB_CACHE_TTL = 600  # A finished deep research job no longer changes
+FINISHED_JOB_STATUSES = {"completed", "failed", "error", "cancelled"}
+
+# Process-wide state shared by all CladoTool instances
+_response_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_inflight_requests: Dict[str, asyncio.Future] = {}
+_metrics = {
+    "requests": 0,
+    "new_connections": 0,
+    "coalesced_requests": 0,
+    "cache_hits": 0,
+}
+
+
+def get_clado_metrics() -> Dict[str, Any]:
+    """Request, connection reuse, coalescing and cache counters for the Clado client."""
+    reused = max(_metrics["requests"] - _metrics["new_connections"], 0)
+    return {
+        **_metrics,
+        "reused_connections": reused,
+        "connection_reuse_rate": reused / _metrics["requests"] if _metrics["requests"] else 0.0,
+    }
+
+
+async def _trace_connections(event_name: str, info: Dict[str, Any]):
+    """httpx trace hook: counts TCP connects so reuse can be derived from request totals."""
+    if event_name == "connection.connect_tcp.complete":
+        _metrics["new_connections"] += 1
+
+
 class CladoTool(Tool):
     """
     Clado API Tool for comprehensive LinkedIn data search and enrichment.
@@ -48,6 +87,13 @@ class CladoTool(Tool):
             "Content-Type": "application/json",
         }
 
+    @staticmethod
+    def _cache_ttl(endpoint: str) -> Optional[int]:
+        for prefix, ttl in CACHE_TTLS.items():
+            if endpoint.startswith(prefix):
+                return ttl
+        return None
+
     async def _make_request(
         self,
         method: str,
@@ -56,7 +102,83 @@ class CladoTool(Tool):
         json_data: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
         """
-        Make an HTTP request to the Clado API with retry logic.
+        Make a request to the Clado API.
+
+        GET requests are served from a short-lived process-wide cache where the
+        endpoint allows it, and identical GETs already in flight are coalesced
+        into a single upstream call. POSTs (which start jobs) always go through.
+
+        Args:
+            method: HTTP method (GET, POST)
+            endpoint: API endpoint path
+            params: Query parameters for GET requests
+            json_data: JSON payload for POST requests
+
+        Returns:
+            API response as dictionary
+
+        Raises:
+            Exception: If request fails after all retries
+        """
+        if method.upper() != "GET":
+            return await self._send_request(method, endpoint, params, json_data)
+
+        key = f"{endpoint}?{json.dumps(params or {}, sort_keys=True, default=str)}"
+
+        cached = _response_cache.get(key)
+        if cached:
+            expires_at, response = cached
+            if expires_at > time.monotonic():
+                _metrics["cache_hits"] += 1
+                logger.debug(f"Clado cache hit for {endpoint}")
+                return response
+            del _response_cache[key]
+
+        inflight = _inflight_requests.get(key)
+        if inflight:
+            _metrics["coalesced_requests"] += 1
+            logger.debug(f"Coalescing Clado request for {endpoint}")
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        _inflight_requests[key] = future
+        try:
+            response = await self._send_request(method, endpoint, params, json_data)
+            future.set_result(response)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when nobody else was waiting
+            raise
+        finally:
+            _inflight_requests.pop(key, None)
+
+        ttl = self._cache_ttl(endpoint)
+        if (
+            endpoint.startswith(DEEP_RESEARCH_STATUS_ENDPOINT)
+            and str(response.get("status", "")).lower() in FINISHED_JOB_STATUSES
+        ):
+            ttl = FINISHED_JOB_CACHE_TTL
+        if ttl:
+            _response_cache[key] = (time.monotonic() + ttl, response)
+            # Drop expired entries so the cache can't grow without bound
+            now = time.monotonic()
+            for stale_key in [k for k, (exp, _) in _response_cache.items() if exp <= now]:
+                del _response_cache[stale_key]
+
+        return response
+
+    async def _send_request(
+        self,
+        method: str,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        json_data: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Send an HTTP request to the Clado API over the shared client with retry logic.
 
         Args:
             method: HTTP method (GET, POST)
@@ -73,20 +195,33 @@ class CladoTool(Tool):
         url = f"{self.base_url}{endpoint}"
         headers = self._get_headers()
 
+        client = get_shared_client(
+            "clado", timeout=httpx.Timeout(self.timeout, connect=10.0)
+        )
+        extensions = {"trace": _trace_connections}
+
         for attempt in range(self.max_retries):
             try:
-                async with httpx.AsyncClient(timeout=self.timeout) as client:
+                _metrics["requests"] += 1
+                async with get_breaker("clado").guard():
                     if method.upper() == "GET":
-                        response = await client.get(url, headers=headers, params=params)
+                        response = await client.get(
+                            url, headers=headers, params=params, extensions=extensions
+                        )
                     elif method.upper() == "POST":
                         response = await client.post(
-                            url, headers=headers, json=json_data
+                            url, headers=headers, json=json_data, extensions=extensions
                         )
                     else:
                         raise ValueError(f"Unsupported HTTP method: {method}")
 
                     response.raise_for_status()
-                    return response.json()
+                logger.debug(f"Clado client metrics: {get_clado_metrics()}")
+                return response.json()
+
+            except CircuitOpenError:
+                # Clado is known to be down; don't spend the retry schedule on it
+                raise
 
             except httpx.TimeoutException:
                 logger.warning(
@@ -1,6 +1,30 @@
 import os
+import json
+import asyncio
+import hashlib
+import random
 import requests
+import httpx
 from typing import Dict, Any, Optional, TypedDict, Literal
+from urllib.parse import urlparse
+
+from services import redis
+from utils.circuit_breaker import get_breaker
+from utils.http_client import get_shared_client
+from utils.logger import logger
+
+
+# Shared HTTP settings for all RapidAPI providers
+REQUEST_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+CONNECTION_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60)
+MAX_ATTEMPTS = 3
+BACKOFF_BASE_SECONDS = 0.5
+MAX_RETRY_AFTER_SECONDS = 10
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Response cache
+DEFAULT_CACHE_TTL = 900  # 15 minutes
+CACHE_KEY_PREFIX = "rapidapi:"
 
 
 class EndpointSchema(TypedDict):
@@ -12,38 +36,26 @@ class EndpointSchema(TypedDict):
 
 
 class RapidDataProviderBase:
-    def __init__(self, base_url: str, endpoints: Dict[str, EndpointSchema]):
+    def __init__(self, base_url: str, endpoints: Dict[str, EndpointSchema], cache_ttl: int = DEFAULT_CACHE_TTL):
         self.base_url = base_url
         self.endpoints = endpoints
-    
+        self.cache_ttl = cache_ttl
+        self.provider_name = urlparse(base_url).netloc
+
     def get_endpoints(self):
         return self.endpoints
-    
-    def call_endpoint(
-            self,
-            route: str,
-            payload: Optional[Dict[str, Any]] = None
-    ):
-        """
-        Call an API endpoint with the given parameters and data.
-        
-        Args:
-            endpoint (EndpointSchema): The endpoint configuration dictionary
-            params (dict, optional): Query parameters for GET requests
-            payload (dict, optional): JSON payload for POST requests
-            
-        Returns:
-            dict: The JSON response from the API
-        """
+
+    def _prepare_request(self, route: str):
+        """Resolve a route key to (method, url, headers)."""
         if route.startswith("/"):
             route = route[1:]
 
         endpoint = self.endpoints.get(route)
         if not endpoint:
             raise ValueError(f"Endpoint {route} not found")
-        
+
         url = f"{self.base_url}{endpoint['route']}"
-        
+
         headers = {
             "x-rapidapi-key": os.getenv("RAPID_API_KEY"),
             "x-rapidapi-host": url.split("//")[1].split("/")[0],
@@ -51,11 +63,124 @@ class RapidDataProviderBase:
         }
 
         method = endpoint.get('method', 'GET').upper()
-        
+        if method not in ('GET', 'POST'):
+            raise ValueError(f"Unsupported HTTP method: {method}")
+        return method, url, headers
+
+    def _cache_key(self, route: str, payload: Optional[Dict[str, Any]]) -> str:
+        payload_hash = hashlib.sha256(
+            json.dumps(payload or {}, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return f"{CACHE_KEY_PREFIX}{self.provider_name}:{route.lstrip('/')}:{payload_hash}"
+
+    def call_endpoint(
+            self,
+            route: str,
+            payload: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Call an API endpoint with the given parameters and data (blocking).
+
+        Kept for scripts; async code should use acall_endpoint.
+
+        Args:
+            route (str): The key of the endpoint to call
+            payload (dict, optional): Query parameters for GET requests or JSON payload for POST requests
+
+        Returns:
+            dict: The JSON response from the API
+        """
+        method, url, headers = self._prepare_request(route)
+        timeout = REQUEST_TIMEOUT.read
+
         if method == 'GET':
-            response = requests.get(url, params=payload, headers=headers)
-        elif method == 'POST':
-            response = requests.post(url, json=payload, headers=headers)
+            response = requests.get(url, params=payload, headers=headers, timeout=timeout)
         else:
-            raise ValueError(f"Unsupported HTTP method: {method}")
+            response = requests.post(url, json=payload, headers=headers, timeout=timeout)
         return response.json()
+
+    async def acall_endpoint(
+            self,
+            route: str,
+            payload: Optional[Dict[str, Any]] = None,
+            use_cache: bool = True
+    ):
+        """
+        Call an API endpoint without blocking the event loop.
+
+        Uses the shared connection pool, retries transient failures with jittered
+        exponential backoff, and serves repeated (provider, route, payload) lookups
+        from the Redis response cache.
+
+        Args:
+            route (str): The key of the endpoint to call
+            payload (dict, optional): Query parameters for GET requests or JSON payload for POST requests
+            use_cache (bool): Read from and write to the response cache
+
+        Returns:
+            dict: The JSON response from the API
+        """
+        method, url, headers = self._prepare_request(route)
+        cache_key = self._cache_key(route, payload)
+
+        if use_cache and self.cache_ttl > 0:
+            try:
+                cached = await redis.get(cache_key)
+                if cached is not None:
+                    logger.debug(f"RapidAPI cache hit for {self.provider_name}/{route}")
+                    return json.loads(cached)
+            except Exception as e:
+                logger.warning(f"RapidAPI cache read failed: {e}")
+
+        response = await self._request_with_retries(method, url, headers, payload)
+        result = response.json()
+
+        if use_cache and self.cache_ttl > 0 and response.is_success:
+            try:
+                await redis.set(cache_key, json.dumps(result), ex=self.cache_ttl)
+            except Exception as e:
+                logger.warning(f"RapidAPI cache write failed: {e}")
+
+        return result
+
+    async def _request_with_retries(self, method: str, url: str, headers: Dict[str, str], payload: Optional[Dict[str, Any]]) -> httpx.Response:
+        client = get_shared_client("rapidapi", timeout=REQUEST_TIMEOUT, limits=CONNECTION_LIMITS)
+        breaker = get_breaker(f"rapidapi:{self.provider_name}")
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            # Raises CircuitOpenError while this provider is down
+            probe = await breaker.before_call()
+            try:
+                if method == 'GET':
+                    response = await client.get(url, params=payload, headers=headers)
+                else:
+                    response = await client.post(url, json=payload, headers=headers)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                await breaker.record_failure(e, probe=probe)
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"RapidAPI request to {url} failed ({e}), retrying in {delay:.2f}s (attempt {attempt}/{MAX_ATTEMPTS})")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code >= 500:
+                await breaker.record_failure(Exception(f"HTTP {response.status_code} from {self.provider_name}"), probe=probe)
+            else:
+                await breaker.record_success(probe=probe)
+
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt == MAX_ATTEMPTS:
+                return response
+
+            delay = self._backoff_delay(attempt, response.headers.get("retry-after"))
+            logger.warning(f"RapidAPI request to {url} returned {response.status_code}, retrying in {delay:.2f}s (attempt {attempt}/{MAX_ATTEMPTS})")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+        """Exponential backoff with full jitter, honouring a (capped) Retry-After header."""
+        if retry_after:
+            try:
+                return min(float(retry_after), MAX_RETRY_AFTER_SECONDS)
+            except ValueError:
+                pass
+        return random.uniform(0, BACKOFF_BASE_SECONDS * (2 ** (attempt - 1)))
@@ -89,7 +89,8 @@ class YahooFinanceProvider(RapidDataProviderBase):
             },
         }
         base_url = "https://yahoo-finance15.p.rapidapi.com/api"
-        super().__init__(base_url, endpoints)
+        # Market data goes stale quickly, so keep cached responses short-lived
+        super().__init__(base_url, endpoints, cache_ttl=60)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
 from agentpress.thread_manager import ThreadManager
+from services import tool_output_store
 import json
 
 class ExpandMessageTool(Tool):
@@ -21,6 +22,11 @@ class ExpandMessageTool(Tool):
                     "message_id": {
                         "type": "string",
                         "description": "The ID of the message to expand. Must be a UUID."
+                    },
+                    "start": {
+                        "type": "integer",
+                        "description": "For tool outputs stored separately: character offset to read from. Long outputs are returned in pages; use the next start given in the result to read further.",
+                        "default": 0
                     }
                 },
                 "required": ["message_id"]
@@ -30,7 +36,8 @@ class ExpandMessageTool(Tool):
     @xml_schema(
         tag_name="expand-message",
         mappings=[
-            {"param_name": "message_id", "node_type": "attribute", "path": "."}
+            {"param_name": "message_id", "node_type": "attribute", "path": "."},
+            {"param_name": "start", "node_type": "attribute", "path": "."}
         ],
         example='''
         <!-- Example 1: Expand a message that was truncated in the previous conversation -->
@@ -53,13 +60,22 @@ class ExpandMessageTool(Tool):
         <parameter name="message_id">550e8400-e29b-41d4-a716-446655440000</parameter>
         </invoke>
         </function_calls>
+
+        <!-- Example 4: Read the next page of a long tool output -->
+        <function_calls>
+        <invoke name="expand_message">
+        <parameter name="message_id">550e8400-e29b-41d4-a716-446655440000</parameter>
+        <parameter name="start">20000</parameter>
+        </invoke>
+        </function_calls>
         '''
     )
-    async def expand_message(self, message_id: str) -> ToolResult:
+    async def expand_message(self, message_id: str, start: int = 0) -> ToolResult:
         """Expand a message from the previous conversation with the user.
 
         Args:
             message_id: The ID of the message to expand
+            start: Character offset to read from, for tool outputs stored separately
 
         Returns:
             ToolResult indicating the message was successfully expanded
@@ -72,6 +88,18 @@ class ExpandMessageTool(Tool):
                 return self.fail_response(f"Message with ID {message_id} not found in thread {self.thread_id}")
 
             message_data = message.data[0]
+
+            # Large tool outputs are stored outside the message
+            output_ref = (message_data.get('metadata') or {}).get('output_ref')
+            if output_ref:
+                full_output = await tool_output_store.load_output(output_ref)
+                start = max(0, int(start or 0))
+                end = min(len(full_output), start + tool_output_store.page_size())
+                status = f"Message expanded successfully, showing characters {start}-{end} of {len(full_output)}."
+                if end < len(full_output):
+                    status += f" Call expand-message again with start {end} to read further."
+                return self.success_response({"status": status, "message": full_output[start:end]})
+
             message_content = message_data['content']
             final_content = message_content
             if isinstance(message_content, dict) and 'content' in message_content:
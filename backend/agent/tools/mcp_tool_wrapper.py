@@ -9,15 +9,19 @@ import json
 from typing import Any, Dict, List, Optional
 from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema, ToolSchema, SchemaType
 from mcp_local.client import MCPManager
+from mcp_local.session_pool import MCPSessionPool
+from mcp_local.schema_cache import get_cached_tools, set_cached_tools, invalidate_cached_tools
 from utils.logger import logger
-import inspect
-from mcp import ClientSession
-from mcp.client.sse import sse_client
-from mcp.client.stdio import stdio_client
-from mcp.client.streamable_http import streamablehttp_client
-from mcp import StdioServerParameters
+from utils.config import config
 import asyncio
 
+# Custom MCP type (as stored on the agent) -> session pool transport
+CUSTOM_MCP_TRANSPORTS = {
+    'sse': 'sse',
+    'http': 'http',
+    'json': 'stdio',
+}
+
 
 class MCPToolWrapper(Tool):
     """
@@ -35,7 +39,9 @@ class MCPToolWrapper(Tool):
             mcp_configs: List of MCP configurations from agent's configured_mcps
         """
         # Don't call super().__init__() yet - we need to set up dynamic methods first
-        self.mcp_manager = MCPManager()
+        # One session pool per wrapper: MCP sessions stay open for the duration of the run
+        self.session_pool = MCPSessionPool()
+        self.mcp_manager = MCPManager(session_pool=self.session_pool)
         self.mcp_configs = mcp_configs or []
         self._initialized = False
         self._dynamic_tools = {}
@@ -48,270 +54,99 @@ class MCPToolWrapper(Tool):
     async def _ensure_initialized(self):
         """Ensure MCP servers are initialized."""
         if not self._initialized:
-            # Initialize standard MCP servers from Smithery
             standard_configs = [cfg for cfg in self.mcp_configs if not cfg.get('isCustom', False)]
             custom_configs = [cfg for cfg in self.mcp_configs if cfg.get('isCustom', False)]
             
-            # Initialize standard MCPs through MCPManager
-            if standard_configs:
-                for config in standard_configs:
-                    try:
-                        await self.mcp_manager.connect_server(config)
-                    except Exception as e:
-                        logger.error(f"Failed to connect to MCP server {config['qualifiedName']}: {e}")
-            
-            # Initialize custom MCPs directly
-            if custom_configs:
-                await self._initialize_custom_mcps(custom_configs)
+            # Standard MCPs (Smithery, via MCPManager) and custom MCPs are discovered
+            # concurrently, each server bounded by its own deadline
+            await asyncio.gather(
+                self.mcp_manager.connect_all(standard_configs),
+                self._initialize_custom_mcps(custom_configs)
+            )
             
             # Create dynamic tools for all connected servers
             await self._create_dynamic_tools()
             self._initialized = True
     
-    async def _connect_sse_server(self, server_name, server_config, all_tools, timeout):
-        url = server_config["url"]
-        headers = server_config.get("headers", {})
-        
-        async with asyncio.timeout(timeout):
-            try:
-                async with sse_client(url, headers=headers) as (read, write):
-                    async with ClientSession(read, write) as session:
-                        await session.initialize()
-                        tools_result = await session.list_tools()
-                        tools_info = []
-                        for tool in tools_result.tools:
-                            tool_info = {
-                                "name": tool.name,
-                                "description": tool.description,
-                                "input_schema": tool.inputSchema
-                            }
-                            tools_info.append(tool_info)
-                        
-                        all_tools[server_name] = {
-                            "status": "connected",
-                            "transport": "sse",
-                            "url": url,
-                            "tools": tools_info
-                        }
-                        
-                        logger.info(f"  {server_name}: Connected via SSE ({len(tools_info)} tools)")
-            except TypeError as e:
-                if "unexpected keyword argument" in str(e):
-                    async with sse_client(url) as (read, write):
-                        async with ClientSession(read, write) as session:
-                            await session.initialize()
-                            tools_result = await session.list_tools()
-                            tools_info = []
-                            for tool in tools_result.tools:
-                                tool_info = {
-                                    "name": tool.name,
-                                    "description": tool.description,
-                                    "input_schema": tool.inputSchema
-                                }
-                                tools_info.append(tool_info)
-                            
-                            all_tools[server_name] = {
-                                "status": "connected",
-                                "transport": "sse",
-                                "url": url,
-                                "tools": tools_info
-                            }
-                            logger.info(f"  {server_name}: Connected via SSE ({len(tools_info)} tools)")
-                else:
-                    raise
+    @staticmethod
+    def _custom_connection_config(transport: str, server_config: Dict[str, Any]) -> Dict[str, Any]:
+        """Config used to key the session pool and schema cache for a custom MCP."""
+        if transport == 'http':
+            return {'url': server_config['url']}
+        return server_config
     
-    async def _connect_streamable_http_server(self, url):
-        async with streamablehttp_client(url) as (
-            read_stream,
-            write_stream,
-            _,
-        ):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                tool_result = await session.list_tools()
-                print(f"Connected via HTTP ({len(tool_result.tools)} tools)")
-                
-                tools_info = []
-                for tool in tool_result.tools:
-                    tool_info = {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "inputSchema": tool.inputSchema
-                    }
-                    tools_info.append(tool_info)
-                
-                return tools_info
-        
-    async def _connect_stdio_server(self, server_name, server_config, all_tools, timeout):
-        """Connect to a stdio-based MCP server."""
-        server_params = StdioServerParameters(
-            command=server_config["command"],
-            args=server_config.get("args", []),
-            env=server_config.get("env", {})
-        )
+    async def _discover_tools(self, transport: str, connection_config: Dict[str, Any], server_name: str) -> List[Any]:
+        """List a server's tools, served from the schema cache when possible."""
+        cached_tools = await get_cached_tools(transport, connection_config)
+        if cached_tools is not None:
+            logger.info(f"  {server_name}: Loaded {len(cached_tools)} tools from schema cache")
+            return cached_tools
         
-        async with asyncio.timeout(timeout):
-            async with stdio_client(server_params) as (read, write):
-                async with ClientSession(read, write) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    tools_info = []
-                    for tool in tools_result.tools:
-                        tool_info = {
-                            "name": tool.name,
-                            "description": tool.description,
-                            "input_schema": tool.inputSchema
-                        }
-                        tools_info.append(tool_info)
-                    
-                    all_tools[server_name] = {
-                        "status": "connected",
-                        "transport": "stdio",
-                        "tools": tools_info
-                    }
-                    
-                    logger.info(f"  {server_name}: Connected via stdio ({len(tools_info)} tools)")
-
+        async with asyncio.timeout(config.MCP_SERVER_INIT_TIMEOUT):
+            tools_result = await self.session_pool.list_tools(transport, connection_config)
+        logger.info(f"  {server_name}: Connected via {transport} ({len(tools_result.tools)} tools)")
+        
+        await set_cached_tools(transport, connection_config, tools_result.tools)
+        return tools_result.tools
+    
+    async def _initialize_custom_mcp(self, mcp_config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Discover one custom MCP server and return its enabled tools keyed by tool name."""
+        custom_type = mcp_config.get('customType', 'sse')
+        server_config = mcp_config.get('config', {})
+        enabled_tools = mcp_config.get('enabledTools', [])
+        server_name = mcp_config.get('name', 'Unknown')
+        
+        logger.info(f"Initializing custom MCP: {server_name} (type: {custom_type})")
+        
+        transport = CUSTOM_MCP_TRANSPORTS.get(custom_type)
+        if not transport:
+            logger.error(f"Custom MCP {server_name}: Unsupported type '{custom_type}', supported types are 'sse', 'http' and 'json'")
+            return {}
+        
+        required_field = 'command' if transport == 'stdio' else 'url'
+        if required_field not in server_config:
+            logger.error(f"Custom MCP {server_name}: Missing '{required_field}' in config")
+            return {}
+        
+        try:
+            connection_config = self._custom_connection_config(transport, server_config)
+            tools = await self._discover_tools(transport, connection_config, server_name)
+        except Exception as e:
+            logger.error(f"Custom MCP {server_name}: Connection failed - {str(e)}")
+            return {}
+        
+        custom_tools = {}
+        for tool in tools:
+            if not enabled_tools or tool.name in enabled_tools:
+                tool_name = f"custom_{server_name.replace(' ', '_').lower()}_{tool.name}"
+                custom_tools[tool_name] = {
+                    'name': tool_name,
+                    'description': tool.description,
+                    'parameters': tool.inputSchema,
+                    'server': server_name,
+                    'original_name': tool.name,
+                    'is_custom': True,
+                    'custom_type': custom_type,
+                    'custom_config': server_config
+                }
+                logger.debug(f"Registered custom tool: {tool_name}")
+        
+        logger.info(f"Successfully initialized custom MCP {server_name} with {len(custom_tools)} tools")
+        return custom_tools
+    
     async def _initialize_custom_mcps(self, custom_configs):
-        """Initialize custom MCP servers."""
-        for config in custom_configs:
-            try:
-                logger.info(f"Initializing custom MCP: {config}")
-                custom_type = config.get('customType', 'sse')
-                server_config = config.get('config', {})
-                enabled_tools = config.get('enabledTools', [])
-                server_name = config.get('name', 'Unknown')
-                
-                logger.info(f"Initializing custom MCP: {server_name} (type: {custom_type})")
-                
-                if custom_type == 'sse':
-                    if 'url' not in server_config:
-                        logger.error(f"Custom MCP {server_name}: Missing 'url' in config")
-                        continue
-                        
-                    url = server_config['url']
-                    logger.info(f"Initializing custom MCP {url} with SSE type")
-                    
-                    try:
-                        # Use the working connect_sse_server method
-                        all_tools = {}
-                        await self._connect_sse_server(server_name, server_config, all_tools, 15)
-                        
-                        # Process the results
-                        if server_name in all_tools and all_tools[server_name].get('status') == 'connected':
-                            tools_info = all_tools[server_name].get('tools', [])
-                            tools_registered = 0
-                            
-                            for tool_info in tools_info:
-                                tool_name_from_server = tool_info['name']
-                                if not enabled_tools or tool_name_from_server in enabled_tools:
-                                    tool_name = f"custom_{server_name.replace(' ', '_').lower()}_{tool_name_from_server}"
-                                    self._custom_tools[tool_name] = {
-                                        'name': tool_name,
-                                        'description': tool_info['description'],
-                                        'parameters': tool_info['input_schema'],
-                                        'server': server_name,
-                                        'original_name': tool_name_from_server,
-                                        'is_custom': True,
-                                        'custom_type': custom_type,
-                                        'custom_config': server_config
-                                    }
-                                    tools_registered += 1
-                                    logger.debug(f"Registered custom tool: {tool_name}")
-                            
-                            logger.info(f"Successfully initialized custom MCP {server_name} with {tools_registered} tools")
-                        else:
-                            logger.error(f"Failed to connect to custom MCP {server_name}")
-                            
-                    except Exception as e:
-                        logger.error(f"Custom MCP {server_name}: Connection failed - {str(e)}")
-                        continue
-                
-                elif custom_type == 'http':
-                    if 'url' not in server_config:
-                        logger.error(f"Custom MCP {server_name}: Missing 'url' in config")
-                        continue
-                        
-                    url = server_config['url']
-                    logger.info(f"Initializing custom MCP {url} with HTTP type")
-                    
-                    try:
-
-                        tools_info = await self._connect_streamable_http_server(url)
-                        tools_registered = 0
-                        
-                        for tool_info in tools_info:
-                            tool_name_from_server = tool_info['name']
-                            if not enabled_tools or tool_name_from_server in enabled_tools:
-                                tool_name = f"custom_{server_name.replace(' ', '_').lower()}_{tool_name_from_server}"
-                                self._custom_tools[tool_name] = {
-                                    'name': tool_name,
-                                    'description': tool_info['description'],
-                                    'parameters': tool_info['inputSchema'],
-                                    'server': server_name,
-                                    'original_name': tool_name_from_server,
-                                    'is_custom': True,
-                                    'custom_type': custom_type,
-                                    'custom_config': server_config
-                                }
-                                tools_registered += 1
-                                logger.debug(f"Registered custom tool: {tool_name}")
-                        
-                        logger.info(f"Successfully initialized custom MCP {server_name} with {tools_registered} tools")
-                            
-                    except Exception as e:
-                        logger.error(f"Custom MCP {server_name}: Connection failed - {str(e)}")
-                        continue
-                        
-                elif custom_type == 'json':
-                    if 'command' not in server_config:
-                        logger.error(f"Custom MCP {server_name}: Missing 'command' in config")
-                        continue
-                        
-                    logger.info(f"Initializing custom MCP {server_name} with JSON/stdio type")
-                    
-                    try:
-                        # Use the stdio connection method
-                        all_tools = {}
-                        await self._connect_stdio_server(server_name, server_config, all_tools, 15)
-                        
-                        # Process the results
-                        if server_name in all_tools and all_tools[server_name].get('status') == 'connected':
-                            tools_info = all_tools[server_name].get('tools', [])
-                            tools_registered = 0
-                            
-                            for tool_info in tools_info:
-                                tool_name_from_server = tool_info['name']
-                                if not enabled_tools or tool_name_from_server in enabled_tools:
-                                    tool_name = f"custom_{server_name.replace(' ', '_').lower()}_{tool_name_from_server}"
-                                    self._custom_tools[tool_name] = {
-                                        'name': tool_name,
-                                        'description': tool_info['description'],
-                                        'parameters': tool_info['input_schema'],
-                                        'server': server_name,
-                                        'original_name': tool_name_from_server,
-                                        'is_custom': True,
-                                        'custom_type': custom_type,
-                                        'custom_config': server_config
-                                    }
-                                    tools_registered += 1
-                                    logger.debug(f"Registered custom tool: {tool_name}")
-                            
-                            logger.info(f"Successfully initialized custom MCP {server_name} with {tools_registered} tools")
-                        else:
-                            logger.error(f"Failed to connect to custom MCP {server_name}")
-                            
-                    except Exception as e:
-                        logger.error(f"Custom MCP {server_name}: Connection failed - {str(e)}")
-                        continue
-                        
-                else:
-                    logger.error(f"Custom MCP {server_name}: Unsupported type '{custom_type}', supported types are 'sse', 'http' and 'json'")
-                    continue
-                    
-            except Exception as e:
-                logger.error(f"Failed to initialize custom MCP {config.get('name', 'Unknown')}: {e}")
+        """Initialize custom MCP servers concurrently."""
+        results = await asyncio.gather(
+            *(self._initialize_custom_mcp(mcp_config) for mcp_config in custom_configs),
+            return_exceptions=True
+        )
+        
+        # Merge in configuration order so tool registration is deterministic
+        for mcp_config, result in zip(custom_configs, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to initialize custom MCP {mcp_config.get('name', 'Unknown')}: {result}")
                 continue
+            self._custom_tools.update(result)
     
     async def initialize_and_register_tools(self, tool_registry=None):
         """Initialize MCP tools and optionally update the tool registry.
@@ -435,10 +270,7 @@ class MCPToolWrapper(Tool):
     def _register_schemas(self):
         """Register schemas from all decorated methods and dynamic tools."""
         # First register static schemas from decorated methods
-        for name, method in inspect.getmembers(self, predicate=inspect.ismethod):
-            if hasattr(method, 'tool_schemas'):
-                self._schemas[name] = method.tool_schemas
-                logger.debug(f"Registered schemas for method '{name}' in {self.__class__.__name__}")
+        super()._register_schemas()
         
         # Note: Dynamic schemas will be added after async initialization
         logger.debug(f"Initial registration complete for MCPToolWrapper")
@@ -494,149 +326,50 @@ class MCPToolWrapper(Tool):
             return self.fail_response(f"Error executing tool: {str(e)}")
     
     async def _execute_custom_mcp_tool(self, tool_name: str, arguments: Dict[str, Any], tool_info: Dict[str, Any]) -> ToolResult:
-        """Execute a custom MCP tool call."""
+        """Execute a custom MCP tool call over a pooled session."""
         try:
             custom_type = tool_info['custom_type']
             custom_config = tool_info['custom_config']
             original_tool_name = tool_info['original_name']
             
-            if custom_type == 'sse':
-                # Execute SSE-based custom MCP using the same pattern as _connect_sse_server
-                url = custom_config['url']
-                headers = custom_config.get('headers', {})
-                
-                async with asyncio.timeout(30):  # 30 second timeout for tool execution
-                    try:
-                        # Try with headers first (same pattern as _connect_sse_server)
-                        async with sse_client(url, headers=headers) as (read, write):
-                            async with ClientSession(read, write) as session:
-                                await session.initialize()
-                                result = await session.call_tool(original_tool_name, arguments)
-                                
-                                # Handle the result properly
-                                if hasattr(result, 'content'):
-                                    content = result.content
-                                    if isinstance(content, list):
-                                        # Extract text from content list
-                                        text_parts = []
-                                        for item in content:
-                                            if hasattr(item, 'text'):
-                                                text_parts.append(item.text)
-                                            else:
-                                                text_parts.append(str(item))
-                                        content_str = "\n".join(text_parts)
-                                    elif hasattr(content, 'text'):
-                                        content_str = content.text
-                                    else:
-                                        content_str = str(content)
-                                    
-                                    return self.success_response(content_str)
-                                else:
-                                    return self.success_response(str(result))
-                                    
-                    except TypeError as e:
-                        if "unexpected keyword argument" in str(e):
-                            # Fallback: try without headers (exact pattern from _connect_sse_server)
-                            async with sse_client(url) as (read, write):
-                                async with ClientSession(read, write) as session:
-                                    await session.initialize()
-                                    result = await session.call_tool(original_tool_name, arguments)
-                                    
-                                    # Handle the result properly
-                                    if hasattr(result, 'content'):
-                                        content = result.content
-                                        if isinstance(content, list):
-                                            # Extract text from content list
-                                            text_parts = []
-                                            for item in content:
-                                                if hasattr(item, 'text'):
-                                                    text_parts.append(item.text)
-                                                else:
-                                                    text_parts.append(str(item))
-                                            content_str = "\n".join(text_parts)
-                                        elif hasattr(content, 'text'):
-                                            content_str = content.text
-                                        else:
-                                            content_str = str(content)
-                                        
-                                        return self.success_response(content_str)
-                                    else:
-                                        return self.success_response(str(result))
-                        else:
-                            raise
+            transport = CUSTOM_MCP_TRANSPORTS.get(custom_type)
+            if not transport:
+                return self.fail_response(f"Unsupported custom MCP type: {custom_type}")
             
-            elif custom_type == 'http':
-                # Execute HTTP-based custom MCP
-                url = custom_config['url']
-                
-                async with asyncio.timeout(30):  # 30 second timeout for tool execution
-                    async with streamablehttp_client(url) as (read, write, _):
-                        async with ClientSession(read, write) as session:
-                            await session.initialize()
-                            result = await session.call_tool(original_tool_name, arguments)
-                            
-                            # Handle the result properly
-                            if hasattr(result, 'content'):
-                                content = result.content
-                                if isinstance(content, list):
-                                    # Extract text from content list
-                                    text_parts = []
-                                    for item in content:
-                                        if hasattr(item, 'text'):
-                                            text_parts.append(item.text)
-                                        else:
-                                            text_parts.append(str(item))
-                                    content_str = "\n".join(text_parts)
-                                elif hasattr(content, 'text'):
-                                    content_str = content.text
-                                else:
-                                    content_str = str(content)
-                                
-                                return self.success_response(content_str)
-                            else:
-                                return self.success_response(str(result))
-                                
-            elif custom_type == 'json':
-                # Execute stdio-based custom MCP using the same pattern as _connect_stdio_server
-                server_params = StdioServerParameters(
-                    command=custom_config["command"],
-                    args=custom_config.get("args", []),
-                    env=custom_config.get("env", {})
-                )
+            connection_config = self._custom_connection_config(transport, custom_config)
+            
+            # 30 second timeout for tool execution
+            result = await self.session_pool.call_tool(transport, connection_config, original_tool_name, arguments, timeout=30)
+            
+            # Handle the result properly
+            if hasattr(result, 'content'):
+                content = result.content
+                if isinstance(content, list):
+                    # Extract text from content list
+                    text_parts = []
+                    for item in content:
+                        if hasattr(item, 'text'):
+                            text_parts.append(item.text)
+                        else:
+                            text_parts.append(str(item))
+                    content_str = "\n".join(text_parts)
+                elif hasattr(content, 'text'):
+                    content_str = content.text
+                else:
+                    content_str = str(content)
                 
-                async with asyncio.timeout(30):  # 30 second timeout for tool execution
-                    async with stdio_client(server_params) as (read, write):
-                        async with ClientSession(read, write) as session:
-                            await session.initialize()
-                            result = await session.call_tool(original_tool_name, arguments)
-                            
-                            # Handle the result properly
-                            if hasattr(result, 'content'):
-                                content = result.content
-                                if isinstance(content, list):
-                                    # Extract text from content list
-                                    text_parts = []
-                                    for item in content:
-                                        if hasattr(item, 'text'):
-                                            text_parts.append(item.text)
-                                        else:
-                                            text_parts.append(str(item))
-                                    content_str = "\n".join(text_parts)
-                                elif hasattr(content, 'text'):
-                                    content_str = content.text
-                                else:
-                                    content_str = str(content)
-                                
-                                return self.success_response(content_str)
-                            else:
-                                return self.success_response(str(result))
+                return self.success_response(content_str)
             else:
-                return self.fail_response(f"Unsupported custom MCP type: {custom_type}")
+                return self.success_response(str(result))
                                 
         except asyncio.TimeoutError:
             return self.fail_response(f"Tool execution timeout for {tool_name}")
         except Exception as e:
             logger.error(f"Error executing custom MCP tool {tool_name}: {str(e)}")
+            # The server may have changed its tools since they were cached
+            transport = CUSTOM_MCP_TRANSPORTS.get(tool_info.get('custom_type'))
+            if transport:
+                await invalidate_cached_tools(transport, self._custom_connection_config(transport, tool_info['custom_config']))
             return self.fail_response(f"Error executing custom tool: {str(e)}")
     
     # Keep the original call_mcp_tool method as a fallback
@@ -691,11 +424,10 @@ class MCPToolWrapper(Tool):
         return await self._execute_mcp_tool(tool_name, arguments)
             
     async def cleanup(self):
-        """Disconnect all MCP servers."""
-        if self._initialized:
-            try:
-                await self.mcp_manager.disconnect_all()
-            except Exception as e:
-                logger.error(f"Error during MCP cleanup: {str(e)}")
-            finally:
-                self._initialized = False 
\ No newline at end of file
+        """Disconnect all MCP servers and close pooled sessions."""
+        try:
+            await self.mcp_manager.disconnect_all()
+        except Exception as e:
+            logger.error(f"Error during MCP cleanup: {str(e)}")
+        finally:
+            self._initialized = False
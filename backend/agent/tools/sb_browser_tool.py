@@ -1,7 +1,7 @@
 import traceback
 import json
 
-from agentpress.tool import ToolResult, openapi_schema, xml_schema
+from agentpress.tool import ToolResult, ResourceAccess, openapi_schema, xml_schema
 from agentpress.thread_manager import ThreadManager
 from sandbox.tool_base import SandboxToolsBase
 from utils.logger import logger
@@ -15,6 +15,10 @@ class SandboxBrowserTool(SandboxToolsBase):
         super().__init__(project_id, thread_manager)
         self.thread_id = thread_id
 
+    def get_resource_access(self, function_name: str, arguments: dict) -> ResourceAccess:
+        """The sandbox has one browser; its actions run one after another."""
+        return ResourceAccess(key="browser")
+
     async def _execute_browser_action(self, endpoint: str, params: dict = None, method: str = "POST") -> ToolResult:
         """Execute a browser automation action through the API
         
@@ -124,6 +128,10 @@ class SandboxBrowserTool(SandboxToolsBase):
                     "url": {
                         "type": "string",
                         "description": "The url to navigate to"
+                    },
+                    "lean": {
+                        "type": "boolean",
+                        "description": "Load the page without images, fonts, media and trackers. Much faster when only the page text is needed; leave off when the visual layout matters."
                     }
                 },
                 "required": ["url"]
@@ -133,7 +141,8 @@ class SandboxBrowserTool(SandboxToolsBase):
     @xml_schema(
         tag_name="browser-navigate-to",
         mappings=[
-            {"param_name": "url", "node_type": "content", "path": "."}
+            {"param_name": "url", "node_type": "content", "path": "."},
+            {"param_name": "lean", "node_type": "attribute", "path": ".", "required": False}
         ],
         example='''
         <function_calls>
@@ -143,16 +152,20 @@ class SandboxBrowserTool(SandboxToolsBase):
         </function_calls>
         '''
     )
-    async def browser_navigate_to(self, url: str) -> ToolResult:
+    async def browser_navigate_to(self, url: str, lean: bool = None) -> ToolResult:
         """Navigate to a specific url
         
         Args:
             url (str): The url to navigate to
+            lean (bool, optional): Skip images, fonts, media and trackers for this navigation
             
         Returns:
             dict: Result of the execution
         """
-        return await self._execute_browser_action("navigate_to", {"url": url})
+        params = {"url": url}
+        if lean is not None:
+            params["lean"] = lean
+        return await self._execute_browser_action("navigate_to", params)
 
     # @openapi_schema({
     #     "type": "function",
@@ -1,9 +1,10 @@
-from agentpress.tool import ToolResult, openapi_schema, xml_schema
+from agentpress.tool import ToolResult, ResourceAccess, openapi_schema, xml_schema
 from sandbox.tool_base import SandboxToolsBase    
 from utils.files_utils import should_exclude_file, clean_path
 from agentpress.thread_manager import ThreadManager
 from utils.logger import logger
 import os
+from typing import Optional
 
 class SandboxFilesTool(SandboxToolsBase):
     """Tool for executing file system operations in a Daytona sandbox. All operations are performed relative to the /workspace directory."""
@@ -17,6 +18,13 @@ class SandboxFilesTool(SandboxToolsBase):
         """Clean and normalize a path to be relative to /workspace"""
         return clean_path(path, self.workspace_path)
 
+    def get_resource_access(self, function_name: str, arguments: dict) -> Optional[ResourceAccess]:
+        """Edits of the same file run one after another, in the order they were called."""
+        file_path = arguments.get("file_path")
+        if not file_path:
+            return None
+        return ResourceAccess(key=f"file:{self.clean_path(file_path)}")
+
     def _should_exclude_file(self, rel_path: str) -> bool:
         """Check if a file should be excluded based on path, name, or extension"""
         return should_exclude_file(rel_path)
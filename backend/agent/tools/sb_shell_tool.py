@@ -1,7 +1,7 @@
 from typing import Optional, Dict, Any
 import time
 from uuid import uuid4
-from agentpress.tool import ToolResult, openapi_schema, xml_schema
+from agentpress.tool import ToolResult, ResourceAccess, openapi_schema, xml_schema
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
 
@@ -9,11 +9,20 @@ class SandboxShellTool(SandboxToolsBase):
     """Tool for executing tasks in a Daytona sandbox with browser-use capabilities. 
     Uses sessions for maintaining state between commands and provides comprehensive process management."""
 
+    max_concurrency = 4
+
     def __init__(self, project_id: str, thread_manager: ThreadManager):
         super().__init__(project_id, thread_manager)
         self._sessions: Dict[str, str] = {}  # Maps session names to session IDs
         self.workspace_path = "/workspace"  # Ensure we're always operating in /workspace
 
+    def get_resource_access(self, function_name: str, arguments: Dict[str, Any]) -> Optional[ResourceAccess]:
+        """Commands in the same named session run one after another."""
+        session_name = arguments.get("session_name")
+        if not session_name:
+            return None
+        return ResourceAccess(key=f"shell_session:{session_name}")
+
     async def _ensure_session(self, session_name: str = "default") -> str:
         """Ensure a session exists and return its ID."""
         if session_name not in self._sessions:
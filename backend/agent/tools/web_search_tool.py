@@ -5,6 +5,11 @@ from agentpress.tool import Tool, ToolResult, openapi_schema, xml_schema
 from utils.config import config
 from sandbox.tool_base import SandboxToolsBase
 from agentpress.thread_manager import ThreadManager
+from services import redis
+from utils.http_client import get_shared_client
+from utils.circuit_breaker import get_breaker
+from urllib.parse import urlparse
+import hashlib
 import json
 import os
 import datetime
@@ -13,9 +18,27 @@ import logging
 
 # TODO: add subpages, etc... in filters as sometimes its necessary 
 
+# Scraping settings
+SCRAPE_MAX_CONCURRENCY = 5  # Parallel Firecrawl requests per scrape_webpage call
+SCRAPE_TIMEOUT_SECONDS = 120
+SCRAPE_MAX_RETRIES = 3
+SCRAPE_CACHE_TTL = 3600  # Scraped page content is shared across runs for an hour
+SCRAPE_CACHE_MAX_BYTES = 1_000_000  # Don't cache pages larger than this
+SCRAPE_CACHE_PREFIX = "scrape:"
+
+# Search settings
+SEARCH_CACHE_TTL = 1800  # Identical (normalized) searches reuse results for 30 minutes
+SEARCH_CACHE_MAX_ENTRIES = 5000  # Oldest cached searches are evicted beyond this
+SEARCH_CACHE_MAX_BYTES = 500_000
+SEARCH_CACHE_PREFIX = "web_search:"
+SEARCH_CACHE_INDEX_KEY = "web_search:index"
+SEARCH_MAX_BATCH_QUERIES = 5
+
 class SandboxWebSearchTool(SandboxToolsBase):
     """Tool for performing web searches using Tavily API and web scraping using Firecrawl."""
 
+    max_concurrency = 3  # Third-party APIs; more parallel calls mostly get rate limited
+
     def __init__(self, project_id: str, thread_manager: ThreadManager):
         super().__init__(project_id, thread_manager)
         # Load environment variables
@@ -37,7 +60,7 @@ class SandboxWebSearchTool(SandboxToolsBase):
         "type": "function",
         "function": {
             "name": "web_search",
-            "description": "Search the web for up-to-date information on a specific topic using the Tavily API. This tool allows you to gather real-time information from the internet to answer user queries, research topics, validate facts, and find recent developments. Results include titles, URLs, and publication dates. Use this tool for discovering relevant web pages before potentially crawling them for complete content.",
+            "description": "Search the web for up-to-date information on a specific topic using the Tavily API. This tool allows you to gather real-time information from the internet to answer user queries, research topics, validate facts, and find recent developments. Results include titles, URLs, and publication dates. Use this tool for discovering relevant web pages before potentially crawling them for complete content. When a task needs several related searches, pass them together in 'queries' to run them at once; results are merged and de-duplicated by URL.",
             "parameters": {
                 "type": "object",
                 "properties": {
@@ -45,20 +68,25 @@ class SandboxWebSearchTool(SandboxToolsBase):
                         "type": "string",
                         "description": "The search query to find relevant web pages. Be specific and include key terms to improve search accuracy. For best results, use natural language questions or keyword combinations that precisely describe what you're looking for."
                     },
+                    "queries": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": f"Several search queries to run concurrently in one call (up to {SEARCH_MAX_BATCH_QUERIES}). Use instead of 'query' when researching multiple angles of a topic."
+                    },
                     "num_results": {
                         "type": "integer",
                         "description": "The number of search results to return. Increase for more comprehensive research or decrease for focused, high-relevance results.",
                         "default": 20
                     }
-                },
-                "required": ["query"]
+                }
             }
         }
     })
     @xml_schema(
         tag_name="web-search",
         mappings=[
-            {"param_name": "query", "node_type": "attribute", "path": "."},
+            {"param_name": "query", "node_type": "attribute", "path": ".", "required": False},
+            {"param_name": "queries", "node_type": "attribute", "path": ".", "required": False},
             {"param_name": "num_results", "node_type": "attribute", "path": "."}
         ],
         example='''
@@ -76,20 +104,35 @@ class SandboxWebSearchTool(SandboxToolsBase):
         <parameter name="num_results">20</parameter>
         </invoke>
         </function_calls>
+        
+        <!-- Several related searches in one call -->
+        <function_calls>
+        <invoke name="web_search">
+        <parameter name="queries">["electric vehicle sales 2024 Europe", "electric vehicle sales 2024 China", "electric vehicle sales 2024 United States"]</parameter>
+        <parameter name="num_results">10</parameter>
+        </invoke>
+        </function_calls>
         '''
     )
     async def web_search(
         self, 
-        query: str,
-        num_results: int = 20
+        query: str = None,
+        num_results: int = 20,
+        queries: list = None
     ) -> ToolResult:
         """
         Search the web using the Tavily API to find relevant and up-to-date information.
+        
+        A list of queries runs concurrently and returns merged, URL de-duplicated results.
         """
         try:
+            query_list = self._parse_queries(query, queries)
+            
             # Ensure we have a valid query
-            if not query or not isinstance(query, str):
+            if not query_list:
                 return self.fail_response("A valid search query is required.")
+            if len(query_list) > SEARCH_MAX_BATCH_QUERIES:
+                return self.fail_response(f"Too many queries ({len(query_list)}). At most {SEARCH_MAX_BATCH_QUERIES} queries can be searched at once.")
             
             # Normalize num_results
             if num_results is None:
@@ -104,23 +147,22 @@ class SandboxWebSearchTool(SandboxToolsBase):
             else:
                 num_results = 20
 
-            # Execute the search with Tavily
-            logging.info(f"Executing web search for query: '{query}' with {num_results} results")
-            search_response = await self.tavily_client.search(
-                query=query,
-                max_results=num_results,
-                include_images=True,
-                include_answer="advanced",
-                search_depth="advanced",
-            )
+            if len(query_list) == 1:
+                search_response = await self._search(query_list[0], num_results)
+            else:
+                responses = await asyncio.gather(
+                    *(self._search(q, num_results) for q in query_list),
+                    return_exceptions=True
+                )
+                search_response = self._merge_search_responses(query_list, responses)
             
             # Check if we have actual results or an answer
             results = search_response.get('results', [])
-            answer = search_response.get('answer', '')
+            answer = search_response.get('answer', '') or "".join((search_response.get('answers') or {}).values())
             
             # Return the complete Tavily response 
             # This includes the query, answer, results, images and more
-            logging.info(f"Retrieved search results for query: '{query}' with answer and {len(results)} results")
+            logging.info(f"Retrieved search results for {query_list} with answer and {len(results)} results")
             
             # Consider search successful if we have either results OR an answer
             if len(results) > 0 or (answer and answer.strip()):
@@ -130,7 +172,7 @@ class SandboxWebSearchTool(SandboxToolsBase):
                 )
             else:
                 # No results or answer found
-                logging.warning(f"No search results or answer found for query: '{query}'")
+                logging.warning(f"No search results or answer found for {query_list}")
                 return ToolResult(
                     success=False,
                     output=json.dumps(search_response, ensure_ascii=False)
@@ -138,12 +180,131 @@ class SandboxWebSearchTool(SandboxToolsBase):
         
         except Exception as e:
             error_message = str(e)
-            logging.error(f"Error performing web search for '{query}': {error_message}")
+            logging.error(f"Error performing web search for '{query or queries}': {error_message}")
             simplified_message = f"Error performing web search: {error_message[:200]}"
             if len(error_message) > 200:
                 simplified_message += "..."
             return self.fail_response(simplified_message)
 
+    @staticmethod
+    def _parse_queries(query, queries) -> list:
+        """Collect the single query and/or batch queries into a de-duplicated list."""
+        if isinstance(queries, str):
+            try:
+                queries = json.loads(queries)
+            except json.JSONDecodeError:
+                queries = queries.split("\n")
+        if isinstance(queries, str):
+            queries = [queries]
+        
+        query_list = []
+        seen = set()
+        for q in ([query] if query else []) + list(queries or []):
+            if not isinstance(q, str) or not q.strip():
+                continue
+            normalized = SandboxWebSearchTool._normalize_query(q)
+            if normalized not in seen:
+                seen.add(normalized)
+                query_list.append(q.strip())
+        return query_list
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Case/whitespace/trailing-punctuation insensitive form of a query, used for caching."""
+        return " ".join(query.lower().split()).strip(" ?!.")
+
+    async def _search(self, query: str, num_results: int) -> dict:
+        """Run one Tavily search, served from the shared search cache when possible."""
+        cache_key = f"{SEARCH_CACHE_PREFIX}{hashlib.sha256(f'{self._normalize_query(query)}|{num_results}'.encode()).hexdigest()}"
+        
+        try:
+            cached = await redis.get(cache_key)
+            if cached:
+                logging.info(f"Search cache hit for query: '{query}'")
+                return json.loads(cached)
+        except Exception as e:
+            logging.warning(f"Search cache read failed: {str(e)}")
+        
+        # Execute the search with Tavily
+        logging.info(f"Executing web search for query: '{query}' with {num_results} results")
+        async with get_breaker("tavily").guard():
+            search_response = await self.tavily_client.search(
+                query=query,
+                max_results=num_results,
+                include_images=True,
+                include_answer="advanced",
+                search_depth="advanced",
+            )
+        
+        if search_response.get('results') or search_response.get('answer'):
+            await self._cache_search_response(cache_key, search_response)
+        return search_response
+
+    async def _cache_search_response(self, cache_key: str, search_response: dict):
+        """Store a search response and keep the number of cached searches bounded."""
+        try:
+            json_content = json.dumps(search_response, ensure_ascii=False)
+            if len(json_content) > SEARCH_CACHE_MAX_BYTES:
+                return
+            await redis.set(cache_key, json_content, ex=SEARCH_CACHE_TTL)
+            
+            # Index entries by insertion time and evict the oldest beyond the cap
+            redis_client = await redis.get_client()
+            await redis_client.zadd(SEARCH_CACHE_INDEX_KEY, {cache_key: datetime.datetime.now().timestamp()})
+            overflow = await redis_client.zcard(SEARCH_CACHE_INDEX_KEY) - SEARCH_CACHE_MAX_ENTRIES
+            if overflow > 0:
+                evicted = await redis_client.zpopmin(SEARCH_CACHE_INDEX_KEY, overflow)
+                if evicted:
+                    await redis_client.delete(*[key for key, _ in evicted])
+        except Exception as e:
+            logging.warning(f"Search cache write failed: {str(e)}")
+
+    @staticmethod
+    def _merge_search_responses(query_list: list, responses: list) -> dict:
+        """Merge several Tavily responses, de-duplicating results and images by URL."""
+        merged_results = {}
+        images = []
+        seen_images = set()
+        answers = {}
+        errors = {}
+        
+        for query, response in zip(query_list, responses):
+            if isinstance(response, BaseException):
+                logging.error(f"Error performing web search for '{query}': {str(response)}")
+                errors[query] = str(response)[:200]
+                continue
+            
+            if response.get('answer'):
+                answers[query] = response['answer']
+            
+            for result in response.get('results', []):
+                url = result.get('url')
+                if not url:
+                    continue
+                existing = merged_results.get(url)
+                if existing is None:
+                    merged_results[url] = {**result, "queries": [query]}
+                else:
+                    existing["queries"].append(query)
+                    if (result.get('score') or 0) > (existing.get('score') or 0):
+                        merged_results[url] = {**result, "queries": existing["queries"]}
+            
+            for image in response.get('images', []):
+                image_url = image.get('url') if isinstance(image, dict) else image
+                if image_url and image_url not in seen_images:
+                    seen_images.add(image_url)
+                    images.append(image)
+        
+        merged = {
+            "queries": query_list,
+            "answers": answers,
+            "results": sorted(merged_results.values(), key=lambda r: r.get('score') or 0, reverse=True),
+            "images": images
+        }
+        if errors:
+            merged["errors"] = errors
+        return merged
+
     @openapi_schema({
         "type": "function",
         "function": {
@@ -210,26 +371,16 @@ class SandboxWebSearchTool(SandboxToolsBase):
             
             logging.info(f"Processing {len(url_list)} URLs: {url_list}")
             
-            # Process each URL and collect results
-            results = []
-            for url in url_list:
-                try:
-                    # Add protocol if missing
-                    if not (url.startswith('http://') or url.startswith('https://')):
-                        url = 'https://' + url
-                        logging.info(f"Added https:// protocol to URL: {url}")
-                    
-                    # Scrape this URL
-                    result = await self._scrape_single_url(url)
-                    results.append(result)
-                    
-                except Exception as e:
-                    logging.error(f"Error processing URL {url}: {str(e)}")
-                    results.append({
-                        "url": url,
-                        "success": False,
-                        "error": str(e)
-                    })
+            # Add protocol if missing
+            url_list = [
+                url if url.startswith('http://') or url.startswith('https://') else 'https://' + url
+                for url in url_list
+            ]
+            
+            # Scrape all URLs concurrently (bounded), then write the results in one batch
+            semaphore = asyncio.Semaphore(SCRAPE_MAX_CONCURRENCY)
+            scraped = await asyncio.gather(*(self._scrape_single_url(url, semaphore) for url in url_list))
+            results = await self._save_scrape_results(scraped)
             
             # Summarize results
             successful = sum(1 for r in results if r.get("success", False))
@@ -264,48 +415,77 @@ class SandboxWebSearchTool(SandboxToolsBase):
             logging.error(f"Error in scrape_webpage: {error_message}")
             return self.fail_response(f"Error processing scrape request: {error_message[:200]}")
     
-    async def _scrape_single_url(self, url: str) -> dict:
+    @staticmethod
+    def _scrape_cache_key(url: str) -> str:
+        return f"{SCRAPE_CACHE_PREFIX}{hashlib.sha256(url.encode()).hexdigest()}"
+    
+    async def _get_cached_scrape(self, url: str):
+        try:
+            cached = await redis.get(self._scrape_cache_key(url))
+            return json.loads(cached) if cached else None
+        except Exception as e:
+            logging.warning(f"Scrape cache read failed for {url}: {str(e)}")
+            return None
+    
+    async def _set_cached_scrape(self, url: str, formatted_result: dict):
+        try:
+            json_content = json.dumps(formatted_result, ensure_ascii=False)
+            if len(json_content) > SCRAPE_CACHE_MAX_BYTES:
+                return
+            await redis.set(self._scrape_cache_key(url), json_content, ex=SCRAPE_CACHE_TTL)
+        except Exception as e:
+            logging.warning(f"Scrape cache write failed for {url}: {str(e)}")
+    
+    async def _scrape_single_url(self, url: str, semaphore: asyncio.Semaphore) -> dict:
         """
-        Helper function to scrape a single URL and return the result information.
+        Helper function to scrape a single URL (from cache or Firecrawl).
+        
+        Returns the result information plus the formatted page under "content";
+        writing it into the sandbox is left to _save_scrape_results.
         """
         logging.info(f"Scraping single URL: {url}")
         
         try:
+            cached_result = await self._get_cached_scrape(url)
+            if cached_result is not None:
+                logging.info(f"Scrape cache hit for {url}")
+                return {"url": url, "success": True, "cached": True, "content": cached_result}
+            
             # ---------- Firecrawl scrape endpoint ----------
-            logging.info(f"Sending request to Firecrawl for URL: {url}")
-            async with httpx.AsyncClient() as client:
-                headers = {
-                    "Authorization": f"Bearer {self.firecrawl_api_key}",
-                    "Content-Type": "application/json",
-                }
-                payload = {
-                    "url": url,
-                    "formats": ["markdown"]
-                }
-                
-                # Use longer timeout and retry logic for more reliability
-                max_retries = 3
-                timeout_seconds = 120
-                retry_count = 0
-                
-                while retry_count < max_retries:
+            client = get_shared_client("firecrawl")
+            headers = {
+                "Authorization": f"Bearer {self.firecrawl_api_key}",
+                "Content-Type": "application/json",
+            }
+            payload = {
+                "url": url,
+                "formats": ["markdown"]
+            }
+            
+            # Use longer timeout and retry logic for more reliability
+            retry_count = 0
+            
+            async with semaphore:
+                logging.info(f"Sending request to Firecrawl for URL: {url}")
+                while retry_count < SCRAPE_MAX_RETRIES:
                     try:
-                        logging.info(f"Sending request to Firecrawl (attempt {retry_count + 1}/{max_retries})")
-                        response = await client.post(
-                            f"{self.firecrawl_url}/v1/scrape",
-                            json=payload,
-                            headers=headers,
-                            timeout=timeout_seconds,
-                        )
-                        response.raise_for_status()
+                        logging.info(f"Sending request to Firecrawl (attempt {retry_count + 1}/{SCRAPE_MAX_RETRIES})")
+                        async with get_breaker("firecrawl").guard():
+                            response = await client.post(
+                                f"{self.firecrawl_url}/v1/scrape",
+                                json=payload,
+                                headers=headers,
+                                timeout=SCRAPE_TIMEOUT_SECONDS,
+                            )
+                            response.raise_for_status()
                         data = response.json()
                         logging.info(f"Successfully received response from Firecrawl for {url}")
                         break
                     except (httpx.ReadTimeout, httpx.ConnectTimeout, httpx.ReadError) as timeout_err:
                         retry_count += 1
-                        logging.warning(f"Request timed out (attempt {retry_count}/{max_retries}): {str(timeout_err)}")
-                        if retry_count >= max_retries:
-                            raise Exception(f"Request timed out after {max_retries} attempts with {timeout_seconds}s timeout")
+                        logging.warning(f"Request timed out (attempt {retry_count}/{SCRAPE_MAX_RETRIES}): {str(timeout_err)}")
+                        if retry_count >= SCRAPE_MAX_RETRIES:
+                            raise Exception(f"Request timed out after {SCRAPE_MAX_RETRIES} attempts with {SCRAPE_TIMEOUT_SECONDS}s timeout")
                         # Exponential backoff
                         logging.info(f"Waiting {2 ** retry_count}s before retry")
                         await asyncio.sleep(2 ** retry_count)
@@ -330,40 +510,9 @@ class SandboxWebSearchTool(SandboxToolsBase):
                 formatted_result["metadata"] = data["data"]["metadata"]
                 logging.info(f"Added metadata: {data['data']['metadata'].keys()}")
             
-            # Create a simple filename from the URL domain and date
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            await self._set_cached_scrape(url, formatted_result)
             
-            # Extract domain from URL for the filename
-            from urllib.parse import urlparse
-            parsed_url = urlparse(url)
-            domain = parsed_url.netloc.replace("www.", "")
-            
-            # Clean up domain for filename
-            domain = "".join([c if c.isalnum() else "_" for c in domain])
-            safe_filename = f"{timestamp}_{domain}.json"
-            
-            logging.info(f"Generated filename: {safe_filename}")
-            
-            # Save results to a file in the /workspace/scrape directory
-            scrape_dir = f"{self.workspace_path}/scrape"
-            self.sandbox.fs.create_folder(scrape_dir, "755")
-            
-            results_file_path = f"{scrape_dir}/{safe_filename}"
-            json_content = json.dumps(formatted_result, ensure_ascii=False, indent=2)
-            logging.info(f"Saving content to file: {results_file_path}, size: {len(json_content)} bytes")
-            
-            self.sandbox.fs.upload_file(
-                json_content.encode(),
-                results_file_path,
-            )
-            
-            return {
-                "url": url,
-                "success": True,
-                "title": title,
-                "file_path": results_file_path,
-                "content_length": len(markdown_content)
-            }
+            return {"url": url, "success": True, "cached": False, "content": formatted_result}
         
         except Exception as e:
             error_message = str(e)
@@ -375,6 +524,61 @@ class SandboxWebSearchTool(SandboxToolsBase):
                 "success": False,
                 "error": error_message
             }
+    
+    async def _save_scrape_results(self, scraped: list) -> list:
+        """
+        Write all successfully scraped pages into /workspace/scrape in a single batch
+        and return the per-URL result information.
+        """
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        scrape_dir = f"{self.workspace_path}/scrape"
+        
+        files = []
+        results = []
+        for item in scraped:
+            if not item.get("success", False):
+                results.append(item)
+                continue
+            
+            formatted_result = item["content"]
+            url = item["url"]
+            
+            # Create a simple filename from the URL domain and date; the URL hash keeps
+            # pages from the same domain scraped in the same second apart
+            domain = urlparse(url).netloc.replace("www.", "")
+            domain = "".join([c if c.isalnum() else "_" for c in domain])
+            url_hash = hashlib.sha256(url.encode()).hexdigest()[:8]
+            results_file_path = f"{scrape_dir}/{timestamp}_{domain}_{url_hash}.json"
+            
+            json_content = json.dumps(formatted_result, ensure_ascii=False, indent=2)
+            files.append((json_content.encode(), results_file_path))
+            results.append({
+                "url": url,
+                "success": True,
+                "title": formatted_result.get("title", ""),
+                "file_path": results_file_path,
+                "content_length": len(formatted_result.get("text", "")),
+                "cached": item.get("cached", False)
+            })
+        
+        if files:
+            def write_files():
+                self.sandbox.fs.create_folder(scrape_dir, "755")
+                for content, path in files:
+                    self.sandbox.fs.upload_file(content, path)
+            
+            logging.info(f"Saving {len(files)} scrape results to {scrape_dir}")
+            try:
+                # The sandbox filesystem client is blocking; do the whole batch off the event loop
+                await asyncio.to_thread(write_files)
+            except Exception as e:
+                logging.error(f"Error saving scrape results: {str(e)}")
+                results = [
+                    {"url": r["url"], "success": False, "error": f"Failed to save result: {str(e)}"} if r.get("success") else r
+                    for r in results
+                ]
+        
+        return results
 
 if __name__ == "__main__":
     async def test_web_search():
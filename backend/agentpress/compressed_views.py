@@ -0,0 +1,145 @@
+"""
+Persistent compressed views of thread messages.
+
+ThreadManager compresses long messages before every LLM call. Without memoization,
+every message is re-tokenized and re-truncated on every turn. This store keeps the
+results per message in Redis so later turns and runs reuse them:
+
+- per-message token counts, keyed by message_id + a hash of the content they were
+  computed for, and by model when counted with a model's tokenizer (conversation
+  totals are summed from those)
+- compressed/truncated contents, keyed by message_id + compression kind and length
+- the tightest compression threshold used per thread, so compression never
+  loosens again and messages that were already compressed keep identical bytes
+  (which keeps the provider's prompt cache prefix valid)
+
+Views are loaded in one pipelined round trip per turn and new ones are written
+back in another. If Redis is unavailable, everything is computed locally as before.
+"""
+
+import hashlib
+import json
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from services import redis
+from utils.logger import logger
+
+VIEW_KEY_PREFIX = "msg_views:"
+THRESHOLD_KEY_PREFIX = "compression_threshold:"
+VIEW_TTL = 3600 * 24 * 7
+MAX_LOCAL_TOKEN_COUNTS = 1000  # memo for messages without an id (system prompt, temporary messages)
+
+
+def _content_hash(content: Any) -> str:
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class CompressedViewStore:
+    """Redis-backed memo of per-message token counts and compressed contents."""
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Any]] = {}  # message_id -> field -> value
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        self._loaded: Set[str] = set()
+        self._thresholds: Dict[str, int] = {}
+        self._dirty_thresholds: Set[str] = set()
+        self._local_token_counts: Dict[str, int] = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    async def load(self, thread_id: str, messages: List[Dict[str, Any]]):
+        """Fetch stored views for messages not seen yet (and the thread's threshold) in one round trip."""
+        message_ids = [
+            msg["message_id"] for msg in messages
+            if msg.get("message_id") and msg["message_id"] not in self._loaded
+        ]
+        load_threshold = thread_id not in self._thresholds
+        if not message_ids and not load_threshold:
+            return
+
+        try:
+            redis_client = await redis.get_client()
+            pipe = redis_client.pipeline(transaction=False)
+            for message_id in message_ids:
+                pipe.hgetall(f"{VIEW_KEY_PREFIX}{message_id}")
+            if load_threshold:
+                pipe.get(f"{THRESHOLD_KEY_PREFIX}{thread_id}")
+            results = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to load compressed message views: {e}")
+            results = [{} for _ in message_ids] + ([None] if load_threshold else [])
+
+        for message_id, fields in zip(message_ids, results):
+            entry = self._entries.setdefault(message_id, {})
+            for field, value in (fields or {}).items():
+                try:
+                    entry.setdefault(field, json.loads(value))
+                except (TypeError, ValueError):
+                    continue
+            self._loaded.add(message_id)
+
+        if load_threshold:
+            stored = results[-1]
+            if stored and thread_id not in self._thresholds:
+                try:
+                    self._thresholds[thread_id] = int(stored)
+                except ValueError:
+                    pass
+
+    async def flush(self):
+        """Persist views and thresholds computed since the last flush."""
+        if not self._dirty and not self._dirty_thresholds:
+            return
+        dirty, self._dirty = self._dirty, {}
+        dirty_thresholds, self._dirty_thresholds = self._dirty_thresholds, set()
+        try:
+            redis_client = await redis.get_client()
+            pipe = redis_client.pipeline(transaction=False)
+            for message_id, fields in dirty.items():
+                key = f"{VIEW_KEY_PREFIX}{message_id}"
+                pipe.hset(key, mapping={field: json.dumps(value, default=str) for field, value in fields.items()})
+                pipe.expire(key, VIEW_TTL)
+            for thread_id in dirty_thresholds:
+                pipe.set(f"{THRESHOLD_KEY_PREFIX}{thread_id}", self._thresholds[thread_id], ex=VIEW_TTL)
+            await pipe.execute()
+            logger.debug(f"Stored compressed views for {len(dirty)} messages")
+        except Exception as e:
+            logger.warning(f"Failed to store compressed message views: {e}")
+
+    def _memo(self, message_id: str, field: str, compute: Callable[[], Any]) -> Any:
+        entry = self._entries.setdefault(message_id, {})
+        if field in entry:
+            self.stats["hits"] += 1
+            return entry[field]
+        self.stats["misses"] += 1
+        value = compute()
+        entry[field] = value
+        self._dirty.setdefault(message_id, {})[field] = value
+        return value
+
+    def token_count(self, msg: Dict[str, Any], compute: Callable[[], int], model: Optional[str] = None) -> int:
+        """Token count of the message's current content (with `model`'s tokenizer, if given)."""
+        content_hash = _content_hash(msg.get("content"))
+        field = f"tokens:{model}:{content_hash}" if model else f"tokens:{content_hash}"
+        message_id = msg.get("message_id")
+        if message_id:
+            return self._memo(message_id, field, compute)
+
+        # Role and tool calls are part of the count too for messages without an id
+        local_key = f"{field}:{_content_hash({k: v for k, v in msg.items() if k != 'content'})}"
+        if local_key not in self._local_token_counts:
+            if len(self._local_token_counts) >= MAX_LOCAL_TOKEN_COUNTS:
+                self._local_token_counts.clear()
+            self._local_token_counts[local_key] = compute()
+        return self._local_token_counts[local_key]
+
+    def view(self, message_id: str, kind: str, max_length: int, compute: Callable[[], Any]) -> Any:
+        """Compressed content of a message for a compression kind and length."""
+        return self._memo(message_id, f"view:{kind}:{max_length}", compute)
+
+    def get_threshold(self, thread_id: str) -> Optional[int]:
+        return self._thresholds.get(thread_id)
+
+    def set_threshold(self, thread_id: str, threshold: int):
+        if self._thresholds.get(thread_id) != threshold:
+            self._thresholds[thread_id] = threshold
+            self._dirty_thresholds.add(thread_id)
@@ -5,30 +5,83 @@ This module handles token counting and thread summarization to prevent
 reaching the context window limitations of LLM models.
 """
 
+import asyncio
 import json
 from typing import List, Dict, Any, Optional
 
 from litellm import token_counter, completion_cost
+from services import redis
 from services.supabase import DBConnection
 from services.llm import make_llm_api_call
+from services.llm_scheduler import PRIORITY_LOW
 from utils.logger import logger
 
 # Constants for token management
 DEFAULT_TOKEN_THRESHOLD = 120000  # 80k tokens threshold for summarization
 SUMMARY_TARGET_TOKENS = 10000    # Target ~10k tokens for the summary message
 RESERVE_TOKENS = 5000            # Reserve tokens for new messages
+SUMMARY_CACHE_TTL = 3600 * 24    # Summaries of identical message ranges are reused
+SUMMARY_SOFT_THRESHOLD = 80000   # Start a background summary once a thread passes this
+KEEP_RECENT_MESSAGES = 10        # Newest messages always stay verbatim after the summary
+SUMMARY_LOCK_TTL = 600           # One summarization per thread at a time, across workers
+
+
+def _parse_json(value: Any) -> Any:
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            pass
+    return value
+
+
+def splice_latest_summary(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Replace the messages covered by the latest summary with the summary itself.
+
+    Rolling summaries record the last message they cover in metadata.last_message_id,
+    so messages added while the summary was being generated are kept. Older summaries
+    without it cover everything before them.
+
+    Args:
+        rows: Message rows ordered by created_at (with message_id, type and metadata)
+
+    Returns:
+        The latest summary followed by the messages after it, or the rows unchanged
+    """
+    summary_index = None
+    for i in range(len(rows) - 1, -1, -1):
+        if rows[i].get('type') == 'summary':
+            summary_index = i
+            break
+    if summary_index is None:
+        return rows
+
+    summary = rows[summary_index]
+    last_message_id = (_parse_json(summary.get('metadata')) or {}).get('last_message_id')
+    cut = summary_index
+    if last_message_id:
+        for i, row in enumerate(rows):
+            if row.get('message_id') == last_message_id:
+                cut = i
+                break
+
+    return [summary] + [row for row in rows[cut + 1:] if row.get('type') != 'summary']
+
 
 class ContextManager:
     """Manages thread context including token counting and summarization."""
     
-    def __init__(self, token_threshold: int = DEFAULT_TOKEN_THRESHOLD):
+    def __init__(self, token_threshold: int = DEFAULT_TOKEN_THRESHOLD, soft_token_threshold: int = SUMMARY_SOFT_THRESHOLD):
         """Initialize the ContextManager.
         
         Args:
             token_threshold: Token count threshold to trigger summarization
+            soft_token_threshold: Token count at which a background summary is started
         """
         self.db = DBConnection()
         self.token_threshold = token_threshold
+        self.soft_token_threshold = soft_token_threshold
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
     
     async def get_thread_token_count(self, thread_id: str) -> int:
         """Get the current token count for a thread using LiteLLM.
@@ -60,12 +113,34 @@ class ContextManager:
             logger.error(f"Error getting token count: {str(e)}")
             return 0
     
+    async def _get_rows_since_summary(self, thread_id: str) -> List[Dict[str, Any]]:
+        """Get the thread's LLM message rows, starting with the latest summary if there is one."""
+        client = await self.db.client
+        messages_result = await client.table('messages').select('message_id, type, content, metadata') \
+            .eq('thread_id', thread_id) \
+            .eq('is_llm_message', True) \
+            .order('created_at') \
+            .execute()
+        return splice_latest_summary(messages_result.data or [])
+
+    @staticmethod
+    def _to_llm_message(row: Dict[str, Any]) -> Any:
+        # Parse content if it's a string
+        content = _parse_json(row['content'])
+
+        # Ensure we have the proper format for the LLM
+        if isinstance(content, dict) and 'role' not in content and 'type' in row:
+            # Convert message type to role if needed
+            role = row['type']
+            if role == 'assistant' or role == 'user' or role == 'system' or role == 'tool':
+                content = {'role': role, 'content': content}
+        return content
+
     async def get_messages_for_summarization(self, thread_id: str) -> List[Dict[str, Any]]:
         """Get all LLM messages from the thread that need to be summarized.
         
-        This gets messages after the most recent summary or all messages if
-        no summary exists. Unlike get_llm_messages, this includes ALL messages 
-        since the last summary, even if we're generating a new summary.
+        This gets messages not yet covered by the most recent summary, or all
+        messages if no summary exists. The summary itself is not included.
         
         Args:
             thread_id: ID of the thread to get messages from
@@ -74,63 +149,11 @@ class ContextManager:
             List of message objects to summarize
         """
         logger.debug(f"Getting messages for summarization for thread {thread_id}")
-        client = await self.db.client
         
         try:
-            # Find the most recent summary message
-            summary_result = await client.table('messages').select('created_at') \
-                .eq('thread_id', thread_id) \
-                .eq('type', 'summary') \
-                .eq('is_llm_message', True) \
-                .order('created_at', desc=True) \
-                .limit(1) \
-                .execute()
-            
-            # Get messages after the most recent summary or all messages if no summary
-            if summary_result.data and len(summary_result.data) > 0:
-                last_summary_time = summary_result.data[0]['created_at']
-                logger.debug(f"Found last summary at {last_summary_time}")
-                
-                # Get all messages after the summary, but NOT including the summary itself
-                messages_result = await client.table('messages').select('*') \
-                    .eq('thread_id', thread_id) \
-                    .eq('is_llm_message', True) \
-                    .gt('created_at', last_summary_time) \
-                    .order('created_at') \
-                    .execute()
-            else:
-                logger.debug("No previous summary found, getting all messages")
-                # Get all messages
-                messages_result = await client.table('messages').select('*') \
-                    .eq('thread_id', thread_id) \
-                    .eq('is_llm_message', True) \
-                    .order('created_at') \
-                    .execute()
-            
-            # Parse the message content if needed
-            messages = []
-            for msg in messages_result.data:
-                # Skip existing summary messages - we don't want to summarize summaries
-                if msg.get('type') == 'summary':
-                    logger.debug(f"Skipping summary message from {msg.get('created_at')}")
-                    continue
-                    
-                # Parse content if it's a string
-                content = msg['content']
-                if isinstance(content, str):
-                    try:
-                        content = json.loads(content)
-                    except json.JSONDecodeError:
-                        pass  # Keep as string if not valid JSON
-                
-                # Ensure we have the proper format for the LLM
-                if 'role' not in content and 'type' in msg:
-                    # Convert message type to role if needed
-                    role = msg['type']
-                    if role == 'assistant' or role == 'user' or role == 'system' or role == 'tool':
-                        content = {'role': role, 'content': content}
-                
-                messages.append(content)
+            rows = await self._get_rows_since_summary(thread_id)
+            # Skip existing summary messages - we don't want to summarize summaries
+            messages = [self._to_llm_message(row) for row in rows if row.get('type') != 'summary']
             
             logger.info(f"Got {len(messages)} messages to summarize for thread {thread_id}")
             return messages
@@ -193,7 +216,9 @@ THE CONVERSATION HISTORY TO SUMMARIZE IS AS FOLLOWS:
                 messages=[system_message, {"role": "user", "content": "PLEASE PROVIDE THE SUMMARY NOW."}],
                 temperature=0,
                 max_tokens=SUMMARY_TARGET_TOKENS,
-                stream=False
+                stream=False,
+                priority=PRIORITY_LOW,
+                cache_ttl=SUMMARY_CACHE_TTL
             )
             
             if response and hasattr(response, 'choices') and response.choices:
@@ -233,6 +258,126 @@ The above is a summary of the conversation history. The conversation continues b
             logger.error(f"Error creating summary: {str(e)}", exc_info=True)
             return None
         
+    async def create_rolling_summary(
+        self,
+        thread_id: str,
+        add_message_callback,
+        model: str = "gpt-4o-mini",
+        token_count: Optional[int] = None
+    ) -> bool:
+        """Fold the previous summary and all but the newest messages into a new summary message.
+
+        The newest KEEP_RECENT_MESSAGES messages stay verbatim. The cut is moved back
+        so the kept messages start at a user or assistant message, never in the middle
+        of a tool call and its results.
+
+        Args:
+            thread_id: ID of the thread to summarize
+            add_message_callback: Callback to add the summary message to the thread
+            model: LLM model to use for summarization
+            token_count: Thread token count, stored in the summary's metadata
+
+        Returns:
+            True if a summary was added, False otherwise
+        """
+        rows = await self._get_rows_since_summary(thread_id)
+        previous_summary = rows[0] if rows and rows[0].get('type') == 'summary' else None
+        if previous_summary:
+            rows = rows[1:]
+
+        cut = len(rows) - KEEP_RECENT_MESSAGES
+        while cut > 0:
+            message = self._to_llm_message(rows[cut])
+            if isinstance(message, dict) and message.get('role') in ('user', 'assistant'):
+                break
+            cut -= 1
+
+        # If there are too few messages, don't summarize
+        if cut < 3:
+            logger.info(f"Thread {thread_id} has too few messages ({cut}) to summarize")
+            return False
+
+        messages = [self._to_llm_message(row) for row in rows[:cut]]
+        if previous_summary:
+            messages.insert(0, self._to_llm_message(previous_summary))
+
+        # Create summary
+        summary = await self.create_summary(thread_id, messages, model)
+        if not summary:
+            logger.error(f"Failed to create summary for thread {thread_id}")
+            return False
+
+        # Add summary message to thread
+        await add_message_callback(
+            thread_id=thread_id,
+            type="summary",
+            content=summary,
+            is_llm_message=True,
+            metadata={
+                "token_count": token_count,
+                "last_message_id": rows[cut - 1]['message_id'],
+                "summarized_messages": cut
+            }
+        )
+
+        logger.info(f"Successfully added summary of {cut} messages to thread {thread_id}")
+        return True
+
+    def schedule_summarization(
+        self,
+        thread_id: str,
+        token_count: int,
+        add_message_callback,
+        model: str = "gpt-4o-mini"
+    ) -> bool:
+        """Start a rolling summary in the background once the thread passes the soft threshold.
+
+        Never waits on the LLM: the summary is picked up by get_llm_messages on the
+        first turn after it has been stored.
+
+        Args:
+            thread_id: ID of the thread
+            token_count: Current token count of the thread
+            add_message_callback: Callback to add the summary message to the thread
+            model: LLM model to use for summarization
+
+        Returns:
+            True if a background summarization was started
+        """
+        if token_count < self.soft_token_threshold:
+            return False
+
+        task = self._summary_tasks.get(thread_id)
+        if task and not task.done():
+            logger.debug(f"Summarization already running for thread {thread_id}")
+            return False
+
+        logger.info(f"Thread {thread_id} passed the soft token threshold ({token_count} >= {self.soft_token_threshold}), summarizing in the background")
+        task = asyncio.create_task(self._summarize_in_background(thread_id, token_count, add_message_callback, model))
+        task.add_done_callback(lambda _: self._summary_tasks.pop(thread_id, None))
+        self._summary_tasks[thread_id] = task
+        return True
+
+    async def _summarize_in_background(self, thread_id: str, token_count: int, add_message_callback, model: str):
+        lock_key = f"summary_lock:{thread_id}"
+        try:
+            if not await redis.set(lock_key, "1", ex=SUMMARY_LOCK_TTL, nx=True):
+                logger.debug(f"Thread {thread_id} is already being summarized by another worker")
+                return
+        except Exception as e:
+            logger.warning(f"Could not acquire summary lock for thread {thread_id}, skipping summarization: {e}")
+            return
+
+        try:
+            await self.create_rolling_summary(thread_id, add_message_callback, model, token_count)
+        except Exception as e:
+            logger.error(f"Error in background summarization for thread {thread_id}: {str(e)}", exc_info=True)
+        finally:
+            try:
+                await redis.delete(lock_key)
+            except Exception as e:
+                logger.warning(f"Failed to release summary lock for thread {thread_id}: {e}")
+
     async def check_and_summarize_if_needed(
         self, 
         thread_id: str, 
@@ -266,33 +411,8 @@ The above is a summary of the conversation history. The conversation continues b
             else:
                 logger.info(f"Thread {thread_id} exceeds token threshold ({token_count} >= {self.token_threshold}), summarizing...")
             
-            # Get messages to summarize
-            messages = await self.get_messages_for_summarization(thread_id)
-            
-            # If there are too few messages, don't summarize
-            if len(messages) < 3:
-                logger.info(f"Thread {thread_id} has too few messages ({len(messages)}) to summarize")
-                return False
-            
-            # Create summary
-            summary = await self.create_summary(thread_id, messages, model)
-            
-            if summary:
-                # Add summary message to thread
-                await add_message_callback(
-                    thread_id=thread_id,
-                    type="summary",
-                    content=summary,
-                    is_llm_message=True,
-                    metadata={"token_count": token_count}
-                )
-                
-                logger.info(f"Successfully added summary to thread {thread_id}")
-                return True
-            else:
-                logger.error(f"Failed to create summary for thread {thread_id}")
-                return False
+            return await self.create_rolling_summary(thread_id, add_message_callback, model, token_count)
                 
         except Exception as e:
             logger.error(f"Error in check_and_summarize_if_needed: {str(e)}", exc_info=True)
-            return False 
\ No newline at end of file
+            return False
@@ -0,0 +1,93 @@
+"""
+Write-behind persistence for status messages.
+
+Status messages (thread_run_start, assistant_response_start, tool_started,
+tool_completed/failed/error, finish) are only shown in the UI; nothing reads them
+back during a run. Awaiting an insert for each one put a database round trip
+into the token stream.
+
+The writer gives each of them a client-side message_id, returns the message
+right away for yielding, and inserts queued messages in batches in the
+background.
+
+Ordering: batches are inserted one at a time in queue order. Every synchronous
+write (ThreadManager.add_message) first flushes the queue. So every status
+message is stored before any message that was added after it, and all of them
+are stored once the run's synchronous thread_run_end message is written.
+
+created_at is left to the database, like for synchronously written messages, so
+ordering by created_at matches insert order regardless of clock skew between the
+worker and the database. Only the yielded copy carries a worker timestamp, for
+display; it is not the stored value.
+"""
+
+import asyncio
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from services.supabase import DBConnection
+from utils.logger import logger
+
+FLUSH_DELAY = 0.25  # Seconds queued messages wait to be batched with later ones
+MAX_BATCH_SIZE = 50
+
+
+class MessageWriter:
+    """Queues messages and inserts them in ordered batches in the background."""
+
+    def __init__(self, db: DBConnection):
+        self.db = db
+        self._queue: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        self._delayed_flush: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def add_deferred(
+        self,
+        thread_id: str,
+        type: str,
+        content: Any,
+        is_llm_message: bool = False,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Queue a message for insertion and return it as it will be stored."""
+        message = {
+            'message_id': str(uuid.uuid4()),
+            'thread_id': thread_id,
+            'type': type,
+            'content': content,
+            'is_llm_message': is_llm_message,
+            'metadata': metadata or {},
+        }
+        self._queue.append(message)
+        if len(self._queue) >= MAX_BATCH_SIZE:
+            self._start(self.flush())
+        elif not self._delayed_flush or self._delayed_flush.done():
+            self._delayed_flush = self._start(self._flush_after_delay())
+        now = datetime.now(timezone.utc).isoformat()
+        return {**message, 'created_at': now, 'updated_at': now}
+
+    def _start(self, coro) -> asyncio.Task:
+        # Keep a reference so the task isn't garbage collected before it finishes
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_after_delay(self):
+        await asyncio.sleep(FLUSH_DELAY)
+        await self.flush()
+
+    async def flush(self):
+        """Insert all queued messages, in the order they were queued."""
+        async with self._flush_lock:
+            while self._queue:
+                batch, self._queue = self._queue[:MAX_BATCH_SIZE], self._queue[MAX_BATCH_SIZE:]
+                try:
+                    client = await self.db.client
+                    await client.table('messages').insert(batch, returning='minimal').execute()
+                    logger.debug(f"Stored {len(batch)} queued messages")
+                except Exception as e:
+                    # Status messages are informational; a failed batch must not fail the run
+                    logger.error(f"Failed to store {len(batch)} queued messages: {str(e)}", exc_info=True)
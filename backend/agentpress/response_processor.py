@@ -19,8 +19,12 @@ from utils.logger import logger
 from agentpress.tool import ToolResult
 from agentpress.tool_registry import ToolRegistry
 from agentpress.xml_tool_parser import XMLToolParser
+from agentpress.tool_scheduler import ToolScheduler
 from langfuse.client import StatefulTraceClient
 from services.langfuse import langfuse
+from services.prompt_cache import extract_cache_usage, record_cache_usage
+from utils import worker_limits
+from services import tool_output_store
 from agentpress.utils.json_helpers import (
     ensure_dict, ensure_list, safe_json_parse, 
     to_json_string, format_for_yield
@@ -86,16 +90,21 @@ class ProcessorConfig:
 class ResponseProcessor:
     """Processes LLM responses, extracting and executing tool calls."""
     
-    def __init__(self, tool_registry: ToolRegistry, add_message_callback: Callable, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None):
+    def __init__(self, tool_registry: ToolRegistry, add_message_callback: Callable, trace: Optional[StatefulTraceClient] = None, is_agent_builder: bool = False, target_agent_id: Optional[str] = None, add_status_message_callback: Optional[Callable] = None):
         """Initialize the ResponseProcessor.
         
         Args:
             tool_registry: Registry of available tools
             add_message_callback: Callback function to add messages to the thread.
                 MUST return the full saved message object (dict) or None.
+            add_status_message_callback: Callback for progress status messages that may be
+                persisted in the background. Same contract as add_message_callback;
+                defaults to it.
         """
         self.tool_registry = tool_registry
         self.add_message = add_message_callback
+        self.add_status_message = add_status_message_callback or add_message_callback
+        self.tool_scheduler = ToolScheduler(tool_registry, self._execute_tool)
         self.trace = trace
         if not self.trace:
             self.trace = langfuse.trace(name="anonymous:response_processor")
@@ -169,14 +178,14 @@ class ResponseProcessor:
         try:
             # --- Save and Yield Start Events ---
             start_content = {"status_type": "thread_run_start", "thread_run_id": thread_run_id}
-            start_msg_obj = await self.add_message(
+            start_msg_obj = await self.add_status_message(
                 thread_id=thread_id, type="status", content=start_content, 
                 is_llm_message=False, metadata={"thread_run_id": thread_run_id}
             )
             if start_msg_obj: yield format_for_yield(start_msg_obj)
 
             assist_start_content = {"status_type": "assistant_response_start"}
-            assist_start_msg_obj = await self.add_message(
+            assist_start_msg_obj = await self.add_status_message(
                 thread_id=thread_id, type="status", content=assist_start_content, 
                 is_llm_message=False, metadata={"thread_run_id": thread_run_id}
             )
@@ -205,6 +214,8 @@ class ResponseProcessor:
                         streaming_metadata["usage"]["completion_tokens"] = chunk.usage.completion_tokens
                     if hasattr(chunk.usage, 'total_tokens') and chunk.usage.total_tokens is not None:
                         streaming_metadata["usage"]["total_tokens"] = chunk.usage.total_tokens
+                    # Prompt cache reads/writes, for measuring the cache hit rate per turn
+                    streaming_metadata["usage"].update(extract_cache_usage(chunk.usage))
 
                 if hasattr(chunk, 'choices') and chunk.choices and hasattr(chunk.choices[0], 'finish_reason') and chunk.choices[0].finish_reason:
                     finish_reason = chunk.choices[0].finish_reason
@@ -266,7 +277,7 @@ class ResponseProcessor:
                                         if started_msg_obj: yield format_for_yield(started_msg_obj)
                                         yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                        execution_task = asyncio.create_task(self._execute_tool(tool_call))
+                                        execution_task = self.tool_scheduler.submit(tool_call)
                                         pending_tool_executions.append({
                                             "task": execution_task, "tool_call": tool_call,
                                             "tool_index": tool_index, "context": context
@@ -336,7 +347,7 @@ class ResponseProcessor:
                                 if started_msg_obj: yield format_for_yield(started_msg_obj)
                                 yielded_tool_indices.add(tool_index) # Mark status as yielded
 
-                                execution_task = asyncio.create_task(self._execute_tool(tool_call_data))
+                                execution_task = self.tool_scheduler.submit(tool_call_data)
                                 pending_tool_executions.append({
                                     "task": execution_task, "tool_call": tool_call_data,
                                     "tool_index": tool_index, "context": context
@@ -384,6 +395,8 @@ class ResponseProcessor:
                     self.trace.event(name="failed_to_calculate_usage", level="WARNING", status_message=(f"Failed to calculate usage: {str(e)}"))
 
 
+            record_cache_usage(streaming_metadata.get("model") or llm_model, streaming_metadata["usage"], thread_id)
+
             # Wait for pending tool executions from streaming phase
             tool_results_buffer = [] # Stores (tool_call, result, tool_index, context)
             if pending_tool_executions:
@@ -457,7 +470,7 @@ class ResponseProcessor:
             # Save and yield finish status if limit was reached
             if finish_reason == "xml_tool_limit_reached":
                 finish_content = {"status_type": "finish", "finish_reason": "xml_tool_limit_reached"}
-                finish_msg_obj = await self.add_message(
+                finish_msg_obj = await self.add_status_message(
                     thread_id=thread_id, type="status", content=finish_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                 )
@@ -644,7 +657,7 @@ class ResponseProcessor:
             # --- Final Finish Status ---
             if finish_reason and finish_reason != "xml_tool_limit_reached":
                 finish_content = {"status_type": "finish", "finish_reason": finish_reason}
-                finish_msg_obj = await self.add_message(
+                finish_msg_obj = await self.add_status_message(
                     thread_id=thread_id, type="status", content=finish_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                 )
@@ -660,7 +673,7 @@ class ResponseProcessor:
                 
                 # Save and yield termination status
                 finish_content = {"status_type": "finish", "finish_reason": "agent_terminated"}
-                finish_msg_obj = await self.add_message(
+                finish_msg_obj = await self.add_status_message(
                     thread_id=thread_id, type="status", content=finish_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                 )
@@ -828,12 +841,20 @@ class ResponseProcessor:
         try:
             # Save and Yield thread_run_start status message
             start_content = {"status_type": "thread_run_start", "thread_run_id": thread_run_id}
-            start_msg_obj = await self.add_message(
+            start_msg_obj = await self.add_status_message(
                 thread_id=thread_id, type="status", content=start_content,
                 is_llm_message=False, metadata={"thread_run_id": thread_run_id}
             )
             if start_msg_obj: yield format_for_yield(start_msg_obj)
 
+            usage = getattr(llm_response, 'usage', None)
+            if usage is not None:
+                record_cache_usage(
+                    llm_model,
+                    {"prompt_tokens": getattr(usage, 'prompt_tokens', 0), **extract_cache_usage(usage)},
+                    thread_id
+                )
+
             # Extract finish_reason, content, tool calls
             if hasattr(llm_response, 'choices') and llm_response.choices:
                  if hasattr(llm_response.choices[0], 'finish_reason'):
@@ -944,7 +965,7 @@ class ResponseProcessor:
             # --- Save and Yield Final Status ---
             if finish_reason:
                 finish_content = {"status_type": "finish", "finish_reason": finish_reason}
-                finish_msg_obj = await self.add_message(
+                finish_msg_obj = await self.add_status_message(
                     thread_id=thread_id, type="status", content=finish_content, 
                     is_llm_message=False, metadata={"thread_run_id": thread_run_id}
                 )
@@ -1341,7 +1362,11 @@ class ResponseProcessor:
                 return ToolResult(success=False, output=f"Tool function '{function_name}' not found")
             
             logger.debug(f"Found tool function for '{function_name}', executing...")
-            result = await tool_fn(**arguments)
+            if getattr(getattr(tool_fn, '__self__', None), 'uses_sandbox', False):
+                async with worker_limits.sandbox_slot():
+                    result = await tool_fn(**arguments)
+            else:
+                result = await tool_fn(**arguments)
             logger.info(f"Tool execution complete: {function_name} -> {result}")
             span.end(status_message="tool_executed", output=result)
             return result
@@ -1364,7 +1389,7 @@ class ResponseProcessor:
             tool_calls: List of tool calls to execute
             execution_strategy: Strategy for executing tools:
                 - "sequential": Execute tools one after another, waiting for each to complete
-                - "parallel": Execute all tools simultaneously for better performance 
+                - "parallel": Execute tools concurrently, within the tool scheduler's limits
                 
         Returns:
             List of tuples containing the original tool call and its result
@@ -1406,7 +1431,7 @@ class ResponseProcessor:
                 logger.debug(f"Executing tool {index+1}/{len(tool_calls)}: {tool_name}")
                 
                 try:
-                    result = await self._execute_tool(tool_call)
+                    result = await self.tool_scheduler.submit(tool_call)
                     results.append((tool_call, result))
                     logger.debug(f"Completed tool {tool_name} with success={result.success}")
                     
@@ -1441,8 +1466,8 @@ class ResponseProcessor:
     async def _execute_tools_in_parallel(self, tool_calls: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], ToolResult]]:
         """Execute tool calls in parallel and return results.
         
-        This method executes all tool calls simultaneously using asyncio.gather, which
-        can significantly improve performance when executing multiple independent tools.
+        Calls run concurrently through the tool scheduler, which bounds how many run at
+        once and keeps conflicting calls (e.g. edits of the same file) in order.
         
         Args:
             tool_calls: List of tool calls to execute
@@ -1458,8 +1483,8 @@ class ResponseProcessor:
             logger.info(f"Executing {len(tool_calls)} tools in parallel: {tool_names}")
             self.trace.event(name="executing_tools_in_parallel", level="DEFAULT", status_message=(f"Executing {len(tool_calls)} tools in parallel: {tool_names}"))
             
-            # Create tasks for all tool calls
-            tasks = [self._execute_tool(tool_call) for tool_call in tool_calls]
+            # Schedule all tool calls, in the order the model made them
+            tasks = [self.tool_scheduler.submit(tool_call) for tool_call in tool_calls]
             
             # Execute all tasks concurrently with error handling
             results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -1528,6 +1553,19 @@ class ResponseProcessor:
                 logger.info("Adding parsing_details to tool result metadata")
                 self.trace.event(name="adding_parsing_details_to_tool_result_metadata", level="DEFAULT", status_message=(f"Adding parsing_details to tool result metadata"), metadata={"parsing_details": parsing_details})
             # ---
+
+            # Large outputs go to object storage; the message keeps a preview and a reference
+            message_id = None
+            if isinstance(result, ToolResult):
+                output_text = result.output if isinstance(result.output, str) else json.dumps(result.output, default=str)
+                if tool_output_store.should_offload(output_text, tool_call.get("function_name")):
+                    offload_id = str(uuid.uuid4())
+                    try:
+                        metadata["output_ref"] = await tool_output_store.offload_output(thread_id, offload_id, output_text)
+                        result = ToolResult(success=result.success, output=tool_output_store.build_preview(output_text, offload_id))
+                        message_id = offload_id
+                    except Exception as e:
+                        logger.warning(f"Failed to offload tool output, storing it inline: {e}")
             
             # Check if this is a native function call (has id field)
             if "id" in tool_call:
@@ -1570,7 +1608,8 @@ class ResponseProcessor:
                     type="tool",  # Special type for tool responses
                     content=tool_message,
                     is_llm_message=True,
-                    metadata=metadata
+                    metadata=metadata,
+                    message_id=message_id
                 )
                 return message_obj # Return the full message object
             
@@ -1615,7 +1654,8 @@ class ResponseProcessor:
                     type="tool",
                     content=simple_message,
                     is_llm_message=True,
-                    metadata=metadata
+                    metadata=metadata,
+                    message_id=message_id
                 )
                 return message_obj
             
@@ -1637,7 +1677,8 @@ class ResponseProcessor:
                 type="tool",
                 content=result_message,
                 is_llm_message=True,
-                metadata=metadata
+                metadata=metadata,
+                message_id=message_id
             )
             return message_obj # Return the full message object
         except Exception as e:
@@ -1805,7 +1846,7 @@ class ResponseProcessor:
             "tool_call_id": context.tool_call.get("id") # Include tool_call ID if native
         }
         metadata = {"thread_run_id": thread_run_id}
-        saved_message_obj = await self.add_message(
+        saved_message_obj = await self.add_status_message(
             thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata
         )
         return saved_message_obj # Return the full object (or None if saving failed)
@@ -1826,6 +1867,9 @@ class ResponseProcessor:
             "message": message_text, "tool_index": context.tool_index,
             "tool_call_id": context.tool_call.get("id")
         }
+        timing = getattr(context.result, "timing", None)
+        if timing:
+            content["timing"] = timing
         metadata = {"thread_run_id": thread_run_id}
         # Add the *actual* tool result message ID to the metadata if available and successful
         if context.result.success and tool_message_id:
@@ -1838,7 +1882,7 @@ class ResponseProcessor:
             self.trace.event(name="marking_tool_status_for_termination", level="DEFAULT", status_message=(f"Marking tool status for '{context.function_name}' with termination signal."))
         # <<< END ADDED >>>
 
-        saved_message_obj = await self.add_message(
+        saved_message_obj = await self.add_status_message(
             thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata
         )
         return saved_message_obj
@@ -1854,9 +1898,12 @@ class ResponseProcessor:
             "tool_index": context.tool_index,
             "tool_call_id": context.tool_call.get("id")
         }
+        timing = getattr(context.result, "timing", None)
+        if timing:
+            content["timing"] = timing
         metadata = {"thread_run_id": thread_run_id}
         # Save the status message with is_llm_message=False
-        saved_message_obj = await self.add_message(
+        saved_message_obj = await self.add_status_message(
             thread_id=thread_id, type="status", content=content, is_llm_message=False, metadata=metadata
         )
         return saved_message_obj
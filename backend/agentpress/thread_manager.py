@@ -11,11 +11,14 @@ This module provides comprehensive conversation management, including:
 """
 
 import json
-from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal
+from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal, Callable
 from services.llm import make_llm_api_call
+from services.llm_scheduler import PRIORITY_HIGH
 from agentpress.tool import Tool
 from agentpress.tool_registry import ToolRegistry
-from agentpress.context_manager import ContextManager
+from agentpress.context_manager import ContextManager, splice_latest_summary
+from agentpress.compressed_views import CompressedViewStore
+from agentpress.message_writer import MessageWriter
 from agentpress.response_processor import (
     ResponseProcessor,
     ProcessorConfig
@@ -53,14 +56,18 @@ class ThreadManager:
         self.target_agent_id = target_agent_id
         if not self.trace:
             self.trace = langfuse.trace(name="anonymous:thread_manager")
+        self.message_writer = MessageWriter(self.db)
         self.response_processor = ResponseProcessor(
             tool_registry=self.tool_registry,
             add_message_callback=self.add_message,
+            add_status_message_callback=self.add_status_message,
             trace=self.trace,
             is_agent_builder=self.is_agent_builder,
             target_agent_id=self.target_agent_id
         )
         self.context_manager = ContextManager()
+        self.compressed_views = CompressedViewStore()
+        self._reply_overheads: Dict[str, int] = {}
 
     def _is_tool_result_message(self, msg: Dict[str, Any]) -> bool:
         if not ("content" in msg and msg['content']):
@@ -103,73 +110,92 @@ class ThreadManager:
             else:
                 return msg_content
   
-    def _compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
-        """Compress the tool result messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+    def _message_tokens(self, msg: Dict[str, Any]) -> int:
+        """Token count of a single message for the per-message thresholds, memoized per message_id + content."""
+        return self.compressed_views.token_count(msg, lambda: token_counter(messages=[msg]))
+
+    def _total_tokens(self, messages: List[Dict[str, Any]], llm_model: str) -> int:
+        """Token count of the whole conversation with the model's tokenizer.
+
+        Each message is counted on its own (memoized per model, message_id + content), so
+        only new or changed messages are tokenized. A single-message count includes the
+        reply priming the tokenizer adds once per conversation, so it is subtracted for
+        every message but one.
+        """
+        if not messages:
+            return token_counter(model=llm_model, messages=[])
+        per_message = sum(
+            self.compressed_views.token_count(msg, lambda msg=msg: token_counter(model=llm_model, messages=[msg]), model=llm_model)
+            for msg in messages
+        )
+        return per_message - (len(messages) - 1) * self._reply_overhead(llm_model)
+
+    def _reply_overhead(self, llm_model: str) -> int:
+        """Tokens the model's tokenizer adds once per conversation rather than per message."""
+        if llm_model not in self._reply_overheads:
+            empty = {"role": "user", "content": ""}
+            one = token_counter(model=llm_model, messages=[empty])
+            two = token_counter(model=llm_model, messages=[empty, empty])
+            self._reply_overheads[llm_model] = max(0, 2 * one - two)
+        return self._reply_overheads[llm_model]
+
+    def _compressed_view(self, msg: Dict[str, Any], kind: Literal["compress", "truncate"], max_length: int) -> Union[str, dict]:
+        """Compressed content of a message, reused from the view store when it was computed before."""
+        message_id = msg.get('message_id')
+        if kind == "compress":
+            compute = lambda: self._compress_message(msg["content"], message_id, max_length)
+        else:
+            compute = lambda: self._safe_truncate(msg["content"], max_length)
+        if not message_id:
+            return compute()
+        return self.compressed_views.view(message_id, kind, max_length, compute)
+
+    def _compress_role_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: int, default_max_tokens: int, matches: Callable[[Dict[str, Any]], bool]) -> List[Dict[str, Any]]:
+        """Compress the matching messages except the most recent one."""
+        uncompressed_total_token_count = self._total_tokens(messages, llm_model)
 
-        if uncompressed_total_token_count > (max_tokens or (64 * 1000)):
-            _i = 0 # Count the number of ToolResult messages
+        if uncompressed_total_token_count > (max_tokens or default_max_tokens):
+            _i = 0 # Count the number of matching messages
             for msg in reversed(messages): # Start from the end and work backwards
-                if self._is_tool_result_message(msg): # Only compress ToolResult messages
-                    _i += 1 # Count the number of ToolResult messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
+                if matches(msg):
+                    _i += 1
+                    msg_token_count = self._message_tokens(msg) # Count the number of tokens in the message
                     if msg_token_count > token_threshold: # If the message is too long
-                        if _i > 1: # If this is not the most recent ToolResult message
-                            message_id = msg.get('message_id') # Get the message_id
-                            if message_id:
-                                msg["content"] = self._compress_message(msg["content"], message_id, token_threshold * 3)
+                        if _i > 1: # If this is not the most recent matching message
+                            if msg.get('message_id'):
+                                msg["content"] = self._compressed_view(msg, "compress", token_threshold * 3)
                             else:
                                 logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
                         else:
-                            msg["content"] = self._safe_truncate(msg["content"], int(max_tokens * 2))
+                            msg["content"] = self._compressed_view(msg, "truncate", int(max_tokens * 2))
         return messages
 
+    def _compress_tool_result_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
+        """Compress the tool result messages except the most recent one."""
+        return self._compress_role_messages(messages, llm_model, max_tokens, token_threshold, 64 * 1000, self._is_tool_result_message)
+
     def _compress_user_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
         """Compress the user messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
-
-        if uncompressed_total_token_count > (max_tokens or (100 * 1000)):
-            _i = 0 # Count the number of User messages
-            for msg in reversed(messages): # Start from the end and work backwards
-                if msg.get('role') == 'user': # Only compress User messages
-                    _i += 1 # Count the number of User messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
-                    if msg_token_count > token_threshold: # If the message is too long
-                        if _i > 1: # If this is not the most recent User message
-                            message_id = msg.get('message_id') # Get the message_id
-                            if message_id:
-                                msg["content"] = self._compress_message(msg["content"], message_id, token_threshold * 3)
-                            else:
-                                logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
-                        else:
-                            msg["content"] = self._safe_truncate(msg["content"], int(max_tokens * 2))
-        return messages
+        return self._compress_role_messages(messages, llm_model, max_tokens, token_threshold, 100 * 1000, lambda msg: msg.get('role') == 'user')
 
     def _compress_assistant_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int], token_threshold: Optional[int] = 1000) -> List[Dict[str, Any]]:
         """Compress the assistant messages except the most recent one."""
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
-        if uncompressed_total_token_count > (max_tokens or (100 * 1000)):
-            _i = 0 # Count the number of Assistant messages
-            for msg in reversed(messages): # Start from the end and work backwards
-                if msg.get('role') == 'assistant': # Only compress Assistant messages
-                    _i += 1 # Count the number of Assistant messages
-                    msg_token_count = token_counter(messages=[msg]) # Count the number of tokens in the message
-                    if msg_token_count > token_threshold: # If the message is too long
-                        if _i > 1: # If this is not the most recent Assistant message
-                            message_id = msg.get('message_id') # Get the message_id
-                            if message_id:
-                                msg["content"] = self._compress_message(msg["content"], message_id, token_threshold * 3)
-                            else:
-                                logger.warning(f"UNEXPECTED: Message has no message_id {str(msg)[:100]}")
-                        else:
-                            msg["content"] = self._safe_truncate(msg["content"], int(max_tokens * 2))
-                            
-        return messages
+        return self._compress_role_messages(messages, llm_model, max_tokens, token_threshold, 100 * 1000, lambda msg: msg.get('role') == 'assistant')
 
-    def _compress_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int] = 41000, token_threshold: Optional[int] = 4096, max_iterations: int = 5) -> List[Dict[str, Any]]:
+    def _compress_messages(self, messages: List[Dict[str, Any]], llm_model: str, max_tokens: Optional[int] = 41000, token_threshold: Optional[int] = 4096, max_iterations: int = 5, thread_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """Compress the messages.
             token_threshold: must be a power of 2
+            thread_id: if given, compression never loosens again for this thread, so messages
+                compressed on an earlier turn keep identical content (and the prompt cache prefix)
+
+        Works on shallow copies, so every level starts from the original contents and each
+        compressed message is a pure function of (message_id, compression kind, length) that
+        the view store can reuse on later turns.
         """
+        if thread_id:
+            stored_threshold = self.compressed_views.get_threshold(thread_id)
+            if stored_threshold:
+                token_threshold = min(token_threshold, stored_threshold)
 
         if 'sonnet' in llm_model.lower():
             max_tokens = 200 * 1000 - 64000
@@ -186,21 +212,23 @@ class ThreadManager:
             logger.warning(f"_compress_messages: Max iterations reached, returning uncompressed messages")
             return messages
 
-        result = messages
+        result = [dict(msg) for msg in messages]
 
-        uncompressed_total_token_count = token_counter(model=llm_model, messages=messages)
+        uncompressed_total_token_count = self._total_tokens(messages, llm_model)
 
         result = self._compress_tool_result_messages(result, llm_model, max_tokens, token_threshold)
         result = self._compress_user_messages(result, llm_model, max_tokens, token_threshold)
         result = self._compress_assistant_messages(result, llm_model, max_tokens, token_threshold)
 
-        compressed_token_count = token_counter(model=llm_model, messages=result)
+        compressed_token_count = self._total_tokens(result, llm_model)
 
         logger.info(f"_compress_messages: {uncompressed_total_token_count} -> {compressed_token_count}") # Log the token compression for debugging later
 
         if (compressed_token_count > max_tokens):
             logger.warning(f"Further token compression is needed: {compressed_token_count} > {max_tokens}")
-            result = self._compress_messages(messages, llm_model, max_tokens, int(token_threshold / 2), max_iterations - 1)
+            result = self._compress_messages(messages, llm_model, max_tokens, int(token_threshold / 2), max_iterations - 1, thread_id)
+        elif thread_id and compressed_token_count < uncompressed_total_token_count:
+            self.compressed_views.set_threshold(thread_id, token_threshold)
 
         return result
 
@@ -214,7 +242,8 @@ class ThreadManager:
         type: str,
         content: Union[Dict[str, Any], List[Any], str],
         is_llm_message: bool = False,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        message_id: Optional[str] = None
     ):
         """Add a message to the thread in the database.
 
@@ -227,8 +256,12 @@ class ThreadManager:
                             Defaults to False (user message).
             metadata: Optional dictionary for additional message metadata.
                       Defaults to None, stored as an empty JSONB object if None.
+            message_id: Optional ID to store the message with, when the caller has to
+                        know it before the insert. Generated by the database if None.
         """
         logger.debug(f"Adding message of type '{type}' to thread {thread_id}")
+        # Queued status messages come first, so the stored order matches the yielded order
+        await self.message_writer.flush()
         client = await self.db.client
 
         # Prepare data for insertion
@@ -239,6 +272,8 @@ class ThreadManager:
             'is_llm_message': is_llm_message,
             'metadata': metadata or {},
         }
+        if message_id:
+            data_to_insert['message_id'] = message_id
 
         try:
             # Add returning='representation' to get the inserted row data including the id
@@ -254,11 +289,25 @@ class ThreadManager:
             logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
             raise
 
+    async def add_status_message(
+        self,
+        thread_id: str,
+        type: str,
+        content: Union[Dict[str, Any], List[Any], str],
+        is_llm_message: bool = False,
+        metadata: Optional[Dict[str, Any]] = None
+    ):
+        """Add a message that nothing reads back during the run, without waiting for the database.
+
+        The message gets its message_id and created_at right away and is inserted
+        in a background batch (see MessageWriter). Takes the same arguments as add_message.
+        """
+        return self.message_writer.add_deferred(thread_id, type, content, is_llm_message, metadata)
+
     async def get_llm_messages(self, thread_id: str) -> List[Dict[str, Any]]:
         """Get all messages for a thread.
 
-        This method uses the SQL function which handles context truncation
-        by considering summary messages.
+        If the thread has a summary, the latest one replaces the messages it covers.
 
         Args:
             thread_id: The ID of the thread to get messages for.
@@ -271,7 +320,7 @@ class ThreadManager:
 
         try:
             # result = await client.rpc('get_llm_formatted_messages', {'p_thread_id': thread_id}).execute()
-            result = await client.table('messages').select('message_id, content').eq('thread_id', thread_id).eq('is_llm_message', True).order('created_at').execute()
+            result = await client.table('messages').select('message_id, type, content, metadata').eq('thread_id', thread_id).eq('is_llm_message', True).order('created_at').execute()
 
             # Parse the returned data which might be stringified JSON
             if not result.data:
@@ -279,7 +328,7 @@ class ThreadManager:
 
             # Return properly parsed JSON objects
             messages = []
-            for item in result.data:
+            for item in splice_latest_summary(result.data):
                 if isinstance(item['content'], str):
                     try:
                         parsed_item = json.loads(item['content'])
@@ -298,6 +347,25 @@ class ThreadManager:
             logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}", exc_info=True)
             return []
 
+    def get_xml_examples_prompt(self) -> str:
+        """System prompt section describing the registered XML tools, or "" if there are none."""
+        xml_examples = self.tool_registry.get_xml_examples()
+        if not xml_examples:
+            return ""
+        examples_content = """
+--- XML TOOL CALLING ---
+
+In this environment you have access to a set of tools you can use to answer the user's question. The tools are specified in XML format.
+Format your tool calls using the specified XML tags. Place parameters marked as 'attribute' within the opening tag (e.g., `<tag attribute='value'>`). Place parameters marked as 'content' between the opening and closing tags. Place parameters marked as 'element' within their own child tags (e.g., `<tag><element>value</element></tag>`). Refer to the examples provided below for the exact structure of each tool.
+String and scalar parameters should be specified as attributes, while content goes between tags.
+Note that spaces for string values are not stripped. The output is parsed with regular expressions.
+
+Here are the XML tools available with examples:
+"""
+        for tag_name, example in xml_examples.items():
+            examples_content += f"<{tag_name}> Example: {example}\\n"
+        return examples_content
+
     async def run_thread(
         self,
         thread_id: str,
@@ -359,29 +427,8 @@ class ThreadManager:
 
         # Add XML examples to system prompt if requested, do this only ONCE before the loop
         if include_xml_examples and processor_config.xml_tool_calling:
-            xml_examples = self.tool_registry.get_xml_examples()
-            if xml_examples:
-                examples_content = """
---- XML TOOL CALLING ---
-
-In this environment you have access to a set of tools you can use to answer the user's question. The tools are specified in XML format.
-Format your tool calls using the specified XML tags. Place parameters marked as 'attribute' within the opening tag (e.g., `<tag attribute='value'>`). Place parameters marked as 'content' between the opening and closing tags. Place parameters marked as 'element' within their own child tags (e.g., `<tag><element>value</element></tag>`). Refer to the examples provided below for the exact structure of each tool.
-String and scalar parameters should be specified as attributes, while content goes between tags.
-Note that spaces for string values are not stripped. The output is parsed with regular expressions.
-
-Here are the XML tools available with examples:
-"""
-                for tag_name, example in xml_examples.items():
-                    examples_content += f"<{tag_name}> Example: {example}\\n"
-
-                # # Save examples content to a file
-                # try:
-                #     with open('xml_examples.txt', 'w') as f:
-                #         f.write(examples_content)
-                #     logger.debug("Saved XML examples to xml_examples.txt")
-                # except Exception as e:
-                #     logger.error(f"Failed to save XML examples to file: {e}")
-
+            examples_content = self.get_xml_examples_prompt()
+            if examples_content:
                 system_content = working_system_prompt.get('content')
 
                 if isinstance(system_content, str):
@@ -421,24 +468,11 @@ Here are the XML tools available with examples:
                     token_threshold = self.context_manager.token_threshold
                     logger.info(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
 
-                    # if token_count >= token_threshold and enable_context_manager:
-                    #     logger.info(f"Thread token count ({token_count}) exceeds threshold ({token_threshold}), summarizing...")
-                    #     summarized = await self.context_manager.check_and_summarize_if_needed(
-                    #         thread_id=thread_id,
-                    #         add_message_callback=self.add_message,
-                    #         model=llm_model,
-                    #         force=True
-                    #     )
-                    #     if summarized:
-                    #         logger.info("Summarization complete, fetching updated messages with summary")
-                    #         messages = await self.get_llm_messages(thread_id)
-                    #         # Recount tokens after summarization, using the modified prompt
-                    #         new_token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages)
-                    #         logger.info(f"After summarization: token count reduced from {token_count} to {new_token_count}")
-                    #     else:
-                    #         logger.warning("Summarization failed or wasn't needed - proceeding with original messages")
-                    # elif not enable_context_manager:
-                    #     logger.info("Automatic summarization disabled. Skipping token count check and summarization.")
+                    if enable_context_manager:
+                        # Runs in the background; the summary is spliced in on a later turn
+                        self.context_manager.schedule_summarization(thread_id, token_count, self.add_message, model=llm_model)
+                    else:
+                        logger.debug("Automatic summarization disabled. Skipping summarization.")
 
                 except Exception as e:
                     logger.error(f"Error counting tokens or summarizing: {str(e)}")
@@ -472,7 +506,9 @@ Here are the XML tools available with examples:
                     openapi_tool_schemas = self.tool_registry.get_openapi_schemas()
                     logger.debug(f"Retrieved {len(openapi_tool_schemas) if openapi_tool_schemas else 0} OpenAPI tool schemas")
 
-                prepared_messages = self._compress_messages(prepared_messages, llm_model)
+                await self.compressed_views.load(thread_id, prepared_messages)
+                prepared_messages = self._compress_messages(prepared_messages, llm_model, thread_id=thread_id)
+                await self.compressed_views.flush()
 
                 # 5. Make LLM API call
                 logger.debug("Making LLM API call")
@@ -500,7 +536,8 @@ Here are the XML tools available with examples:
                         tool_choice=tool_choice if processor_config.native_tool_calling else None,
                         stream=stream,
                         enable_thinking=enable_thinking,
-                        reasoning_effort=reasoning_effort
+                        reasoning_effort=reasoning_effort,
+                        priority=PRIORITY_HIGH
                     )
                     logger.debug("Successfully received raw LLM API response stream/object")
 
@@ -89,9 +89,24 @@ class ToolResult:
     Attributes:
         success (bool): Whether the tool execution succeeded
         output (str): Output message or error description
+        timing (Optional[Dict[str, float]]): Set by the ToolScheduler: milliseconds
+            queued and executing
     """
     success: bool
     output: str
+    timing: Optional[Dict[str, float]] = field(default=None, repr=False, compare=False)
+
+@dataclass
+class ResourceAccess:
+    """A resource a tool call touches, used to order conflicting calls.
+
+    Attributes:
+        key (str): Identifies the resource, e.g. "file:/workspace/app.py"
+        exclusive (bool): Whether the call changes the resource. Exclusive calls run
+            alone and in order; non-exclusive calls on the same key run in parallel
+    """
+    key: str
+    exclusive: bool = True
 
 class Tool(ABC):
     """Abstract base class for all tools.
@@ -108,18 +123,39 @@ class Tool(ABC):
         fail_response: Create a failed result
     """
     
+    _class_schemas: Dict[str, List[ToolSchema]] = {}
+    uses_sandbox = False  # Whether calls are limited by the worker's sandbox call slots
+    max_concurrency: Optional[int] = None  # Calls of this tool that run at once within a run (None: no limit)
+
+    def __init_subclass__(cls, **kwargs):
+        """Collect the schemas of decorated methods once, when the tool class is defined."""
+        super().__init_subclass__(**kwargs)
+        cls._class_schemas = {
+            name: function.tool_schemas
+            for name, function in inspect.getmembers(cls, predicate=inspect.isfunction)
+            if hasattr(function, 'tool_schemas')
+        }
+        logger.debug(f"Collected schemas for {len(cls._class_schemas)} methods in {cls.__name__}")
+
     def __init__(self):
         """Initialize tool with empty schema registry."""
         self._schemas: Dict[str, List[ToolSchema]] = {}
         logger.debug(f"Initializing tool class: {self.__class__.__name__}")
         self._register_schemas()
 
+    @classmethod
+    def get_class_schemas(cls) -> Dict[str, List[ToolSchema]]:
+        """Get the schemas of the class's decorated methods, shared by all instances.
+
+        Returns:
+            Dict mapping method names to their schema definitions
+        """
+        return cls._class_schemas
+
     def _register_schemas(self):
         """Register schemas from all decorated methods."""
-        for name, method in inspect.getmembers(self, predicate=inspect.ismethod):
-            if hasattr(method, 'tool_schemas'):
-                self._schemas[name] = method.tool_schemas
-                logger.debug(f"Registered schemas for method '{name}' in {self.__class__.__name__}")
+        # Copy so instances that add schemas at runtime don't change the class-level ones
+        self._schemas.update(self.get_class_schemas())
 
     def get_schemas(self) -> Dict[str, List[ToolSchema]]:
         """Get all registered tool schemas.
@@ -129,6 +165,18 @@ class Tool(ABC):
         """
         return self._schemas
 
+    def get_resource_access(self, function_name: str, arguments: Dict[str, Any]) -> Optional[ResourceAccess]:
+        """Get the resource a call touches, so conflicting calls aren't run in parallel.
+
+        Args:
+            function_name: Name of the called method
+            arguments: Arguments of the call
+
+        Returns:
+            The resource and access mode, or None if the call conflicts with nothing
+        """
+        return None
+
     def success_response(self, data: Union[Dict[str, Any], str]) -> ToolResult:
         """Create a successful tool result.
         
@@ -1,8 +1,50 @@
-from typing import Dict, Type, Any, List, Optional, Callable
-from agentpress.tool import Tool, SchemaType
+from typing import Dict, Type, Any, List, Optional, Callable, Tuple
+from agentpress.tool import Tool, SchemaType, ToolSchema
 from utils.logger import logger
 
 
+class ToolTemplate:
+    """Schema entries a tool class contributes to a registry, prebuilt once per (class, function filter).
+
+    Tool instances hold per-run state (project, thread manager), so each registry still
+    creates its own instance; binding it to a template only copies the prebuilt entries.
+    """
+
+    def __init__(self, tool_class: Type[Tool], function_names: Optional[Tuple[str, ...]] = None):
+        self.tool_class = tool_class
+        self.method_names = set()
+        self.openapi: List[Tuple[str, ToolSchema]] = []  # (function name, schema)
+        self.xml: List[Tuple[str, str, ToolSchema]] = []  # (tag name, method name, schema)
+
+        for func_name, schema_list in tool_class.get_class_schemas().items():
+            self.method_names.add(func_name)
+            if function_names is not None and func_name not in function_names:
+                continue
+            for schema in schema_list:
+                if schema.schema_type == SchemaType.OPENAPI:
+                    self.openapi.append((func_name, schema))
+                if schema.schema_type == SchemaType.XML and schema.xml_schema:
+                    self.xml.append((schema.xml_schema.tag_name, func_name, schema))
+
+    def matches(self, tool_instance: Tool) -> bool:
+        """Whether the instance exposes exactly the class schemas (no schemas added at runtime)."""
+        return set(tool_instance.get_schemas().keys()) == self.method_names
+
+
+_templates: Dict[Tuple[Type[Tool], Optional[Tuple[str, ...]]], ToolTemplate] = {}
+
+
+def get_tool_template(tool_class: Type[Tool], function_names: Optional[List[str]] = None) -> ToolTemplate:
+    """Get (or build) the registration template for a tool class and function filter."""
+    key = (tool_class, tuple(sorted(function_names)) if function_names is not None else None)
+    template = _templates.get(key)
+    if template is None:
+        template = ToolTemplate(tool_class, key[1])
+        _templates[key] = template
+        logger.debug(f"Built tool template for {tool_class.__name__}: {len(template.openapi)} OpenAPI functions, {len(template.xml)} XML tags")
+    return template
+
+
 class ToolRegistry:
     """Registry for managing and accessing tools.
     
@@ -15,6 +57,7 @@ class ToolRegistry:
         
     Methods:
         register_tool: Register a tool with optional function filtering
+        register_function: Register a single OpenAPI function added at runtime
         get_tool: Get a specific tool by name
         get_xml_tool: Get a tool by XML tag name
         get_openapi_schemas: Get OpenAPI schemas for function calling
@@ -25,6 +68,7 @@ class ToolRegistry:
         """Initialize a new ToolRegistry instance."""
         self.tools = {}
         self.xml_tools = {}
+        self._openapi_schemas: Optional[List[Dict[str, Any]]] = None
         logger.debug("Initialized new ToolRegistry instance")
     
     def register_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
@@ -41,6 +85,24 @@ class ToolRegistry:
         """
         logger.debug(f"Registering tool class: {tool_class.__name__}")
         tool_instance = tool_class(**kwargs)
+        self._openapi_schemas = None
+
+        template = get_tool_template(tool_class, function_names)
+        if template.matches(tool_instance):
+            for func_name, schema in template.openapi:
+                self.tools[func_name] = {
+                    "instance": tool_instance,
+                    "schema": schema
+                }
+            for tag_name, method_name, schema in template.xml:
+                self.xml_tools[tag_name] = {
+                    "instance": tool_instance,
+                    "method": method_name,
+                    "schema": schema
+                }
+            logger.debug(f"Tool registration complete for {tool_class.__name__}: {len(template.openapi)} OpenAPI functions, {len(template.xml)} XML tags")
+            return
+
         schemas = tool_instance.get_schemas()
         
         logger.debug(f"Available schemas for {tool_class.__name__}: {list(schemas.keys())}")
@@ -70,6 +132,21 @@ class ToolRegistry:
         
         logger.debug(f"Tool registration complete for {tool_class.__name__}: {registered_openapi} OpenAPI functions, {registered_xml} XML tags")
 
+    def register_function(self, func_name: str, tool_instance: Tool, schema: ToolSchema):
+        """Register a single OpenAPI function, e.g. a dynamic MCP tool created after registration.
+        
+        Args:
+            func_name: Name of the function
+            tool_instance: Tool instance that implements the function
+            schema: OpenAPI schema of the function
+        """
+        self.tools[func_name] = {
+            "instance": tool_instance,
+            "schema": schema
+        }
+        self._openapi_schemas = None
+        logger.debug(f"Registered OpenAPI function {func_name} from {tool_instance.__class__.__name__}")
+
     def get_available_functions(self) -> Dict[str, Callable]:
         """Get all available tool functions.
         
@@ -129,13 +206,15 @@ class ToolRegistry:
         Returns:
             List of OpenAPI-compatible schema definitions
         """
-        schemas = [
-            tool_info['schema'].schema 
-            for tool_info in self.tools.values()
-            if tool_info['schema'].schema_type == SchemaType.OPENAPI
-        ]
-        logger.debug(f"Retrieved {len(schemas)} OpenAPI schemas")
-        return schemas
+        if self._openapi_schemas is None:
+            # Cached until tools change, so every turn sends the same list
+            self._openapi_schemas = [
+                tool_info['schema'].schema 
+                for tool_info in self.tools.values()
+                if tool_info['schema'].schema_type == SchemaType.OPENAPI
+            ]
+            logger.debug(f"Built {len(self._openapi_schemas)} OpenAPI schemas")
+        return self._openapi_schemas
 
     def get_xml_examples(self) -> Dict[str, str]:
         """Get all XML tag examples.
@@ -0,0 +1,139 @@
+"""
+Bounded, conflict-aware scheduling of tool calls.
+
+Tool calls were either all started at once (parallel strategy, and
+execute_on_stream started one task per detected call) or run one by one. With the
+first, a model emitting 15 scrapes or shell commands could overload the sandbox
+or a third-party API. The scheduler runs calls in parallel within these limits:
+
+- at most MAX_PARALLEL_TOOL_CALLS calls at once per run
+- at most Tool.max_concurrency calls at once per tool class
+- calls that touch the same resource (Tool.get_resource_access) are ordered:
+  exclusive calls, e.g. edits of the same file, run alone and in the order they
+  were submitted; non-exclusive calls on a resource run in parallel with each other
+
+It also times every call (time waiting for a slot, execution time). The timing
+is returned on the call's ToolResult and reported in the tool_completed status
+message.
+"""
+
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from agentpress.tool import ResourceAccess, ToolResult
+from agentpress.tool_registry import ToolRegistry
+from utils.config import config
+from utils.logger import logger
+
+
+@dataclass
+class _ResourceState:
+    last_exclusive: Optional[asyncio.Future] = None
+    shared: List[asyncio.Future] = field(default_factory=list)
+
+
+class ToolScheduler:
+    """Runs tool calls within concurrency limits, ordering calls that conflict."""
+
+    def __init__(self, tool_registry: ToolRegistry, execute: Callable[[Dict[str, Any]], Awaitable[ToolResult]]):
+        """
+        Args:
+            tool_registry: Registry used to look up the tool behind each call
+            execute: Executes a single tool call
+        """
+        self.tool_registry = tool_registry
+        self._execute = execute
+        self._run_limit = asyncio.Semaphore(config.MAX_PARALLEL_TOOL_CALLS)
+        self._class_limits: Dict[type, asyncio.Semaphore] = {}
+        self._resources: Dict[str, _ResourceState] = {}
+
+    def submit(self, tool_call: Dict[str, Any]) -> asyncio.Task:
+        """Schedule a tool call; the returned task resolves to its ToolResult.
+
+        Calls must be submitted in the order the model made them. Conflicting calls
+        run in that order.
+        """
+        tool = self._get_tool(tool_call)
+        access = self._get_resource_access(tool, tool_call)
+        done = asyncio.get_running_loop().create_future()
+        wait_for = self._reserve(access, done) if access else []
+        return asyncio.create_task(self._run(tool_call, tool, wait_for, done))
+
+    def _get_tool(self, tool_call: Dict[str, Any]):
+        tool_fn = self.tool_registry.get_available_functions().get(tool_call.get("function_name"))
+        return getattr(tool_fn, "__self__", None)
+
+    def _get_resource_access(self, tool, tool_call: Dict[str, Any]) -> Optional[ResourceAccess]:
+        if tool is None:
+            return None
+        arguments = tool_call.get("arguments") or {}
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments)
+            except json.JSONDecodeError:
+                arguments = {}
+        try:
+            return tool.get_resource_access(tool_call["function_name"], arguments if isinstance(arguments, dict) else {})
+        except Exception as e:
+            logger.warning(f"Failed to get resource access of {tool_call.get('function_name')}: {e}")
+            return None
+
+    def _reserve(self, access: ResourceAccess, done: asyncio.Future) -> List[asyncio.Future]:
+        """Record the call on its resource; returns the calls it has to wait for."""
+        state = self._resources.setdefault(access.key, _ResourceState())
+        if access.exclusive:
+            wait_for = state.shared + ([state.last_exclusive] if state.last_exclusive else [])
+            state.last_exclusive = done
+            state.shared = []
+        else:
+            wait_for = [state.last_exclusive] if state.last_exclusive else []
+            state.shared.append(done)
+        done.add_done_callback(lambda _: self._release(access.key))
+        return wait_for
+
+    def _release(self, key: str):
+        state = self._resources.get(key)
+        if state and (not state.last_exclusive or state.last_exclusive.done()) and all(f.done() for f in state.shared):
+            del self._resources[key]
+
+    def _get_class_limit(self, tool) -> Optional[asyncio.Semaphore]:
+        limit = getattr(tool, "max_concurrency", None)
+        if not limit:
+            return None
+        tool_class = type(tool)
+        if tool_class not in self._class_limits:
+            self._class_limits[tool_class] = asyncio.Semaphore(limit)
+        return self._class_limits[tool_class]
+
+    async def _run(self, tool_call: Dict[str, Any], tool, wait_for: List[asyncio.Future], done: asyncio.Future) -> ToolResult:
+        submitted = time.monotonic()
+        try:
+            if wait_for:
+                await asyncio.wait(wait_for)
+            class_limit = self._get_class_limit(tool)
+            if class_limit:
+                await class_limit.acquire()
+            try:
+                async with self._run_limit:
+                    started = time.monotonic()
+                    result = await self._execute(tool_call)
+                    finished = time.monotonic()
+            finally:
+                if class_limit:
+                    class_limit.release()
+
+            queued_ms = round((started - submitted) * 1000, 1)
+            if isinstance(result, ToolResult):
+                result.timing = {
+                    "queued_ms": queued_ms,
+                    "duration_ms": round((finished - started) * 1000, 1),
+                }
+            if queued_ms > 1000:
+                logger.info(f"Tool {tool_call.get('function_name')} waited {queued_ms:.0f}ms for a slot")
+            return result
+        finally:
+            if not done.done():
+                done.set_result(None)
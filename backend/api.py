@@ -10,6 +10,7 @@ from dotenv import load_dotenv
 from utils.config import config, EnvMode
 import asyncio
 from utils.logger import logger
+from utils.http_client import close_all_clients
 import time
 from collections import OrderedDict
 from typing import Dict, Any
@@ -72,6 +73,9 @@ async def lifespan(app: FastAPI):
         logger.info("Cleaning up agent resources")
         await agent_api.cleanup()
 
+        # Close pooled HTTP clients
+        await close_all_clients()
+
         # Clean up Redis connection
         try:
             logger.info("Closing Redis connection")
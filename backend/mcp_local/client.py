@@ -4,28 +4,17 @@ MCP Client module for connecting to and using MCP servers
 This module handles:
 1. Connecting to MCP servers via Smithery
 2. Converting MCP tools to OpenAPI format for LLMs
-3. Executing MCP tool calls
+3. Executing MCP tool calls over pooled sessions
 """
 
 import asyncio
 import json
 import base64
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
 
 # Import MCP components according to the official SDK
 from mcp import ClientSession
-try:
-    from mcp.client.streamable_http import streamablehttp_client
-except ImportError:
-    # Fallback import if the module structure is different
-    try:
-        from mcp.client import streamablehttp_client
-    except ImportError:
-        raise ImportError(
-            "Could not import streamablehttp_client. "
-            "Make sure you have installed mcp with: pip install 'mcp[cli]'"
-        )
 
 # Import types - these should be in mcp.types according to the docs
 try:
@@ -42,6 +31,9 @@ except ImportError:
         ToolResult = Any
 
 from utils.logger import logger
+from utils.config import config as app_config
+from mcp_local.session_pool import MCPSessionPool
+from mcp_local.schema_cache import get_cached_tools, set_cached_tools, invalidate_cached_tools
 import os
 
 # Get Smithery API key from environment
@@ -61,9 +53,16 @@ class MCPConnection:
 class MCPManager:
     """Manages connections to multiple MCP servers"""
     
-    def __init__(self):
+    def __init__(self, session_pool: Optional[MCPSessionPool] = None):
         self.connections: Dict[str, MCPConnection] = {}
-        self._sessions: Dict[str, Tuple[Any, Any, Any]] = {}  # Store streams for cleanup
+        self.session_pool = session_pool or MCPSessionPool()
+    
+    @staticmethod
+    def _smithery_url(qualified_name: str, config: Dict[str, Any]) -> str:
+        """Build the Smithery streamable HTTP URL for a server config"""
+        config_json = json.dumps(config)
+        config_b64 = base64.b64encode(config_json.encode()).decode()
+        return f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
         
     async def connect_server(self, mcp_config: Dict[str, Any]) -> MCPConnection:
         """
@@ -95,33 +94,29 @@ class MCPManager:
             )
         
         try:
-            # Encode config in base64
-            config_json = json.dumps(mcp_config["config"])
-            config_b64 = base64.b64encode(config_json.encode()).decode()
+            url = self._smithery_url(qualified_name, mcp_config["config"])
             
-            # Create server URL
-            url = f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
-            
-            # Test connection and get available tools
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    # Initialize the connection
-                    await session.initialize()
-                    logger.info(f"MCP session initialized for {qualified_name}")
-                    
-                    # List available tools
-                    tools_result = await session.list_tools()
-            tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
+            # Skip discovery entirely when another run already cached this server's tools
+            tools = await get_cached_tools("http", {"url": url})
+            if tools is not None:
+                logger.info(f"Loaded {len(tools)} tools for {qualified_name} from schema cache")
+            else:
+                # Connect through the pool so the discovery session is reused for tool calls
+                async with asyncio.timeout(app_config.MCP_SERVER_INIT_TIMEOUT):
+                    tools_result = await self.session_pool.list_tools("http", {"url": url})
+                logger.info(f"MCP session initialized for {qualified_name}")
+                tools = tools_result.tools if hasattr(tools_result, 'tools') else tools_result
+                await set_cached_tools("http", {"url": url}, tools)
             
             logger.info(f"Available tools from {qualified_name}: {[t.name for t in tools]}")
             
-            # Create connection object (without persistent session)
+            # Create connection object (the live session is owned by the pool)
             connection = MCPConnection(
                 qualified_name=qualified_name,
                 name=mcp_config["name"],
                 config=mcp_config["config"],
                 enabled_tools=mcp_config.get("enabledTools", []),
-                session=None,  # No persistent session
+                session=None,
                 tools=tools
             )
             
@@ -133,13 +128,21 @@ class MCPManager:
             raise
             
     async def connect_all(self, mcp_configs: List[Dict[str, Any]]) -> None:
-        """Connect to all MCP servers in the configuration"""
-        for config in mcp_configs:
-            try:
-                await self.connect_server(config)
-            except Exception as e:
-                logger.error(f"Failed to connect to {config['qualifiedName']}: {str(e)}")
+        """Connect to all MCP servers in the configuration concurrently"""
+        results = await asyncio.gather(
+            *(self.connect_server(config) for config in mcp_configs),
+            return_exceptions=True
+        )
+        for config, result in zip(mcp_configs, results):
+            if isinstance(result, BaseException):
                 # Continue with other servers even if one fails
+                logger.error(f"Failed to connect to {config['qualifiedName']}: {str(result)}")
+        
+        # Keep connections in configuration order regardless of which server answered first,
+        # so the generated tool list is stable from run to run
+        ordered = {config["qualifiedName"]: self.connections[config["qualifiedName"]]
+                   for config in mcp_configs if config["qualifiedName"] in self.connections}
+        self.connections = {**ordered, **self.connections}
                 
     def get_all_tools_openapi(self) -> List[Dict[str, Any]]:
         """
@@ -211,62 +214,54 @@ class MCPManager:
             raise ValueError("SMITHERY_API_KEY environment variable is not set")
         
         try:
-            # Create fresh connection for this tool call
-            config_json = json.dumps(conn.config)
-            config_b64 = base64.b64encode(config_json.encode()).decode()
-            url = f"{SMITHERY_SERVER_BASE_URL}/{qualified_name}/mcp?config={config_b64}&api_key={SMITHERY_API_KEY}"
+            # Reuse the pooled session for this server (reconnects if it went stale)
+            url = self._smithery_url(qualified_name, conn.config)
+            result = await self.session_pool.call_tool("http", {"url": url}, original_tool_name, arguments)
             
-            # Use the documented pattern with proper context management
-            async with streamablehttp_client(url) as (read_stream, write_stream, _):
-                async with ClientSession(read_stream, write_stream) as session:
-                    # Initialize the connection
-                    await session.initialize()
-                    
-                    # Call the tool
-                    result = await session.call_tool(original_tool_name, arguments)
-            
-                    # Convert result to dict - handle MCP response properly
-                    if hasattr(result, 'content'):
-                        # Handle content which might be a list of TextContent objects
-                        content = result.content
-                        if isinstance(content, list):
-                            # Extract text from TextContent objects
-                            text_parts = []
-                            for item in content:
-                                if hasattr(item, 'text'):
-                                    text_parts.append(item.text)
-                                elif hasattr(item, 'content'):
-                                    text_parts.append(str(item.content))
-                                else:
-                                    text_parts.append(str(item))
-                            content_str = "\n".join(text_parts)
-                        elif hasattr(content, 'text'):
-                            # Single TextContent object
-                            content_str = content.text
-                        elif hasattr(content, 'content'):
-                            content_str = str(content.content)
+            # Convert result to dict - handle MCP response properly
+            if hasattr(result, 'content'):
+                # Handle content which might be a list of TextContent objects
+                content = result.content
+                if isinstance(content, list):
+                    # Extract text from TextContent objects
+                    text_parts = []
+                    for item in content:
+                        if hasattr(item, 'text'):
+                            text_parts.append(item.text)
+                        elif hasattr(item, 'content'):
+                            text_parts.append(str(item.content))
                         else:
-                            content_str = str(content)
-                        
-                        is_error = getattr(result, 'isError', False)
-                    else:
-                        content_str = str(result)
-                        is_error = False
-                        
-                return {
-                        "content": content_str,
-                        "isError": is_error
-                }
+                            text_parts.append(str(item))
+                    content_str = "\n".join(text_parts)
+                elif hasattr(content, 'text'):
+                    # Single TextContent object
+                    content_str = content.text
+                elif hasattr(content, 'content'):
+                    content_str = str(content.content)
+                else:
+                    content_str = str(content)
+                
+                is_error = getattr(result, 'isError', False)
+            else:
+                content_str = str(result)
+                is_error = False
+                
+            return {
+                    "content": content_str,
+                    "isError": is_error
+            }
                 
         except Exception as e:
             logger.error(f"Error executing MCP tool {tool_name}: {str(e)}")
+            # The server may have changed its tools since they were cached
+            await invalidate_cached_tools("http", {"url": self._smithery_url(qualified_name, conn.config)})
             return {
                 "content": f"Error executing tool: {str(e)}",
                 "isError": True
             }
             
     async def disconnect_all(self):
-        """Disconnect all MCP servers (clear stored configurations)"""
+        """Disconnect all MCP servers (close pooled sessions and clear stored configurations)"""
         for qualified_name in list(self.connections.keys()):
             try:
                 del self.connections[qualified_name]
@@ -274,8 +269,7 @@ class MCPManager:
             except Exception as e:
                 logger.error(f"Error clearing configuration for {qualified_name}: {str(e)}")
                 
-        # Clear sessions dict
-        self._sessions.clear()
+        await self.session_pool.close_all()
                 
     def get_tool_info(self, tool_name: str) -> Optional[Dict[str, Any]]:
         """Get information about a specific tool"""
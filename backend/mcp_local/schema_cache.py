@@ -0,0 +1,67 @@
+"""
+Cross-run cache of MCP tool schemas.
+
+Discovering an MCP server's tools means connecting and calling `list_tools`.
+Tool lists rarely change, so they are cached in Redis keyed by a hash of the
+server's transport + config, letting later runs register MCP tools without
+touching the server at all.
+"""
+
+import json
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+
+from services import redis
+from mcp_local.session_pool import MCPSessionPool
+from utils.config import config
+from utils.logger import logger
+
+SCHEMA_CACHE_PREFIX = "mcp_tools:"
+
+
+@dataclass
+class CachedTool:
+    """Tool definition restored from the schema cache (mirrors mcp.types.Tool's fields)."""
+    name: str
+    description: Optional[str] = None
+    inputSchema: Optional[Dict[str, Any]] = None
+
+
+def _cache_key(transport: str, server_config: Dict[str, Any]) -> str:
+    return f"{SCHEMA_CACHE_PREFIX}{MCPSessionPool.make_key(transport, server_config)}"
+
+
+async def get_cached_tools(transport: str, server_config: Dict[str, Any]) -> Optional[List[CachedTool]]:
+    """Return cached tools for a server, or None on a miss (or if Redis is unavailable)."""
+    try:
+        cached = await redis.get(_cache_key(transport, server_config))
+        if not cached:
+            return None
+        return [CachedTool(**tool) for tool in json.loads(cached)]
+    except Exception as e:
+        logger.warning(f"MCP schema cache read failed: {e}")
+        return None
+
+
+async def set_cached_tools(transport: str, server_config: Dict[str, Any], tools: List[Any]):
+    """Store a server's tools (mcp Tool objects or CachedTool) for MCP_SCHEMA_CACHE_TTL seconds."""
+    try:
+        payload = [
+            asdict(CachedTool(name=tool.name, description=tool.description, inputSchema=tool.inputSchema))
+            for tool in tools
+        ]
+        await redis.set(
+            _cache_key(transport, server_config),
+            json.dumps(payload, default=str),
+            ex=config.MCP_SCHEMA_CACHE_TTL
+        )
+    except Exception as e:
+        logger.warning(f"MCP schema cache write failed: {e}")
+
+
+async def invalidate_cached_tools(transport: str, server_config: Dict[str, Any]):
+    """Drop a server's cached tools, e.g. after a call hints the schema is stale."""
+    try:
+        await redis.delete(_cache_key(transport, server_config))
+    except Exception as e:
+        logger.warning(f"MCP schema cache invalidation failed: {e}")
@@ -0,0 +1,275 @@
+"""
+Pool of long-lived MCP client sessions.
+
+Opening an MCP connection means a transport handshake, `session.initialize()`
+and, for stdio servers, spawning a process. This module keeps initialized
+`ClientSession`s alive between tool calls:
+
+1. Sessions are keyed by transport + server config, so identical servers share one
+2. Each session is owned by a holder task (the MCP transports use anyio cancel
+   scopes, which must be entered and exited from the same task)
+3. Idle sessions are evicted, stale ones are pinged, dead ones are reconnected
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+import anyio
+import httpx
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+
+from utils.logger import logger
+
+# Defaults
+DEFAULT_IDLE_TIMEOUT = 300  # seconds a session may sit unused before eviction
+DEFAULT_HEALTH_CHECK_INTERVAL = 60  # ping sessions unused for longer than this
+DEFAULT_CONNECT_TIMEOUT = 15
+DEFAULT_CALL_TIMEOUT = 30
+HEALTH_CHECK_TIMEOUT = 5
+CLOSE_TIMEOUT = 5
+
+SUPPORTED_TRANSPORTS = ("sse", "http", "stdio")
+
+# Raised when a request could not be sent because the session or its connection is
+# gone: the tool did not run, so the call is safe to retry on a fresh session
+NOT_SENT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, httpx.ConnectError)
+# Failures of the connection itself; the session is unusable, but the request may
+# already have been processed, so it is not retried
+TRANSPORT_ERRORS = (httpx.TransportError, anyio.EndOfStream, ConnectionError)
+
+
+@dataclass
+class PooledSession:
+    """An initialized MCP session and the task keeping its transport open."""
+    key: str
+    transport: str
+    session: ClientSession
+    holder_task: asyncio.Task
+    closing: asyncio.Event
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+
+    @property
+    def is_alive(self) -> bool:
+        return not self.holder_task.done()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+
+class MCPSessionPool:
+    """Keeps initialized MCP sessions alive for reuse across tool calls."""
+
+    def __init__(
+        self,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+    ):
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.connect_timeout = connect_timeout
+        self._entries: Dict[str, PooledSession] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.stats = {"connects": 0, "reuses": 0, "reconnects": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(transport: str, config: Dict[str, Any]) -> str:
+        """Stable key for a server: transport plus its full connection config."""
+        payload = json.dumps({"transport": transport, "config": config}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def _transport_client(transport: str, config: Dict[str, Any]):
+        """Build the (unentered) transport context manager for a server config."""
+        if transport == "sse":
+            try:
+                return sse_client(config["url"], headers=config.get("headers", {}))
+            except TypeError:
+                # Older mcp versions don't accept headers
+                return sse_client(config["url"])
+        if transport == "http":
+            return streamablehttp_client(config["url"])
+        if transport == "stdio":
+            server_params = StdioServerParameters(
+                command=config["command"],
+                args=config.get("args", []),
+                env=config.get("env", {})
+            )
+            return stdio_client(server_params)
+        raise ValueError(f"Unsupported MCP transport '{transport}', supported transports are {SUPPORTED_TRANSPORTS}")
+
+    async def _hold_session(
+        self,
+        transport: str,
+        config: Dict[str, Any],
+        ready: asyncio.Future,
+        closing: asyncio.Event,
+    ):
+        """Open transport + session, hand the session out, then wait until asked to close."""
+        try:
+            async with self._transport_client(transport, config) as streams:
+                read_stream, write_stream = streams[0], streams[1]
+                async with ClientSession(read_stream, write_stream) as session:
+                    await session.initialize()
+                    if not ready.done():
+                        ready.set_result(session)
+                    await closing.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e if isinstance(e, Exception) else RuntimeError(str(e)))
+            elif not closing.is_set():
+                logger.warning(f"Pooled MCP {transport} session closed unexpectedly: {e}")
+            if not isinstance(e, Exception):
+                raise
+
+    async def _connect(self, key: str, transport: str, config: Dict[str, Any]) -> PooledSession:
+        loop = asyncio.get_running_loop()
+        ready: asyncio.Future = loop.create_future()
+        closing = asyncio.Event()
+        holder_task = asyncio.create_task(self._hold_session(transport, config, ready, closing))
+
+        try:
+            async with asyncio.timeout(self.connect_timeout):
+                session = await ready
+        except BaseException:
+            closing.set()
+            holder_task.cancel()
+            raise
+
+        entry = PooledSession(
+            key=key,
+            transport=transport,
+            session=session,
+            holder_task=holder_task,
+            closing=closing
+        )
+        self._entries[key] = entry
+        self.stats["connects"] += 1
+        logger.info(f"Opened pooled MCP {transport} session ({len(self._entries)} active)")
+        return entry
+
+    async def _is_healthy(self, entry: PooledSession) -> bool:
+        if not entry.is_alive:
+            return False
+        if time.monotonic() - entry.last_used < self.health_check_interval:
+            return True
+        try:
+            async with asyncio.timeout(HEALTH_CHECK_TIMEOUT):
+                await entry.session.send_ping()
+            return True
+        except Exception as e:
+            logger.warning(f"Pooled MCP {entry.transport} session failed health check: {e}")
+            return False
+
+    async def get_session(self, transport: str, config: Dict[str, Any]) -> ClientSession:
+        """Return a live, initialized session for the server, connecting if needed."""
+        await self.evict_idle()
+
+        key = self.make_key(transport, config)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if await self._is_healthy(entry):
+                    entry.touch()
+                    self.stats["reuses"] += 1
+                    return entry.session
+                await self._close_entry(entry)
+                self.stats["reconnects"] += 1
+
+            entry = await self._connect(key, transport, config)
+            return entry.session
+
+    async def list_tools(self, transport: str, config: Dict[str, Any]):
+        """List tools on a server, leaving the session open for subsequent calls."""
+        session = await self.get_session(transport, config)
+        return await session.list_tools()
+
+    async def call_tool(
+        self,
+        transport: str,
+        config: Dict[str, Any],
+        tool_name: str,
+        arguments: Dict[str, Any],
+        timeout: float = DEFAULT_CALL_TIMEOUT,
+    ):
+        """Call a tool over a pooled session.
+
+        If the session turns out to be dead before the request was sent, the call is
+        retried once on a new session. Errors returned by the server (McpError) and
+        any other exception are raised without touching the session, which other
+        calls may be using concurrently.
+        """
+        key = self.make_key(transport, config)
+        for attempt in range(2):
+            session = await self.get_session(transport, config)
+            try:
+                async with asyncio.timeout(timeout):
+                    result = await session.call_tool(tool_name, arguments)
+                entry = self._entries.get(key)
+                if entry:
+                    entry.touch()
+                return result
+            except asyncio.TimeoutError:
+                # The session may be wedged; don't hand it to the next caller
+                await self._close_session(key, session)
+                raise
+            except NOT_SENT_ERRORS as e:
+                await self._close_session(key, session)
+                if attempt == 0:
+                    logger.warning(f"MCP session for '{tool_name}' was closed, reconnecting: {e}")
+                    self.stats["reconnects"] += 1
+                    continue
+                raise
+            except TRANSPORT_ERRORS:
+                await self._close_session(key, session)
+                raise
+
+    async def _close_session(self, key: str, session: ClientSession):
+        """Close the pooled entry of `session`, unless it has already been replaced."""
+        entry = self._entries.get(key)
+        if entry and entry.session is session:
+            await self._close_entry(entry)
+
+    async def _close_entry(self, entry: PooledSession):
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        entry.closing.set()
+        try:
+            async with asyncio.timeout(CLOSE_TIMEOUT):
+                await asyncio.shield(entry.holder_task)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            entry.holder_task.cancel()
+        except Exception as e:
+            logger.debug(f"Error while closing pooled MCP session: {e}")
+
+    async def close(self, transport: str, config: Dict[str, Any]):
+        """Close the pooled session for a server, if any."""
+        entry = self._entries.get(self.make_key(transport, config))
+        if entry:
+            await self._close_entry(entry)
+
+    async def evict_idle(self):
+        """Close sessions that have been idle longer than idle_timeout."""
+        now = time.monotonic()
+        idle = [entry for entry in self._entries.values() if now - entry.last_used > self.idle_timeout]
+        for entry in idle:
+            logger.debug(f"Evicting idle MCP {entry.transport} session")
+            await self._close_entry(entry)
+            self.stats["evictions"] += 1
+
+    async def close_all(self):
+        """Close every pooled session."""
+        entries = list(self._entries.values())
+        if entries:
+            await asyncio.gather(*(self._close_entry(entry) for entry in entries), return_exceptions=True)
+            logger.info(f"Closed {len(entries)} pooled MCP sessions (stats: {self.stats})")
+        self._locks.clear()
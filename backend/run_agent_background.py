@@ -13,17 +13,37 @@ from agentpress.thread_manager import ThreadManager
 from services.supabase import DBConnection
 from services import redis
 from dramatiq.brokers.rabbitmq import RabbitmqBroker
+from dramatiq.asyncio import get_event_loop_thread
 import os
 import pika
 from services.langfuse import langfuse
 from utils.retry import retry
+from utils import worker_limits
+from utils.http_client import close_all_clients
+from services import run_queue
+from services import run_checkpoints
+from services.run_responses import CompactedResponses, compact_responses, archive_raw_stream
+from utils.config import config
+
+
+class CloseSharedClients(dramatiq.Middleware):
+    """Close the pooled HTTP clients on the worker's event loop before it stops."""
+
+    def before_worker_shutdown(self, broker, worker):
+        event_loop_thread = get_event_loop_thread()
+        if event_loop_thread is not None:
+            event_loop_thread.run_coroutine(close_all_clients())
+
+
+# Listed before AsyncIO, whose shutdown hook stops the event loop
+worker_middleware = [CloseSharedClients(), dramatiq.middleware.AsyncIO(), dramatiq.middleware.CurrentMessage()]
 
 # RabbitMQ configuration - support both URL and individual parameters
 rabbitmq_url = os.getenv("RABBITMQ_URL")
 if rabbitmq_url:
     # Use full URL if provided (CloudAMQP format)
     rabbitmq_broker = RabbitmqBroker(
-        url=rabbitmq_url, middleware=[dramatiq.middleware.AsyncIO()]
+        url=rabbitmq_url, middleware=worker_middleware
     )
 else:
     # Fallback to individual parameters for local development
@@ -41,36 +61,50 @@ else:
         port=rabbitmq_port,
         credentials=credentials,
         virtual_host=rabbitmq_vhost,
-        middleware=[dramatiq.middleware.AsyncIO()],
+        middleware=worker_middleware,
     )
 
 dramatiq.set_broker(rabbitmq_broker)
 
 _initialized = False
 db = DBConnection()
-instance_id = "single"
+# Unique per worker process, so active_run keys and control channels identify the worker running each run
+worker_instance_id = f"worker-{str(uuid.uuid4())[:8]}"
+_metrics_reporter = None
+_run_janitor = None
 
 
 async def initialize():
     """Initialize the agent API with resources from the main API."""
-    global db, instance_id, _initialized
+    global db, _initialized, _metrics_reporter, _run_janitor
 
-    # Use provided instance_id or generate a new one
-    if not instance_id:
-        # Generate instance ID
-        instance_id = str(uuid.uuid4())[:8]
     await retry(lambda: redis.initialize_async())
     await db.initialize()
 
+    if _metrics_reporter is None:
+        worker_limits.install_loop_timing()
+        _metrics_reporter = asyncio.create_task(worker_limits.report_metrics(worker_instance_id))
+    if _run_janitor is None:
+        _run_janitor = asyncio.create_task(_resume_abandoned_runs())
+
     _initialized = True
-    logger.info(f"Initialized agent API with instance ID: {instance_id}")
+    logger.info(f"Initialized agent API with instance ID: {worker_instance_id}")
+
+
+def _get_enqueued_at() -> Optional[float]:
+    """Epoch seconds the current message was enqueued, if known."""
+    try:
+        message = dramatiq.middleware.CurrentMessage.get_current_message()
+        return message.message_timestamp / 1000 if message else None
+    except Exception:
+        return None
 
 
 @dramatiq.actor
 async def run_agent_background(
     agent_run_id: str,
     thread_id: str,
-    instance_id: str,  # Use the global instance ID passed during initialization
+    instance_id: str,  # Instance ID of the API that started the run; the worker uses its own
     project_id: str,
     model_name: str,
     enable_thinking: Optional[bool],
@@ -88,32 +122,153 @@ async def run_agent_background(
         logger.critical(f"Failed to initialize Redis connection: {e}")
         raise e
 
-    # Idempotency check: prevent duplicate runs
-    run_lock_key = f"agent_run_lock:{agent_run_id}"
+    # Wait for one of this worker's run slots; the run's event-loop time is accounted to it
+    async with worker_limits.run_slot(agent_run_id, enqueued_at=_get_enqueued_at()):
+        await _run_agent(
+            agent_run_id=agent_run_id,
+            thread_id=thread_id,
+            project_id=project_id,
+            model_name=model_name,
+            enable_thinking=enable_thinking,
+            reasoning_effort=reasoning_effort,
+            stream=stream,
+            enable_context_manager=enable_context_manager,
+            agent_config=agent_config,
+            is_agent_builder=is_agent_builder,
+            target_agent_id=target_agent_id,
+        )
 
-    # Try to acquire a lock for this agent run
-    lock_acquired = await redis.set(
-        run_lock_key, instance_id, nx=True, ex=redis.REDIS_KEY_TTL
-    )
 
-    if not lock_acquired:
-        # Check if the run is already being handled by another instance
-        existing_instance = await redis.get(run_lock_key)
-        if existing_instance:
-            logger.info(
-                f"Agent run {agent_run_id} is already being processed by instance {existing_instance.decode() if isinstance(existing_instance, bytes) else existing_instance}. Skipping duplicate execution."
-            )
+@dramatiq.actor
+async def run_next_agent_run():
+    """Run the next queued agent run; one message is sent for every queued run."""
+    try:
+        await initialize()
+    except Exception as e:
+        logger.critical(f"Failed to initialize Redis connection: {e}")
+        raise e
+
+    # Take a slot before choosing the run, so priority is applied when capacity frees up
+    async with worker_limits.run_limit.slot():
+        queued = await run_queue.dequeue_run()
+        if not queued:
+            logger.warning("Received a run queue message but no agent run was pending")
             return
-        else:
-            # Lock exists but no value, try to acquire again
-            lock_acquired = await redis.set(
-                run_lock_key, instance_id, nx=True, ex=redis.REDIS_KEY_TTL
-            )
-            if not lock_acquired:
-                logger.info(
-                    f"Agent run {agent_run_id} is already being processed by another instance. Skipping duplicate execution."
-                )
-                return
+        run_kwargs = queued["kwargs"]
+        if not await _is_run_still_pending(run_kwargs["agent_run_id"]):
+            logger.info(f"Skipping queued agent run {run_kwargs['agent_run_id']}: it was stopped while queued")
+            await run_queue.ack_run(run_kwargs["agent_run_id"])
+            return
+        await run_checkpoints.register_run(run_kwargs["agent_run_id"], queued["tier"], queued["account_id"], run_kwargs)
+        async with worker_limits.track_run(run_kwargs["agent_run_id"], enqueued_at=queued["enqueued_at"]):
+            await _run_agent(**run_kwargs)
+
+
+async def _is_run_still_pending(agent_run_id: str) -> bool:
+    """Whether a dequeued run should still start (it may have been stopped while waiting in the queue)."""
+    try:
+        client = await db.client
+        result = await client.table('agent_runs').select('status').eq('id', agent_run_id).maybe_single().execute()
+    except Exception as e:
+        logger.warning(f"Failed to check status of queued agent run {agent_run_id}, starting it anyway: {e}")
+        return True
+    return bool(result and result.data and result.data.get('status') == 'running')
+
+
+async def enqueue_agent_run(tier: str, account_id: str, **run_kwargs):
+    """Queue an agent run in its subscription tier and wake a worker to pick up the next run.
+
+    Args:
+        tier: Queue tier (see services.run_queue.get_run_queue_tier)
+        account_id: Account that started the run
+        **run_kwargs: Arguments of _run_agent
+    """
+    await run_queue.enqueue_run(tier, account_id, run_kwargs)
+    run_next_agent_run.send()
+
+
+async def _resume_abandoned_runs():
+    """Janitor: enqueue runs again whose worker stopped renewing their lease, so they continue from their checkpoint.
+
+    Also puts back runs that were dequeued but never reached their lease.
+    """
+    while True:
+        await asyncio.sleep(config.RUN_JANITOR_INTERVAL)
+        try:
+            # One worker scans per interval
+            if not await redis.set(run_checkpoints.JANITOR_LOCK_KEY, worker_instance_id, nx=True, ex=config.RUN_JANITOR_INTERVAL):
+                continue
+            for agent_run_id in await run_checkpoints.claim_expired_runs():
+                await _resume_abandoned_run(agent_run_id)
+            # Runs whose worker died between dequeuing them and taking their lease
+            for _ in range(await run_queue.requeue_unclaimed_runs()):
+                run_next_agent_run.send()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error while resuming abandoned agent runs: {e}", exc_info=True)
+
+
+async def _resume_abandoned_run(agent_run_id: str):
+    run = await run_checkpoints.get_registered_run(agent_run_id)
+    if not run:
+        logger.warning(f"Agent run {agent_run_id} lost its worker but has no checkpoint to resume from")
+        await run_checkpoints.forget_run(agent_run_id)
+        return
+    if not await _is_run_still_pending(agent_run_id):
+        await run_checkpoints.forget_run(agent_run_id)
+        return
+
+    checkpoint = await run_checkpoints.mark_resumed(agent_run_id)
+    if checkpoint.resume_count > config.RUN_MAX_RESUMES:
+        error_message = f"Agent run was interrupted {config.RUN_MAX_RESUMES} times and was not resumed again"
+        logger.error(f"Agent run {agent_run_id}: {error_message}")
+        await redis.rpush(f"agent_run:{agent_run_id}:responses", json.dumps({"type": "status", "status": "error", "message": error_message}))
+        await redis.publish(f"agent_run:{agent_run_id}:new_response", "new")
+        all_responses = [json.loads(r) for r in await redis.lrange(f"agent_run:{agent_run_id}:responses", 0, -1)]
+        await update_agent_run_status(
+            await db.client, agent_run_id, "failed", error=error_message, responses=compact_responses(all_responses)
+        )
+        await redis.publish(f"agent_run:{agent_run_id}:control", "ERROR")
+        await _cleanup_redis_response_list(agent_run_id)
+        await run_checkpoints.forget_run(agent_run_id)
+        return
+
+    logger.warning(
+        f"Agent run {agent_run_id} lost its worker; enqueueing it to resume after "
+        f"{checkpoint.iteration_count} iterations (resume {checkpoint.resume_count})"
+    )
+    await enqueue_agent_run(run["tier"], run["account_id"], **run["kwargs"])
+
+
+async def _run_agent(
+    agent_run_id: str,
+    thread_id: str,
+    project_id: str,
+    model_name: str,
+    enable_thinking: Optional[bool],
+    reasoning_effort: Optional[str],
+    stream: bool,
+    enable_context_manager: bool,
+    agent_config: Optional[dict] = None,
+    is_agent_builder: Optional[bool] = False,
+    target_agent_id: Optional[str] = None,
+):
+    instance_id = worker_instance_id
+
+    # Idempotency check: prevent duplicate runs. The lock is a lease this worker keeps
+    # renewing, so it expires soon after a crash and the janitor can resume the run.
+    leased = await run_checkpoints.acquire_lease(agent_run_id, instance_id)
+    # From here the lease (or the worker already holding it) covers a crash, not the queue
+    await run_queue.ack_run(agent_run_id)
+    if not leased:
+        existing_instance = await redis.get(f"{run_checkpoints.LOCK_KEY_PREFIX}{agent_run_id}")
+        logger.info(
+            f"Agent run {agent_run_id} is already being processed by instance {existing_instance or 'unknown'}. Skipping duplicate execution."
+        )
+        return
+
+    checkpoint = await run_checkpoints.RunCheckpoint.load(agent_run_id)
 
     sentry.sentry.set_tag("thread_id", thread_id)
 
@@ -129,9 +284,13 @@ async def run_agent_background(
     client = await db.client
     start_time = datetime.now(timezone.utc)
     total_responses = 0
+    compacted_responses = CompactedResponses()  # What's persisted to agent_runs.responses
     pubsub = None
     stop_checker = None
+    lease_keeper = None
     stop_signal_received = False
+    lease_lost = False
+    final_status = "running"
 
     # Define Redis keys and channels
     response_list_key = f"agent_run:{agent_run_id}:responses"
@@ -178,6 +337,21 @@ async def run_agent_background(
             )
             stop_signal_received = True  # Stop the run if the checker fails
 
+    async def keep_lease():
+        nonlocal lease_lost
+        try:
+            while True:
+                await asyncio.sleep(config.RUN_LEASE_TTL / 3)
+                try:
+                    if not await run_checkpoints.renew_lease(agent_run_id, instance_id):
+                        logger.error(f"Lost the lease of agent run {agent_run_id} (Instance: {instance_id})")
+                        lease_lost = True
+                        return
+                except Exception as e:
+                    logger.warning(f"Failed to renew lease of agent run {agent_run_id}: {e}")
+        except asyncio.CancelledError:
+            pass
+
     trace = langfuse.trace(
         name="agent_run",
         id=agent_run_id,
@@ -203,6 +377,18 @@ async def run_agent_background(
             f"Subscribed to control channels: {instance_control_channel}, {global_control_channel}"
         )
         stop_checker = asyncio.create_task(check_for_stop_signal())
+        lease_keeper = asyncio.create_task(keep_lease())
+
+        if checkpoint.is_resumed:
+            logger.info(
+                f"Resuming agent run {agent_run_id} after {checkpoint.iteration_count} iterations "
+                f"(resume {checkpoint.resume_count}, last message {checkpoint.last_message_id})"
+            )
+            await redis.rpush(response_list_key, json.dumps({
+                "type": "status", "status": "resumed",
+                "message": "Resuming the agent run after a worker interruption",
+            }))
+            await redis.publish(response_channel, "new")
 
         # Ensure active run key exists and has TTL
         await redis.set(instance_active_key, "running", ex=redis.REDIS_KEY_TTL)
@@ -220,14 +406,19 @@ async def run_agent_background(
             trace=trace,
             is_agent_builder=is_agent_builder,
             target_agent_id=target_agent_id,
+            checkpoint=checkpoint,
         )
 
-        final_status = "running"
         error_message = None
 
         pending_redis_operations = []
 
         async for response in agent_gen:
+            if lease_lost:
+                # Another worker may have resumed the run; leave its status to that worker
+                logger.error(f"Abandoning agent run {agent_run_id}: its lease expired (Instance: {instance_id})")
+                return
+
             if stop_signal_received:
                 logger.info(f"Agent run {agent_run_id} stopped by signal.")
                 final_status = "stopped"
@@ -245,6 +436,7 @@ async def run_agent_background(
                 asyncio.create_task(redis.publish(response_channel, "new"))
             )
             total_responses += 1
+            compacted_responses.add(response)
 
             # Check for agent-signaled completion or error
             if response.get("type") == "status":
@@ -276,21 +468,19 @@ async def run_agent_background(
                 status_message="agent_run_completed"
             )
             await redis.rpush(response_list_key, json.dumps(completion_message))
+            compacted_responses.add(completion_message)
             await redis.publish(
                 response_channel, "new"
             )  # Notify about the completion message
 
-        # Fetch final responses from Redis for DB update
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-
-        # Update DB status
+        # Update DB status with the compacted responses (the full stream stays in Redis until its TTL)
+        raw_stream_path = await _archive_response_stream(client, agent_run_id, pending_redis_operations)
         await update_agent_run_status(
             client,
             agent_run_id,
             final_status,
             error=error_message,
-            responses=all_responses,
+            responses=compacted_responses.as_list(raw_stream_path),
         )
 
         # Publish final control signal (END_STREAM or ERROR)
@@ -332,24 +522,16 @@ async def run_agent_background(
                 f"Failed to push error response to Redis for {agent_run_id}: {redis_err}"
             )
 
-        # Fetch final responses (including the error)
-        all_responses = []
-        try:
-            all_responses_json = await redis.lrange(response_list_key, 0, -1)
-            all_responses = [json.loads(r) for r in all_responses_json]
-        except Exception as fetch_err:
-            logger.error(
-                f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}"
-            )
-            all_responses = [error_response]  # Use the error message we tried to push
+        compacted_responses.add(error_response)
 
         # Update DB status
+        raw_stream_path = await _archive_response_stream(client, agent_run_id, pending_redis_operations)
         await update_agent_run_status(
             client,
             agent_run_id,
             "failed",
             error=f"{error_message}\n{traceback_str}",
-            responses=all_responses,
+            responses=compacted_responses.as_list(raw_stream_path),
         )
 
         # Publish ERROR signal
@@ -360,6 +542,9 @@ async def run_agent_background(
             logger.warning(f"Failed to publish ERROR signal: {str(e)}")
 
     finally:
+        if lease_keeper and not lease_keeper.done():
+            lease_keeper.cancel()
+
         # Cleanup stop checker task
         if stop_checker and not stop_checker.done():
             stop_checker.cancel()
@@ -385,8 +570,10 @@ async def run_agent_background(
         # Remove the instance-specific active run key
         await _cleanup_redis_instance_key(agent_run_id)
 
-        # Clean up the run lock
-        await _cleanup_redis_run_lock(agent_run_id)
+        # Release the run lease; a run that didn't reach a final status stays tracked for the janitor
+        await run_checkpoints.release_lease(
+            agent_run_id, instance_id, finished=final_status != "running" and not lease_lost
+        )
 
         # Wait for all pending redis operations to complete, with timeout
         try:
@@ -405,10 +592,7 @@ async def run_agent_background(
 
 async def _cleanup_redis_instance_key(agent_run_id: str):
     """Clean up the instance-specific Redis key for an agent run."""
-    if not instance_id:
-        logger.warning("Instance ID not set, cannot clean up instance key.")
-        return
-    key = f"active_run:{instance_id}:{agent_run_id}"
+    key = f"active_run:{worker_instance_id}:{agent_run_id}"
     logger.debug(f"Cleaning up Redis instance key: {key}")
     try:
         await redis.delete(key)
@@ -417,17 +601,15 @@ async def _cleanup_redis_instance_key(agent_run_id: str):
         logger.warning(f"Failed to clean up Redis key {key}: {str(e)}")
 
 
-async def _cleanup_redis_run_lock(agent_run_id: str):
-    """Clean up the run lock Redis key for an agent run."""
-    run_lock_key = f"agent_run_lock:{agent_run_id}"
-    logger.debug(f"Cleaning up Redis run lock key: {run_lock_key}")
+async def _archive_response_stream(client, agent_run_id: str, pending_redis_operations: list) -> Optional[str]:
+    """Archive the run's raw response stream once all of it has reached Redis (if archiving is enabled)."""
+    if not config.ARCHIVE_RUN_STREAMS:
+        return None
     try:
-        await redis.delete(run_lock_key)
-        logger.debug(f"Successfully cleaned up Redis run lock key: {run_lock_key}")
-    except Exception as e:
-        logger.warning(
-            f"Failed to clean up Redis run lock key {run_lock_key}: {str(e)}"
-        )
+        await asyncio.wait_for(asyncio.gather(*pending_redis_operations), timeout=30.0)
+    except asyncio.TimeoutError:
+        logger.warning(f"Timeout waiting for pending Redis operations before archiving {agent_run_id}")
+    return await archive_raw_stream(client, agent_run_id)
 
 
 # TTL for Redis response lists (24 hours)
@@ -475,35 +657,22 @@ async def update_agent_run_status(
         # Retry up to 3 times
         for retry in range(3):
             try:
+                # Only the matched row count comes back, not the row (and its responses) again
                 update_result = (
                     await client.table("agent_runs")
-                    .update(update_data)
+                    .update(update_data, count="exact", returning="minimal")
                     .eq("id", agent_run_id)
                     .execute()
                 )
 
-                if hasattr(update_result, "data") and update_result.data:
+                if getattr(update_result, "count", None):
                     logger.info(
                         f"Successfully updated agent run {agent_run_id} status to '{status}' (retry {retry})"
                     )
-
-                    # Verify the update
-                    verify_result = (
-                        await client.table("agent_runs")
-                        .select("status", "completed_at")
-                        .eq("id", agent_run_id)
-                        .execute()
-                    )
-                    if verify_result.data:
-                        actual_status = verify_result.data[0].get("status")
-                        completed_at = verify_result.data[0].get("completed_at")
-                        logger.info(
-                            f"Verified agent run update: status={actual_status}, completed_at={completed_at}"
-                        )
                     return True
                 else:
                     logger.warning(
-                        f"Database update returned no data for agent run {agent_run_id} on retry {retry}: {update_result}"
+                        f"Database update matched no rows for agent run {agent_run_id} on retry {retry}: {update_result}"
                     )
                     if retry == 2:  # Last retry
                         logger.error(
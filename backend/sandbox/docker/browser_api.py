@@ -10,11 +10,63 @@ from dataclasses import dataclass, field
 from datetime import datetime
 import os
 import random
-from functools import cached_property
+from functools import cached_property, partial
 import traceback
 import pytesseract
 from PIL import Image
 import io
+from urllib.parse import urlparse
+
+#######################################################
+# Lean browsing defaults
+#######################################################
+
+# Resource types aborted in lean mode. Stylesheets and scripts are kept so the
+# DOM (and element visibility) still matches what a normal browser would see.
+LEAN_BLOCKED_RESOURCE_TYPES = ["image", "media", "font"]
+
+# Third-party analytics / ad domains that never contribute page text
+LEAN_BLOCKED_DOMAINS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "doubleclick.net",
+    "adservice.google.com",
+    "connect.facebook.net",
+    "hotjar.com",
+    "segment.io",
+    "segment.com",
+    "mixpanel.com",
+    "scorecardresearch.com",
+    "quantserve.com",
+    "taboola.com",
+    "outbrain.com",
+    "criteo.com",
+    "amazon-adsystem.com",
+]
+
+# Aborted requests never report a size, so savings are estimated from
+# typical per-type transfer sizes (bytes).
+LEAN_ESTIMATED_RESOURCE_BYTES = {
+    "image": 45_000,
+    "media": 500_000,
+    "font": 35_000,
+    "script": 30_000,
+    "stylesheet": 15_000,
+    "xhr": 5_000,
+    "fetch": 5_000,
+}
+LEAN_DEFAULT_ESTIMATED_BYTES = 5_000
+
+LEAN_DISABLE_ANIMATIONS_CSS = """
+*, *::before, *::after {
+    animation-duration: 0s !important;
+    animation-delay: 0s !important;
+    transition-duration: 0s !important;
+    transition-delay: 0s !important;
+    scroll-behavior: auto !important;
+}
+"""
 
 #######################################################
 # Action model definitions
@@ -33,6 +85,7 @@ class ClickCoordinatesAction(BaseModel):
 
 class GoToUrlAction(BaseModel):
     url: str
+    lean: Optional[bool] = None  # Overrides the session lean mode for this navigation only
 
 class InputTextAction(BaseModel):
     index: int
@@ -75,6 +128,12 @@ class DoneAction(BaseModel):
     success: bool = True
     text: str = ""
 
+class LeanModeAction(BaseModel):
+    enabled: bool = True
+    block_resource_types: Optional[List[str]] = None
+    block_domains: Optional[List[str]] = None
+    disable_animations: bool = True
+
 #######################################################
 # DOM Structure Models
 #######################################################
@@ -264,6 +323,7 @@ class BrowserActionResult(BaseModel):
     pixels_below: int = 0
     content: Optional[str] = None
     ocr_text: Optional[str] = None  # Added field for OCR text
+    lean_stats: Optional[Dict[str, Any]] = None  # Blocked request counters when lean mode is active
     
     # Additional metadata
     element_count: int = 0  # Number of interactive elements found
@@ -290,6 +350,15 @@ class BrowserAutomation:
         self.screenshot_dir = os.path.join(os.getcwd(), "screenshots")
         os.makedirs(self.screenshot_dir, exist_ok=True)
         
+        # Lean mode: abort heavy resources / trackers when only DOM text is needed
+        self.lean_mode: bool = False
+        self.lean_blocked_resource_types = set(LEAN_BLOCKED_RESOURCE_TYPES)
+        self.lean_blocked_domains: List[str] = list(LEAN_BLOCKED_DOMAINS)
+        self.lean_disable_animations: bool = True
+        self.lean_route_installed: bool = False
+        self.lean_stats: Dict[str, Any] = self._empty_lean_stats()
+        self.lean_navigation_stats: Dict[str, Any] = self._empty_lean_stats()
+        
         # Register routes
         self.router.on_startup.append(self.startup)
         self.router.on_shutdown.append(self.shutdown)
@@ -326,6 +395,10 @@ class BrowserAutomation:
         
         # Drag and drop
         self.router.post("/automation/drag_drop")(self.drag_drop)
+        
+        # Lean browsing mode
+        self.router.post("/automation/set_lean_mode")(self.set_lean_mode)
+        self.router.get("/automation/lean_stats")(self.get_lean_stats)
 
     async def startup(self):
         """Initialize the browser instance on startup"""
@@ -393,6 +466,113 @@ class BrowserAutomation:
         self.pages.append(page)
         self.current_page_index = len(self.pages) - 1
         print(f"Page created: {page.url}; current page index: {self.current_page_index}")
+        if self.lean_mode:
+            await self.apply_lean_page_settings(page)
+    
+    # Lean Mode Helpers
+    
+    @staticmethod
+    def _empty_lean_stats() -> Dict[str, Any]:
+        return {"blocked_requests": 0, "estimated_bytes_saved": 0, "blocked_by_type": {}}
+    
+    def is_blocked_domain(self, url: str) -> bool:
+        """Check if a URL's host matches (or is a subdomain of) a blocked domain"""
+        host = (urlparse(url).hostname or "").lower()
+        if not host:
+            return False
+        return any(host == domain or host.endswith("." + domain) for domain in self.lean_blocked_domains)
+    
+    def record_blocked_request(self, resource_type: str, request_stats: Optional[Dict[str, Any]] = None):
+        estimated = LEAN_ESTIMATED_RESOURCE_BYTES.get(resource_type, LEAN_DEFAULT_ESTIMATED_BYTES)
+        for stats in filter(None, (self.lean_stats, request_stats)):
+            stats["blocked_requests"] += 1
+            stats["estimated_bytes_saved"] += estimated
+            stats["blocked_by_type"][resource_type] = stats["blocked_by_type"].get(resource_type, 0) + 1
+    
+    async def handle_lean_route(self, route, request, lean: Optional[bool] = None,
+                                request_stats: Optional[Dict[str, Any]] = None):
+        """Abort heavy resources while lean mode is active.
+
+        Installed context-wide for session lean mode (lean=None follows lean_mode), and
+        per page for the duration of a navigation with the request's own lean flag and
+        stats bound in, so concurrent requests never share that state.
+        """
+        if lean is None:
+            lean = self.lean_mode
+        try:
+            if not lean or request.is_navigation_request():
+                await route.continue_()
+                return
+            
+            resource_type = request.resource_type
+            if resource_type in self.lean_blocked_resource_types or self.is_blocked_domain(request.url):
+                self.record_blocked_request(resource_type, request_stats)
+                await route.abort("blockedbyclient")
+                return
+            
+            await route.continue_()
+        except Exception as e:
+            # The page may have navigated away or closed while the request was pending
+            print(f"Lean route handling error for {request.url}: {e}")
+    
+    async def install_lean_route(self):
+        if self.lean_route_installed or not self.browser_context:
+            return
+        await self.browser_context.route("**/*", self.handle_lean_route)
+        self.lean_route_installed = True
+    
+    async def remove_lean_route(self):
+        if not self.lean_route_installed or not self.browser_context:
+            return
+        await self.browser_context.unroute("**/*", self.handle_lean_route)
+        self.lean_route_installed = False
+    
+    async def apply_lean_page_settings(self, page: Page):
+        """Reduce motion and freeze CSS animations/transitions on a page"""
+        if not self.lean_disable_animations:
+            return
+        try:
+            await page.emulate_media(reduced_motion="reduce")
+            await page.add_style_tag(content=LEAN_DISABLE_ANIMATIONS_CSS)
+        except Exception as e:
+            print(f"Error applying lean page settings: {e}")
+    
+    async def reset_lean_page_settings(self):
+        for page in self.pages:
+            try:
+                await page.emulate_media(reduced_motion="no-preference")
+            except Exception as e:
+                print(f"Error resetting lean page settings: {e}")
+    
+    async def begin_lean_request(self, page: Page, lean: Optional[bool]):
+        """Route the page through a handler bound to this request's lean flag and stats.
+
+        Page routes take precedence over the context-wide route, so the request's flag
+        (or the session's, when the request doesn't set one) decides for this navigation.
+        Returns the handler and its stats; pass the handler to end_lean_request.
+        """
+        request_stats = self._empty_lean_stats()
+        handler = partial(
+            self.handle_lean_route,
+            lean=self.lean_mode if lean is None else lean,
+            request_stats=request_stats,
+        )
+        await page.route("**/*", handler)
+        return handler, request_stats
+    
+    async def end_lean_request(self, page: Page, handler):
+        try:
+            await page.unroute("**/*", handler)
+        except Exception as e:
+            # The page may have been closed during the request
+            print(f"Error removing lean request route: {e}")
+    
+    def lean_stats_snapshot(self, navigation_stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        navigation_stats = navigation_stats or self.lean_navigation_stats
+        return {
+            "session": {**self.lean_stats, "blocked_by_type": dict(self.lean_stats["blocked_by_type"])},
+            "last_navigation": {**navigation_stats, "blocked_by_type": dict(navigation_stats["blocked_by_type"])},
+        }
     
     async def get_current_page(self) -> Page:
         """Get the current active page"""
@@ -766,6 +946,9 @@ class BrowserAutomation:
                 ocr_text = await self.extract_ocr_text_from_screenshot(screenshot)
                 metadata['ocr_text'] = ocr_text
             
+            if self.lean_mode:
+                metadata['lean_stats'] = self.lean_stats_snapshot()
+            
             print(f"Got updated state after {action_name}: {len(dom_state.selector_map)} elements")
             return dom_state, screenshot, elements, metadata
         except Exception as e:
@@ -794,6 +977,7 @@ class BrowserAutomation:
             pixels_below=dom_state.pixels_below if dom_state else 0,
             content=content,
             ocr_text=metadata.get('ocr_text', ""),
+            lean_stats=metadata.get('lean_stats'),
             element_count=metadata.get('element_count', 0),
             interactive_elements=metadata.get('interactive_elements', []),
             viewport_width=metadata.get('viewport_width', 0),
@@ -804,17 +988,30 @@ class BrowserAutomation:
     
     async def navigate_to(self, action: GoToUrlAction = Body(...)):
         """Navigate to a specified URL"""
+        page = None
+        lean_handler = None
+        lean = self.lean_mode if action.lean is None else action.lean
         try:
             page = await self.get_current_page()
+            lean_handler, navigation_stats = await self.begin_lean_request(page, action.lean)
             await page.goto(action.url, wait_until="domcontentloaded")
             await page.wait_for_load_state("networkidle", timeout=10000)
+            if lean:
+                await self.apply_lean_page_settings(page)
             
             # Get updated state after action
             dom_state, screenshot, elements, metadata = await self.get_updated_browser_state(f"navigate_to({action.url})")
             
+            message = f"Navigated to {action.url}"
+            if lean:
+                self.lean_navigation_stats = navigation_stats
+                metadata['lean_stats'] = self.lean_stats_snapshot(navigation_stats)
+                message += (f" (lean mode: blocked {navigation_stats['blocked_requests']} requests, "
+                            f"~{navigation_stats['estimated_bytes_saved'] // 1024} KB saved)")
+            
             result = self.build_action_result(
                 True,
-                f"Navigated to {action.url}",
+                message,
                 dom_state,
                 screenshot,
                 elements,
@@ -852,6 +1049,9 @@ class BrowserAutomation:
                     error=str(e),
                     content=None
                 )
+        finally:
+            if lean_handler is not None:
+                await self.end_lean_request(page, lean_handler)
     
     async def search_google(self, action: SearchGoogleAction = Body(...)):
         """Search Google with the provided query"""
@@ -1838,6 +2038,48 @@ class BrowserAutomation:
                 content=None
             )
 
+    # Lean Mode Actions
+    
+    async def set_lean_mode(self, action: LeanModeAction = Body(...)):
+        """Enable or disable lean browsing for the whole session"""
+        try:
+            self.lean_mode = action.enabled
+            if action.block_resource_types is not None:
+                self.lean_blocked_resource_types = set(action.block_resource_types)
+            if action.block_domains is not None:
+                self.lean_blocked_domains = [domain.lower().lstrip(".") for domain in action.block_domains]
+            self.lean_disable_animations = action.disable_animations
+            
+            if self.lean_mode:
+                await self.install_lean_route()
+                for page in self.pages:
+                    await self.apply_lean_page_settings(page)
+            else:
+                await self.remove_lean_route()
+                await self.reset_lean_page_settings()
+            
+            state = "enabled" if self.lean_mode else "disabled"
+            print(f"Lean mode {state}: types={sorted(self.lean_blocked_resource_types)}, domains={len(self.lean_blocked_domains)}")
+            return BrowserActionResult(
+                success=True,
+                message=f"Lean mode {state}",
+                lean_stats=self.lean_stats_snapshot()
+            )
+        except Exception as e:
+            print(f"Error setting lean mode: {e}")
+            traceback.print_exc()
+            return BrowserActionResult(success=False, message=str(e), error=str(e))
+    
+    async def get_lean_stats(self):
+        """Report blocked request counters and estimated bytes saved"""
+        return {
+            "enabled": self.lean_mode,
+            "block_resource_types": sorted(self.lean_blocked_resource_types),
+            "block_domains": self.lean_blocked_domains,
+            "disable_animations": self.lean_disable_animations,
+            **self.lean_stats_snapshot()
+        }
+
 # Create singleton instance
 automation_service = BrowserAutomation()
 
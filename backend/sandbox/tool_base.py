@@ -13,6 +13,9 @@ class SandboxToolsBase(Tool):
     
     # Class variable to track if sandbox URLs have been printed
     _urls_printed = False
+
+    # Calls count against the worker's sandbox call limit (see utils/worker_limits.py)
+    uses_sandbox = True
     
     def __init__(self, project_id: str, thread_manager: Optional[ThreadManager] = None):
         super().__init__()
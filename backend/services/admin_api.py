@@ -16,6 +16,8 @@ from utils.config import config
 from services.supabase import DBConnection
 from utils.auth_utils import get_current_user_id_from_jwt
 from utils.admin_utils import is_admin_user, get_user_email
+from utils import worker_limits
+from services import run_queue
 from services.billing import (
     get_user_subscription,
     SUBSCRIPTION_TIERS,
@@ -299,3 +301,26 @@ async def add_user_to_pro_plan(
         raise HTTPException(
             status_code=500, detail=f"Error adding user to pro plan: {str(e)}"
         )
+
+
+@router.get("/metrics")
+async def get_worker_metrics(
+    current_user_id: str = Depends(get_current_user_id_from_jwt),
+):
+    """Run queue depths per tier, plus concurrency and resource usage reported by every live agent worker."""
+    await verify_admin_access(current_user_id)
+
+    try:
+        workers = await worker_limits.get_all_worker_metrics()
+        return {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "queues": await run_queue.get_queue_depths(),
+            "workers": workers,
+            "active_runs": sum(w["worker"]["runs"]["active"] for w in workers),
+            "waiting_runs": sum(w["worker"]["runs"]["waiting"] for w in workers),
+        }
+    except Exception as e:
+        logger.error(f"Error getting worker metrics: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Error getting worker metrics: {str(e)}"
+        )
@@ -0,0 +1,98 @@
+"""
+Admission control for agent starts.
+
+Before a run is created, the API estimates how long it would wait for a worker.
+The estimate uses:
+- live worker capacity (run limits and active runs, published by each worker)
+- the pending runs in the run queue ahead of it
+
+- If a worker slot is free, the run starts right away
+- If the wait is within the tier's limit (ADMISSION_MAX_WAIT_PAID / _FREE), the
+  run is accepted. The API publishes a "queued" status on its stream with its
+  position and estimated wait, so the user sees why nothing is happening yet
+- Otherwise the start is rejected with 429 and a Retry-After estimate, which keeps
+  latency bounded under load
+
+If no worker has reported capacity (or Redis fails), runs are admitted as before.
+"""
+
+import json
+import math
+from dataclasses import dataclass
+
+from services import redis, run_queue
+from utils import worker_limits
+from utils.config import config
+from utils.logger import logger
+
+DEFAULT_RUN_DURATION = 120  # Seconds per run, until workers have measured their own
+MIN_RETRY_AFTER = 5
+
+
+@dataclass
+class AdmissionDecision:
+    admitted: bool
+    queue_position: int = 0  # Runs that have to start before this one; 0 means it starts right away
+    estimated_wait: float = 0.0
+    retry_after: int = 0
+
+
+async def check_admission(tier: str) -> AdmissionDecision:
+    """Decide whether a new run of the given queue tier can be accepted now."""
+    if not config.ADMISSION_CONTROL_ENABLED:
+        return AdmissionDecision(admitted=True)
+
+    try:
+        workers = await worker_limits.get_worker_capacity()
+        if not workers:
+            return AdmissionDecision(admitted=True)
+        depths = await run_queue.get_queue_depths()
+    except Exception as e:
+        logger.warning(f"Admission control unavailable, admitting run: {e}")
+        return AdmissionDecision(admitted=True)
+
+    total_slots = sum(worker["limit"] for worker in workers)
+    free_slots = max(0, total_slots - sum(worker["active"] for worker in workers))
+    durations = [worker["avg_run_duration"] for worker in workers if worker.get("avg_run_duration")]
+    run_duration = sum(durations) / len(durations) if durations else DEFAULT_RUN_DURATION
+
+    # Runs in tiers with at least this tier's weight are served before it
+    weight = run_queue.TIER_WEIGHTS.get(tier, 0)
+    pending_ahead = sum(
+        depth["pending"] for queue_tier, depth in depths.items()
+        if run_queue.TIER_WEIGHTS[queue_tier] >= weight
+    )
+
+    queue_position = max(0, pending_ahead + 1 - free_slots)
+    estimated_wait = queue_position * run_duration / max(total_slots, 1)
+    max_wait = config.ADMISSION_MAX_WAIT_PAID if tier == "paid" else config.ADMISSION_MAX_WAIT_FREE
+
+    if estimated_wait > max_wait:
+        retry_after = max(MIN_RETRY_AFTER, math.ceil(estimated_wait - max_wait))
+        logger.warning(
+            f"Rejecting {tier} run: estimated wait {estimated_wait:.0f}s > {max_wait}s "
+            f"({pending_ahead} pending, {free_slots}/{total_slots} slots free)"
+        )
+        return AdmissionDecision(
+            admitted=False, queue_position=queue_position, estimated_wait=estimated_wait, retry_after=retry_after
+        )
+
+    return AdmissionDecision(admitted=True, queue_position=queue_position, estimated_wait=estimated_wait)
+
+
+async def publish_queued_status(agent_run_id: str, decision: AdmissionDecision):
+    """Put a "queued" status on the run's stream when it won't start right away."""
+    if decision.queue_position <= 0:
+        return
+    status = {
+        "type": "status",
+        "status": "queued",
+        "message": f"Waiting for an available worker (about {math.ceil(decision.estimated_wait)}s)",
+        "queue_position": decision.queue_position,
+        "estimated_wait": round(decision.estimated_wait, 1),
+    }
+    try:
+        await redis.rpush(f"agent_run:{agent_run_id}:responses", json.dumps(status))
+        await redis.publish(f"agent_run:{agent_run_id}:new_response", "new")
+    except Exception as e:
+        logger.warning(f"Failed to publish queued status for {agent_run_id}: {e}")
@@ -9,20 +9,32 @@ This module provides a unified interface for making API calls to different LLM p
 - Model-specific configurations
 - Comprehensive error handling and logging
 - Special handling for server overload scenarios (AnthropicException - Overloaded)
+- Provider-aware queueing and shared RPM/TPM budgets (services/llm_scheduler.py)
+- Time-to-first-token / stall watchdog and hedging for streams (services/llm_streaming.py)
+- Per-provider circuit breakers that route straight to fallbacks during outages
+- Opt-in Redis completion cache for deterministic utility calls (cache_ttl)
 
 Error Handling:
-- Rate limit errors: 30 second delay between retries
+- Rate limit errors: shared cooldown for the provider (Retry-After, else 30 seconds)
 - Server overload errors: 60+ second delay with exponential backoff
 - General errors: 0.1 second delay between retries
 - Maximum 3 retry attempts by default (configurable)
 """
 
-from typing import Union, Dict, Any, Optional, AsyncGenerator, List
+from typing import Union, Dict, Any, Optional, AsyncGenerator, List, Callable, Awaitable
 import os
 import json
+import time
+import hashlib
 import asyncio
 from openai import OpenAIError
 import litellm
+from services import llm_scheduler, redis
+from services.llm_streaming import guard_stream
+from services.prompt_cache import apply_cache_breakpoints
+from utils.circuit_breaker import CircuitOpenError
+from utils import worker_limits
+from services.llm_scheduler import PRIORITY_NORMAL
 from utils.logger import logger
 from utils.config import config
 
@@ -51,6 +63,30 @@ class LLMRetryError(LLMError):
         self.last_error = None
 
 
+# Completion cache (opt-in per call via cache_ttl)
+COMPLETION_CACHE_PREFIX = "llm_cache:"
+COMPLETION_CACHE_INDEX_KEY = "llm_cache:index"
+COMPLETION_CACHE_MAX_ENTRIES = 10000  # Oldest cached completions are evicted beyond this
+COMPLETION_CACHE_MAX_BYTES = 256_000
+# Parameters that determine a completion (api keys/bases and stream are deliberately excluded)
+COMPLETION_CACHE_KEY_PARAMS = (
+    "model",
+    "messages",
+    "temperature",
+    "top_p",
+    "max_tokens",
+    "max_completion_tokens",
+    "response_format",
+    "tools",
+    "tool_choice",
+    "reasoning_effort",
+    "model_id",
+)
+
+# Identical cached calls already in flight in this process (cache key -> future)
+_inflight_completions: Dict[str, asyncio.Future] = {}
+
+
 def setup_api_keys() -> None:
     """Set up API keys from environment variables."""
     providers = ["OPENAI", "ANTHROPIC", "GROQ", "OPENROUTER"]
@@ -130,6 +166,22 @@ def is_overload_error(error: Exception) -> bool:
     )
 
 
+def is_provider_failure(error: Exception) -> bool:
+    """Check if the error means the provider itself is failing (counts against its circuit breaker)."""
+    if isinstance(error, litellm.exceptions.RateLimitError):
+        return False
+    return is_overload_error(error) or isinstance(
+        error,
+        (
+            litellm.InternalServerError,
+            litellm.ServiceUnavailableError,
+            litellm.BadGatewayError,
+            litellm.Timeout,
+            litellm.APIConnectionError,
+        ),
+    )
+
+
 async def handle_error(error: Exception, attempt: int, max_attempts: int) -> None:
     """Handle API errors with appropriate delays and logging."""
     if isinstance(error, litellm.exceptions.RateLimitError):
@@ -246,7 +298,7 @@ def prepare_params(
                 f"Auto-set model_id for Claude 3.7 Sonnet: {params['model_id']}"
             )
 
-    # Apply Anthropic prompt caching (minimal implementation)
+    # Apply Anthropic prompt caching
     # Check model name *after* potential modifications (like adding bedrock/ prefix)
     effective_model_name = params.get(
         "model", model_name
@@ -255,84 +307,12 @@ def prepare_params(
         "claude" in effective_model_name.lower()
         or "anthropic" in effective_model_name.lower()
     ):
-        messages = params["messages"]  # Direct reference, modification affects params
-
         # Ensure messages is a list
-        if not isinstance(messages, list):
+        if not isinstance(params["messages"], list):
             return params  # Return early if messages format is unexpected
 
-        # 1. Process the first message if it's a system prompt with string content
-        if messages and messages[0].get("role") == "system":
-            content = messages[0].get("content")
-            if isinstance(content, str):
-                # Wrap the string content in the required list structure
-                messages[0]["content"] = [
-                    {
-                        "type": "text",
-                        "text": content,
-                        "cache_control": {"type": "ephemeral"},
-                    }
-                ]
-            elif isinstance(content, list):
-                # If content is already a list, check if the first text block needs cache_control
-                for item in content:
-                    if isinstance(item, dict) and item.get("type") == "text":
-                        if "cache_control" not in item:
-                            item["cache_control"] = {"type": "ephemeral"}
-                            break  # Apply to the first text block only for system prompt
-
-        # 2. Find and process relevant user and assistant messages (limit to 4 max)
-        last_user_idx = -1
-        second_last_user_idx = -1
-        last_assistant_idx = -1
-
-        for i in range(len(messages) - 1, -1, -1):
-            role = messages[i].get("role")
-            if role == "user":
-                if last_user_idx == -1:
-                    last_user_idx = i
-                elif second_last_user_idx == -1:
-                    second_last_user_idx = i
-            elif role == "assistant":
-                if last_assistant_idx == -1:
-                    last_assistant_idx = i
-
-            # Stop searching if we've found all needed messages (system, last user, second last user, last assistant)
-            found_count = sum(
-                idx != -1
-                for idx in [last_user_idx, second_last_user_idx, last_assistant_idx]
-            )
-            if found_count >= 3:
-                break
-
-        # Helper function to apply cache control
-        def apply_cache_control(message_idx: int, message_role: str):
-            if message_idx == -1:
-                return
-
-            message = messages[message_idx]
-            content = message.get("content")
-
-            if isinstance(content, str):
-                message["content"] = [
-                    {
-                        "type": "text",
-                        "text": content,
-                        "cache_control": {"type": "ephemeral"},
-                    }
-                ]
-            elif isinstance(content, list):
-                for item in content:
-                    if isinstance(item, dict) and item.get("type") == "text":
-                        if "cache_control" not in item:
-                            item["cache_control"] = {"type": "ephemeral"}
-
-        # Apply cache control to the identified messages (max 4: system, last user, second last user, last assistant)
-        # System message is always at index 0 if present
-        apply_cache_control(0, "system")
-        apply_cache_control(last_user_idx, "last user")
-        apply_cache_control(second_last_user_idx, "second last user")
-        apply_cache_control(last_assistant_idx, "last assistant")
+        # System prompt + longest stable prefix (see services/prompt_cache.py)
+        apply_cache_breakpoints(params["messages"])
 
     # Add reasoning_effort for Anthropic models if enabled
     use_thinking = enable_thinking if enable_thinking is not None else False
@@ -354,6 +334,112 @@ def prepare_params(
     return params
 
 
+def _completion_cache_key(params: Dict[str, Any]) -> str:
+    payload = {key: params.get(key) for key in COMPLETION_CACHE_KEY_PARAMS if params.get(key) is not None}
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{COMPLETION_CACHE_PREFIX}{digest}"
+
+
+async def _get_cached_completion(cache_key: str) -> Optional[litellm.ModelResponse]:
+    try:
+        cached = await redis.get(cache_key)
+        if cached:
+            return litellm.ModelResponse(**json.loads(cached))
+    except Exception as e:
+        logger.warning(f"Completion cache read failed: {str(e)}")
+    return None
+
+
+async def _set_cached_completion(cache_key: str, response: Any, ttl: int):
+    """Store a completion and keep the number of cached completions bounded."""
+    try:
+        data = response.model_dump() if hasattr(response, "model_dump") else dict(response)
+        json_content = json.dumps(data, default=str)
+        if len(json_content) > COMPLETION_CACHE_MAX_BYTES:
+            return
+        await redis.set(cache_key, json_content, ex=ttl)
+
+        # Index entries by insertion time and evict the oldest beyond the cap
+        redis_client = await redis.get_client()
+        await redis_client.zadd(COMPLETION_CACHE_INDEX_KEY, {cache_key: time.time()})
+        overflow = await redis_client.zcard(COMPLETION_CACHE_INDEX_KEY) - COMPLETION_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            evicted = await redis_client.zpopmin(COMPLETION_CACHE_INDEX_KEY, overflow)
+            if evicted:
+                await redis_client.delete(*[key for key, _ in evicted])
+    except Exception as e:
+        logger.warning(f"Completion cache write failed: {str(e)}")
+
+
+async def _cached_completion(params: Dict[str, Any], ttl: int, call: Callable[[], Awaitable[Any]]):
+    """Serve a non-streaming call from the completion cache, coalescing identical calls in flight."""
+    cache_key = _completion_cache_key(params)
+
+    cached = await _get_cached_completion(cache_key)
+    if cached is not None:
+        logger.info(f"Completion cache hit for {params['model']}")
+        return cached
+
+    inflight = _inflight_completions.get(cache_key)
+    if inflight:
+        logger.debug(f"Coalescing identical call to {params['model']}")
+        return await asyncio.shield(inflight)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight_completions[cache_key] = future
+    try:
+        response = await call()
+        future.set_result(response)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Mark retrieved when nobody else was waiting
+        raise
+    finally:
+        _inflight_completions.pop(cache_key, None)
+
+    await _set_cached_completion(cache_key, response, ttl)
+    return response
+
+
+async def _scheduled_completion(params: Dict[str, Any], priority: int):
+    """Run one litellm.acompletion through the provider scheduler, logging queue wait and latency separately."""
+    model_name = params["model"]
+    async with llm_scheduler.llm_slot(model_name, params, priority) as ticket:
+        ticket.started_at = time.monotonic()
+        response = await litellm.acompletion(**params)
+        await llm_scheduler.record_response(ticket, response)
+    logger.info(
+        f"LLM call to {model_name}: queue wait {ticket.queue_wait:.2f}s, "
+        f"{'stream opened' if params.get('stream') else 'latency'} {ticket.llm_latency:.2f}s"
+    )
+    return response
+
+
+async def _record_outcome(breaker, error: Exception, probe: bool):
+    if is_provider_failure(error):
+        await breaker.record_failure(error, probe=probe)
+    else:
+        # The provider answered (e.g. a bad request); it is up
+        await breaker.record_success(probe=probe)
+
+
+def _guarded_stream(response: Any, params: Dict[str, Any], priority: int) -> AsyncGenerator:
+    """Wrap a stream with the TTFT/stall watchdog, hedging to the fallback model when enabled."""
+    model_name = params["model"]
+    fallback_model = get_fallback_model(model_name) if config.LLM_ENABLE_FALLBACK else None
+    if not fallback_model or fallback_model == model_name:
+        return guard_stream(response, model_name)
+
+    async def open_hedge():
+        async with llm_scheduler.get_llm_breaker(fallback_model).guard(is_failure=is_provider_failure):
+            return await _scheduled_completion({**params, "model": fallback_model}, priority)
+
+    return guard_stream(response, model_name, open_hedge=open_hedge, hedge_model=fallback_model)
+
+
 async def make_llm_api_call(
     messages: List[Dict[str, Any]],
     model_name: str,
@@ -369,6 +455,8 @@ async def make_llm_api_call(
     model_id: Optional[str] = None,
     enable_thinking: Optional[bool] = False,
     reasoning_effort: Optional[str] = "low",
+    priority: int = PRIORITY_NORMAL,
+    cache_ttl: Optional[int] = None,
 ) -> Union[Dict[str, Any], AsyncGenerator]:
     """
     Make an API call to a language model using LiteLLM.
@@ -388,6 +476,8 @@ async def make_llm_api_call(
         model_id: Optional ARN for Bedrock inference profiles
         enable_thinking: Whether to enable thinking
         reasoning_effort: Level of reasoning effort
+        priority: Scheduler priority when the provider is saturated (lower is served first)
+        cache_ttl: Opt-in: serve identical non-streaming temperature-0 calls from the completion cache for this many seconds
 
     Returns:
         Union[Dict[str, Any], AsyncGenerator]: API response or stream
@@ -417,23 +507,69 @@ async def make_llm_api_call(
         enable_thinking=enable_thinking,
         reasoning_effort=reasoning_effort,
     )
+    # Only deterministic calls are cached; sampled ones should differ from call to call
+    if cache_ttl and not stream and temperature == 0:
+        return await _cached_completion(
+            params, cache_ttl, lambda: _call_with_retries(params, model_name, stream, priority)
+        )
+    if not stream:
+        return await _call_with_retries(params, model_name, stream, priority)
+
+    # Streams hold a worker slot until they are fully consumed
+    await worker_limits.llm_stream_limit.acquire()
+    try:
+        response = await _call_with_retries(params, model_name, stream, priority)
+    except BaseException:
+        worker_limits.llm_stream_limit.release()
+        raise
+    return worker_limits.hold_llm_stream_slot(response)
+
+
+async def _call_with_retries(
+    params: Dict[str, Any], model_name: str, stream: bool, priority: int
+) -> Union[Dict[str, Any], AsyncGenerator]:
+    """Run a prepared request with retries, circuit breaking and model fallback."""
+    breaker = llm_scheduler.get_llm_breaker(model_name)
     last_error = None
     for attempt in range(MAX_RETRIES):
+        probe = False
         try:
             logger.debug(f"Attempt {attempt + 1}/{MAX_RETRIES}")
             # logger.debug(f"API request parameters: {json.dumps(params, indent=2)}")
 
-            response = await litellm.acompletion(**params)
+            probe = await breaker.before_call()
+            response = await _scheduled_completion(params, priority)
+            await breaker.record_success(probe=probe)
             logger.debug(f"Successfully received API response from {model_name}")
             logger.debug(f"Response: {response}")
+            if stream:
+                return _guarded_stream(response, params, priority)
             return response
 
+        except CircuitOpenError as e:
+            # Provider is known to be down; skip the retry schedule and go to the fallback
+            last_error = e
+            logger.warning(f"Skipping {model_name}: {str(e)}")
+            break
+
+        except litellm.exceptions.RateLimitError as e:
+            last_error = e
+            await breaker.record_success(probe=probe)
+            if config.LLM_SCHEDULER_ENABLED:
+                # The scheduler holds every request to this provider until the cooldown ends
+                cooldown = await llm_scheduler.report_rate_limited(model_name, e)
+                logger.warning(
+                    f"Rate limit error on attempt {attempt + 1}/{MAX_RETRIES}, provider cooling down for {cooldown:.0f}s: {str(e)}"
+                )
+            else:
+                await handle_error(e, attempt, MAX_RETRIES)
+
         except (
-            litellm.exceptions.RateLimitError,
             OpenAIError,
             json.JSONDecodeError,
         ) as e:
             last_error = e
+            await _record_outcome(breaker, e, probe)
             await handle_error(e, attempt, MAX_RETRIES)
 
         except (
@@ -442,6 +578,7 @@ async def make_llm_api_call(
             litellm.BadGatewayError,
         ) as e:
             last_error = e
+            await breaker.record_failure(e, probe=probe)
             # Check if this is an overload error that should be retried
             if is_overload_error(e) and attempt < MAX_RETRIES - 1:
                 logger.warning(
@@ -454,11 +591,15 @@ async def make_llm_api_call(
                 raise LLMError(f"API call failed with server error: {str(e)}")
 
         except Exception as e:
+            await _record_outcome(breaker, e, probe)
             logger.error(f"Unexpected error during API call: {str(e)}", exc_info=True)
             raise LLMError(f"API call failed: {str(e)}")
 
-    # Try fallback model if original failed due to overload
-    if last_error and is_overload_error(last_error) and config.LLM_ENABLE_FALLBACK:
+    # Try fallback model if original failed due to overload or its circuit is open
+    provider_down = last_error is not None and (
+        is_overload_error(last_error) or isinstance(last_error, CircuitOpenError)
+    )
+    if provider_down and config.LLM_ENABLE_FALLBACK:
         fallback_model = get_fallback_model(model_name)
         if fallback_model and fallback_model != model_name:
             logger.warning(
@@ -469,8 +610,11 @@ async def make_llm_api_call(
                 fallback_params = params.copy()
                 fallback_params["model"] = fallback_model
 
-                response = await litellm.acompletion(**fallback_params)
+                async with llm_scheduler.get_llm_breaker(fallback_model).guard(is_failure=is_provider_failure):
+                    response = await _scheduled_completion(fallback_params, priority)
                 logger.info(f"Successfully used fallback model {fallback_model}")
+                if stream:
+                    return guard_stream(response, fallback_model)
                 return response
             except Exception as fallback_error:
                 logger.error(
@@ -478,7 +622,7 @@ async def make_llm_api_call(
                 )
 
     # Create a user-friendly error message
-    if last_error and is_overload_error(last_error):
+    if provider_down:
         user_friendly_msg = f"The AI service is currently experiencing high demand. Please try again in a few minutes."
         technical_msg = f"Failed to make API call after {MAX_RETRIES} attempts due to server overload. Last error: {str(last_error)}"
     else:
@@ -0,0 +1,489 @@
+"""
+Provider-aware scheduling and rate limiting for LLM calls.
+
+Every `make_llm_api_call` attempt goes through a scheduler bucket (a provider, or
+a specific model when it has its own limits configured) before hitting LiteLLM:
+
+1. Requests wait in a per-bucket priority queue and are admitted up to a local
+   concurrency limit (per process)
+2. Admission also reserves from RPM/TPM budgets kept in Redis fixed one-minute
+   windows, so every API instance and worker shares the same budget
+3. Rate-limit responses put the whole bucket into a shared cooldown, and
+   `x-ratelimit-*` response headers tighten the budgets to what the provider reports
+4. Queue wait and LLM latency are recorded separately (see `get_scheduler_metrics`)
+
+Limits come from LLM_DEFAULT_RPM / LLM_DEFAULT_TPM / LLM_MAX_CONCURRENCY, with
+per-provider or per-model overrides in LLM_RATE_LIMITS, e.g.
+`{"anthropic": {"rpm": 50, "tpm": 400000, "concurrency": 10}}`. A value of 0 means
+unlimited. If Redis is unavailable the shared budgets fail open.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services import redis
+from utils.circuit_breaker import CircuitBreaker, get_breaker
+from utils.config import config
+from utils.logger import logger
+
+# Priorities (lower is served first)
+PRIORITY_HIGH = 0  # interactive agent turns
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10  # background utility calls (naming, summaries)
+
+WINDOW_SECONDS = 60
+WINDOW_KEY_TTL = WINDOW_SECONDS * 2
+KEY_PREFIX = "llm_sched:"
+DEFAULT_COMPLETION_TOKENS = 1024
+MAX_COOLDOWN_SECONDS = 120
+
+# Atomic check-and-reserve against the shared one-minute window.
+# Returns 0 when the request was admitted, otherwise milliseconds to wait.
+_RESERVE_SCRIPT = """
+local now_ms = tonumber(ARGV[5])
+local cooldown_until = tonumber(redis.call('GET', KEYS[3]) or '0')
+if cooldown_until > now_ms then
+    return cooldown_until - now_ms
+end
+local tokens = tonumber(ARGV[1])
+local rpm = tonumber(ARGV[2])
+local tpm = tonumber(ARGV[3])
+local used_requests = tonumber(redis.call('GET', KEYS[1]) or '0')
+local used_tokens = tonumber(redis.call('GET', KEYS[2]) or '0')
+if rpm > 0 and used_requests + 1 > rpm then
+    return tonumber(ARGV[4])
+end
+if tpm > 0 and used_tokens > 0 and used_tokens + tokens > tpm then
+    return tonumber(ARGV[4])
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('INCRBY', KEYS[2], tokens)
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+return 0
+"""
+
+# Header names LiteLLM surfaces (optionally prefixed with "llm_provider-")
+_LIMIT_REQUESTS_HEADERS = ("x-ratelimit-limit-requests", "anthropic-ratelimit-requests-limit")
+_LIMIT_TOKENS_HEADERS = ("x-ratelimit-limit-tokens", "anthropic-ratelimit-tokens-limit")
+_REMAINING_REQUESTS_HEADERS = ("x-ratelimit-remaining-requests", "anthropic-ratelimit-requests-remaining")
+
+
+@dataclass
+class BucketLimits:
+    rpm: int = 0
+    tpm: int = 0
+    concurrency: int = 0
+
+
+@dataclass
+class BucketMetrics:
+    requests: int = 0
+    queued: int = 0
+    active: int = 0
+    rate_limited: int = 0
+    queue_wait_total: float = 0.0
+    queue_wait_max: float = 0.0
+    llm_latency_total: float = 0.0
+    llm_latency_max: float = 0.0
+    completed: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "queued": self.queued,
+            "active": self.active,
+            "rate_limited": self.rate_limited,
+            "avg_queue_wait": round(self.queue_wait_total / self.requests, 3) if self.requests else 0.0,
+            "max_queue_wait": round(self.queue_wait_max, 3),
+            "avg_llm_latency": round(self.llm_latency_total / self.completed, 3) if self.completed else 0.0,
+            "max_llm_latency": round(self.llm_latency_max, 3),
+        }
+
+
+@dataclass
+class SchedulerTicket:
+    """Handed to the caller for one admitted request."""
+    bucket: str
+    estimated_tokens: int
+    queue_wait: float = 0.0
+    window: Optional[int] = None
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def llm_latency(self) -> float:
+        return time.monotonic() - self.started_at
+
+
+def get_provider(model_name: str) -> str:
+    """Best-effort provider name for a LiteLLM model string."""
+    lower = model_name.lower()
+    if "/" in lower:
+        return lower.split("/", 1)[0]
+    if "claude" in lower:
+        return "anthropic"
+    if lower.startswith(("gpt", "o1", "o3", "o4")):
+        return "openai"
+    if "gemini" in lower:
+        return "gemini"
+    return "default"
+
+
+def get_llm_breaker(model_name: str) -> CircuitBreaker:
+    """Circuit breaker shared by every model of the same provider."""
+    return get_breaker(f"llm:{get_provider(model_name)}")
+
+
+def _load_limit_overrides() -> Dict[str, Dict[str, int]]:
+    raw = config.LLM_RATE_LIMITS
+    if not raw:
+        return {}
+    try:
+        overrides = json.loads(raw)
+        return {key.lower(): value for key, value in overrides.items() if isinstance(value, dict)}
+    except (ValueError, AttributeError) as e:
+        logger.warning(f"Ignoring invalid LLM_RATE_LIMITS: {e}")
+        return {}
+
+
+_limit_overrides = _load_limit_overrides()
+
+
+def resolve_bucket(model_name: str) -> Tuple[str, BucketLimits]:
+    """Pick the bucket (model if it has its own limits, else provider) and its configured limits."""
+    model_key = model_name.lower()
+    provider = get_provider(model_name)
+    bucket = model_key if model_key in _limit_overrides else provider
+    override = _limit_overrides.get(bucket, {})
+    limits = BucketLimits(
+        rpm=int(override.get("rpm", config.LLM_DEFAULT_RPM)),
+        tpm=int(override.get("tpm", config.LLM_DEFAULT_TPM)),
+        concurrency=int(override.get("concurrency", config.LLM_MAX_CONCURRENCY)),
+    )
+    return bucket, limits
+
+
+def estimate_tokens(params: Dict[str, Any]) -> int:
+    """Cheap prompt + completion token estimate used to reserve TPM budget."""
+    try:
+        prompt_chars = len(json.dumps(params.get("messages", []), default=str))
+    except (TypeError, ValueError):
+        prompt_chars = 0
+    completion = params.get("max_tokens") or params.get("max_completion_tokens") or DEFAULT_COMPLETION_TOKENS
+    return prompt_chars // 4 + int(completion)
+
+
+def _current_window() -> Tuple[int, int]:
+    """Return (window id, milliseconds until the next window)."""
+    now = time.time()
+    window = int(now // WINDOW_SECONDS)
+    remaining_ms = int(((window + 1) * WINDOW_SECONDS - now) * 1000) + 1
+    return window, remaining_ms
+
+
+def _header(headers: Dict[str, Any], names: Tuple[str, ...]) -> Optional[float]:
+    for name in names:
+        for key in (name, f"llm_provider-{name}"):
+            value = headers.get(key)
+            if value is None:
+                continue
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                continue
+    return None
+
+
+def _response_headers(response: Any) -> Dict[str, Any]:
+    hidden = getattr(response, "_hidden_params", None) or {}
+    headers = hidden.get("additional_headers") or {}
+    return {str(k).lower(): v for k, v in headers.items()}
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class _Bucket:
+    """Priority queue + dispatcher for one provider/model bucket in this process."""
+
+    def __init__(self, name: str, limits: BucketLimits):
+        self.name = name
+        self.configured = limits
+        self.limits = BucketLimits(limits.rpm, limits.tpm, limits.concurrency)
+        self.metrics = BucketMetrics()
+        self._waiters: List[Tuple[int, int, asyncio.Future, int]] = []
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._refunds: Set[asyncio.Task] = set()
+        self._redis_warned = False
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def acquire(self, priority: int, tokens: int) -> Optional[int]:
+        """Wait for admission; returns the budget window the request was charged to."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future, tokens))
+        self.metrics.queued += 1
+        self._ensure_dispatcher()
+        self._changed.set()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted by the dispatcher, but the caller was cancelled before it could
+                # use the slot (hedging, stop signal): give back the slot and the reservation
+                self.release()
+                refund = asyncio.create_task(self.refund(future.result(), tokens))
+                self._refunds.add(refund)
+                refund.add_done_callback(self._refunds.discard)
+            raise
+        finally:
+            self.metrics.queued -= 1
+            if future.cancelled():
+                self._changed.set()
+
+    def release(self):
+        self.metrics.active = max(0, self.metrics.active - 1)
+        self._changed.set()
+
+    async def _dispatch_loop(self):
+        while True:
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+
+            at_capacity = self.limits.concurrency > 0 and self.metrics.active >= self.limits.concurrency
+            if not self._waiters or at_capacity:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+
+            _, _, future, tokens = self._waiters[0]
+            window, wait_seconds = await self._reserve(tokens)
+            if wait_seconds > 0:
+                # Sleep until budget frees up, but re-evaluate early if a higher-priority request arrives
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=wait_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if not self._waiters or self._waiters[0][2] is not future:
+                # A higher-priority request arrived (or the head went away) while reserving:
+                # give the reservation back and serve the new head first
+                await self.refund(window, tokens)
+                continue
+            heapq.heappop(self._waiters)
+            if future.done():
+                # Cancelled while its budget was being reserved
+                await self.refund(window, tokens)
+                continue
+            self.metrics.active += 1
+            future.set_result(window)
+
+    async def _reserve(self, tokens: int) -> Tuple[Optional[int], float]:
+        """Reserve one request + `tokens` from the shared window; returns (window, seconds to wait)."""
+        if self.limits.rpm <= 0 and self.limits.tpm <= 0:
+            cooldown = await self._cooldown_remaining()
+            return None, cooldown
+
+        window, until_next_ms = _current_window()
+        try:
+            redis_client = await redis.get_client()
+            wait_ms = await redis_client.eval(
+                _RESERVE_SCRIPT,
+                3,
+                f"{KEY_PREFIX}{self.name}:{window}:requests",
+                f"{KEY_PREFIX}{self.name}:{window}:tokens",
+                f"{KEY_PREFIX}{self.name}:cooldown_until",
+                tokens,
+                self.limits.rpm,
+                self.limits.tpm,
+                until_next_ms,
+                int(time.time() * 1000),
+                WINDOW_KEY_TTL,
+            )
+            self._redis_warned = False
+        except Exception as e:
+            if not self._redis_warned:
+                logger.warning(f"LLM scheduler budget check failed for '{self.name}', admitting without shared limits: {e}")
+                self._redis_warned = True
+            return None, 0.0
+
+        wait_ms = int(wait_ms or 0)
+        if wait_ms > 0:
+            return None, wait_ms / 1000
+        return window, 0.0
+
+    async def _cooldown_remaining(self) -> float:
+        try:
+            cooldown_until = await redis.get(f"{KEY_PREFIX}{self.name}:cooldown_until")
+        except Exception:
+            return 0.0
+        if not cooldown_until:
+            return 0.0
+        return max(0.0, (int(cooldown_until) - time.time() * 1000) / 1000)
+
+    async def adjust_usage(self, window: Optional[int], token_delta: int):
+        """Correct the token reservation once the real usage is known (or refund it)."""
+        if window is None or token_delta == 0 or self.limits.tpm <= 0:
+            return
+        try:
+            redis_client = await redis.get_client()
+            await redis_client.incrby(f"{KEY_PREFIX}{self.name}:{window}:tokens", token_delta)
+        except Exception as e:
+            logger.debug(f"LLM scheduler usage adjustment failed for '{self.name}': {e}")
+
+    async def refund(self, window: Optional[int], tokens: int):
+        """Give back the request and tokens reserved for a request that was never sent."""
+        if window is None:
+            return
+        try:
+            redis_client = await redis.get_client()
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.decr(f"{KEY_PREFIX}{self.name}:{window}:requests")
+            if tokens:
+                pipe.decrby(f"{KEY_PREFIX}{self.name}:{window}:tokens", tokens)
+            await pipe.execute()
+        except Exception as e:
+            logger.debug(f"LLM scheduler refund failed for '{self.name}': {e}")
+
+    async def set_cooldown(self, seconds: float):
+        seconds = min(max(seconds, 1.0), MAX_COOLDOWN_SECONDS)
+        until_ms = int((time.time() + seconds) * 1000)
+        try:
+            await redis.set(f"{KEY_PREFIX}{self.name}:cooldown_until", str(until_ms), ex=int(seconds) + 1)
+        except Exception as e:
+            logger.debug(f"LLM scheduler could not share cooldown for '{self.name}': {e}")
+        self._changed.set()
+
+    def adapt_from_headers(self, headers: Dict[str, Any]):
+        """Tighten RPM/TPM to the limits the provider reports for our key."""
+        reported_rpm = _header(headers, _LIMIT_REQUESTS_HEADERS)
+        reported_tpm = _header(headers, _LIMIT_TOKENS_HEADERS)
+        if reported_rpm and (self.configured.rpm <= 0 or reported_rpm < self.configured.rpm):
+            if int(reported_rpm) != self.limits.rpm:
+                logger.info(f"LLM scheduler: '{self.name}' RPM limit adapted to {int(reported_rpm)} from response headers")
+            self.limits.rpm = int(reported_rpm)
+        if reported_tpm and (self.configured.tpm <= 0 or reported_tpm < self.configured.tpm):
+            if int(reported_tpm) != self.limits.tpm:
+                logger.info(f"LLM scheduler: '{self.name}' TPM limit adapted to {int(reported_tpm)} from response headers")
+            self.limits.tpm = int(reported_tpm)
+
+
+# (bucket name) -> (bucket, event loop it was created on)
+_buckets: Dict[str, Tuple[_Bucket, asyncio.AbstractEventLoop]] = {}
+
+
+def _get_bucket(model_name: str) -> _Bucket:
+    name, limits = resolve_bucket(model_name)
+    loop = asyncio.get_running_loop()
+    existing = _buckets.get(name)
+    if existing and existing[1] is loop:
+        return existing[0]
+    bucket = _Bucket(name, limits)
+    if existing:
+        # Keep limits learned from headers when the loop changes
+        bucket.limits = existing[0].limits
+        bucket.metrics = existing[0].metrics
+        bucket.metrics.active = 0
+        bucket.metrics.queued = 0
+    _buckets[name] = (bucket, loop)
+    return bucket
+
+
+@asynccontextmanager
+async def llm_slot(model_name: str, params: Dict[str, Any], priority: int = PRIORITY_NORMAL):
+    """
+    Wait for admission to call `model_name`, yielding a SchedulerTicket.
+
+    The concurrency slot is held for the body of the `async with`; for streamed
+    calls that is until the stream has been opened.
+    """
+    tokens = estimate_tokens(params)
+    if not config.LLM_SCHEDULER_ENABLED:
+        yield SchedulerTicket(bucket=get_provider(model_name), estimated_tokens=tokens)
+        return
+
+    bucket = _get_bucket(model_name)
+    enqueued_at = time.monotonic()
+    window = await bucket.acquire(priority, tokens)
+    queue_wait = time.monotonic() - enqueued_at
+
+    bucket.metrics.requests += 1
+    bucket.metrics.queue_wait_total += queue_wait
+    bucket.metrics.queue_wait_max = max(bucket.metrics.queue_wait_max, queue_wait)
+    if queue_wait > 1:
+        logger.info(f"LLM request for '{bucket.name}' waited {queue_wait:.2f}s in scheduler queue")
+
+    ticket = SchedulerTicket(bucket=bucket.name, estimated_tokens=tokens, queue_wait=queue_wait, window=window)
+    try:
+        yield ticket
+    finally:
+        bucket.release()
+
+
+async def record_response(ticket: SchedulerTicket, response: Any):
+    """Record latency, correct the token reservation and adapt limits from a response."""
+    latency = ticket.llm_latency
+    entry = _buckets.get(ticket.bucket)
+    if not entry:
+        return
+    bucket = entry[0]
+    bucket.metrics.completed += 1
+    bucket.metrics.llm_latency_total += latency
+    bucket.metrics.llm_latency_max = max(bucket.metrics.llm_latency_max, latency)
+
+    headers = _response_headers(response)
+    if headers:
+        bucket.adapt_from_headers(headers)
+        remaining = _header(headers, _REMAINING_REQUESTS_HEADERS)
+        if remaining is not None and remaining <= 0:
+            await bucket.set_cooldown(_header(headers, ("retry-after",)) or WINDOW_SECONDS / 2)
+
+    usage = getattr(response, "usage", None)
+    total_tokens = getattr(usage, "total_tokens", None) if usage is not None else None
+    if total_tokens:
+        await bucket.adjust_usage(ticket.window, int(total_tokens) - ticket.estimated_tokens)
+
+
+async def report_rate_limited(model_name: str, error: Exception) -> float:
+    """Put the model's bucket into a shared cooldown after a rate-limit error; returns the cooldown."""
+    delay = _retry_after(error) or float(config.LLM_RATE_LIMIT_DELAY)
+    if not config.LLM_SCHEDULER_ENABLED:
+        return delay
+    bucket = _get_bucket(model_name)
+    bucket.metrics.rate_limited += 1
+    await bucket.set_cooldown(delay)
+    return min(max(delay, 1.0), MAX_COOLDOWN_SECONDS)
+
+
+def get_scheduler_metrics() -> Dict[str, Dict[str, Any]]:
+    """Per-bucket queue/latency metrics for this process."""
+    metrics = {}
+    for name, (bucket, _) in _buckets.items():
+        metrics[name] = {
+            **bucket.metrics.as_dict(),
+            "rpm_limit": bucket.limits.rpm,
+            "tpm_limit": bucket.limits.tpm,
+            "concurrency_limit": bucket.limits.concurrency,
+        }
+    return metrics
@@ -0,0 +1,269 @@
+"""
+Watchdog and hedging for streaming LLM responses.
+
+`guard_stream` wraps the stream returned by `litellm.acompletion(stream=True)`:
+
+1. If no chunk arrives within LLM_STREAM_TTFT_TIMEOUT seconds, it raises StreamStallError.
+   After the first chunk, each gap between chunks is limited to LLM_STREAM_CHUNK_TIMEOUT.
+2. If LLM_HEDGE_DELAY is set and the primary model has produced nothing by then, a
+   request to the fallback model is started. Whichever stream yields its first
+   chunk first is kept and the other is closed.
+3. TTFT and tokens/sec are recorded per provider (see `get_stream_metrics`), and
+   stalls count as failures for the provider's circuit breaker.
+"""
+
+import asyncio
+import inspect
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from services.llm_scheduler import get_llm_breaker, get_provider
+from utils.config import config
+from utils.logger import logger
+
+
+class StreamStallError(Exception):
+    """Raised when a streaming LLM response misses its TTFT or inter-chunk deadline."""
+    pass
+
+
+@dataclass
+class StreamMetrics:
+    streams: int = 0
+    completed: int = 0
+    stalls: int = 0
+    hedges_started: int = 0
+    hedges_won: int = 0
+    ttft_total: float = 0.0
+    ttft_max: float = 0.0
+    tokens_per_second_total: float = 0.0
+    throughput_samples: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "streams": self.streams,
+            "completed": self.completed,
+            "stalls": self.stalls,
+            "hedges_started": self.hedges_started,
+            "hedges_won": self.hedges_won,
+            "avg_ttft": round(self.ttft_total / self.streams, 3) if self.streams else 0.0,
+            "max_ttft": round(self.ttft_max, 3),
+            "avg_tokens_per_second": round(self.tokens_per_second_total / self.throughput_samples, 1) if self.throughput_samples else 0.0,
+        }
+
+
+# provider -> metrics for this process
+_metrics: Dict[str, StreamMetrics] = {}
+
+# A candidate stream together with its iterator and first chunk (None if it ended empty)
+_Candidate = Tuple[str, Any, AsyncIterator, Any]
+
+
+def _metrics_for(model_name: str) -> StreamMetrics:
+    return _metrics.setdefault(get_provider(model_name), StreamMetrics())
+
+
+def get_stream_metrics() -> Dict[str, Dict[str, Any]]:
+    """Per-provider TTFT / throughput metrics for this process."""
+    return {provider: metrics.as_dict() for provider, metrics in _metrics.items()}
+
+
+async def _first_chunk(model_name: str, stream: Any) -> _Candidate:
+    iterator = stream.__aiter__()
+    try:
+        chunk = await iterator.__anext__()
+    except StopAsyncIteration:
+        chunk = None
+    return model_name, stream, iterator, chunk
+
+
+async def _open_and_first_chunk(model_name: str, open_stream: Callable[[], Awaitable[Any]]) -> _Candidate:
+    stream = await open_stream()
+    return await _first_chunk(model_name, stream)
+
+
+async def _close_stream(stream: Any):
+    """Best-effort close of an abandoned stream so its HTTP connection is released."""
+    for target in (stream, getattr(stream, "completion_stream", None)):
+        if target is None:
+            continue
+        close = getattr(target, "aclose", None) or getattr(target, "close", None)
+        if close is None:
+            continue
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+            return
+        except Exception as e:
+            logger.debug(f"Error closing abandoned LLM stream: {e}")
+
+
+async def _discard(task: asyncio.Task):
+    """Cancel a losing candidate and close its stream if it had already opened."""
+    if not task.done():
+        task.cancel()
+    try:
+        _, stream, _, _ = await task
+    except BaseException:
+        return
+    await _close_stream(stream)
+
+
+def _chunk_tokens(chunk: Any) -> int:
+    choices = getattr(chunk, "choices", None)
+    if not choices:
+        return 0
+    delta = getattr(choices[0], "delta", None)
+    if delta is None:
+        return 0
+    return 1 if (getattr(delta, "content", None) or getattr(delta, "reasoning_content", None) or getattr(delta, "tool_calls", None)) else 0
+
+
+async def _race_first_chunk(
+    model_name: str,
+    stream: Any,
+    started: float,
+    ttft_timeout: float,
+    hedge_delay: float,
+    hedge_model: Optional[str],
+    open_hedge: Optional[Callable[[], Awaitable[Any]]],
+) -> _Candidate:
+    """Wait for the first chunk from the primary stream, hedging to the fallback model if it is slow."""
+    tasks = {asyncio.create_task(_first_chunk(model_name, stream))}
+    can_hedge = open_hedge is not None and hedge_delay > 0
+    hedged = False
+    last_error: Optional[BaseException] = None
+
+    def start_hedge():
+        nonlocal hedged
+        hedged = True
+        _metrics_for(model_name).hedges_started += 1
+        logger.warning(f"No first token from {model_name} after {time.monotonic() - started:.1f}s, hedging with {hedge_model}")
+        tasks.add(asyncio.create_task(_open_and_first_chunk(hedge_model, open_hedge)))
+
+    try:
+        while True:
+            now = time.monotonic()
+            remaining = started + ttft_timeout - now
+            if remaining <= 0:
+                break
+            timeout = remaining
+            if can_hedge and not hedged:
+                until_hedge = started + hedge_delay - now
+                if until_hedge <= 0:
+                    start_hedge()
+                    continue
+                timeout = min(timeout, until_hedge)
+
+            if not tasks:
+                break
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.discard(task)
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    logger.warning(f"LLM stream candidate failed before its first chunk: {last_error}")
+                    continue
+                for other in tasks:
+                    asyncio.create_task(_discard(other))
+                tasks.clear()
+                return task.result()
+
+            if not tasks and last_error is not None:
+                if can_hedge and not hedged:
+                    # Primary failed outright; don't wait for the hedge delay
+                    start_hedge()
+                    continue
+                raise last_error
+    except BaseException:
+        for task in tasks:
+            asyncio.create_task(_discard(task))
+        raise
+
+    for task in tasks:
+        asyncio.create_task(_discard(task))
+    _metrics_for(model_name).stalls += 1
+    error = StreamStallError(f"No response from {model_name} within {ttft_timeout}s (time to first token)")
+    await get_llm_breaker(model_name).record_failure(error)
+    raise error
+
+
+async def guard_stream(
+    stream: Any,
+    model_name: str,
+    open_hedge: Optional[Callable[[], Awaitable[Any]]] = None,
+    hedge_model: Optional[str] = None,
+    ttft_timeout: Optional[float] = None,
+    chunk_timeout: Optional[float] = None,
+    hedge_delay: Optional[float] = None,
+) -> AsyncGenerator[Any, None]:
+    """
+    Yield chunks from `stream`, enforcing TTFT / inter-chunk deadlines and optionally hedging.
+
+    Args:
+        stream: The already-opened primary stream
+        model_name: Model the primary stream was requested from
+        open_hedge: Coroutine factory opening the same request against `hedge_model`
+        hedge_model: Fallback model used for hedging
+        ttft_timeout: Seconds to wait for the first chunk (default LLM_STREAM_TTFT_TIMEOUT)
+        chunk_timeout: Max seconds between chunks (default LLM_STREAM_CHUNK_TIMEOUT)
+        hedge_delay: Seconds before hedging; 0 disables (default LLM_HEDGE_DELAY)
+    """
+    ttft_timeout = ttft_timeout if ttft_timeout is not None else config.LLM_STREAM_TTFT_TIMEOUT
+    chunk_timeout = chunk_timeout if chunk_timeout is not None else config.LLM_STREAM_CHUNK_TIMEOUT
+    hedge_delay = hedge_delay if hedge_delay is not None else config.LLM_HEDGE_DELAY
+
+    started = time.monotonic()
+    winner_model, winner_stream, iterator, chunk = await _race_first_chunk(
+        model_name, stream, started, ttft_timeout, hedge_delay, hedge_model, open_hedge
+    )
+    first_chunk_at = time.monotonic()
+    ttft = first_chunk_at - started
+
+    metrics = _metrics_for(winner_model)
+    metrics.streams += 1
+    metrics.ttft_total += ttft
+    metrics.ttft_max = max(metrics.ttft_max, ttft)
+    if winner_model != model_name:
+        _metrics_for(model_name).hedges_won += 1
+        logger.info(f"Hedged request to {winner_model} won over {model_name} (TTFT {ttft:.2f}s)")
+    else:
+        logger.debug(f"First chunk from {model_name} after {ttft:.2f}s")
+
+    if chunk is None:
+        return
+
+    streamed_tokens = 0
+    reported_tokens = None
+    completed = False
+    try:
+        while True:
+            streamed_tokens += _chunk_tokens(chunk)
+            usage = getattr(chunk, "usage", None)
+            if usage is not None and getattr(usage, "completion_tokens", None):
+                reported_tokens = usage.completion_tokens
+            yield chunk
+
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), timeout=chunk_timeout)
+            except StopAsyncIteration:
+                completed = True
+                break
+            except asyncio.TimeoutError:
+                metrics.stalls += 1
+                error = StreamStallError(f"{winner_model} stream stalled: no chunk for {chunk_timeout}s")
+                await get_llm_breaker(winner_model).record_failure(error)
+                raise error
+    finally:
+        if completed:
+            metrics.completed += 1
+            duration = time.monotonic() - first_chunk_at
+            tokens = reported_tokens or streamed_tokens
+            if duration > 0 and tokens:
+                metrics.tokens_per_second_total += tokens / duration
+                metrics.throughput_samples += 1
+                logger.debug(f"{winner_model} streamed {tokens} tokens in {duration:.2f}s ({tokens / duration:.1f} tok/s, TTFT {ttft:.2f}s)")
+        else:
+            await _close_stream(winner_stream)
@@ -0,0 +1,158 @@
+"""
+Anthropic prompt-cache breakpoint planning and cache usage reporting.
+
+Anthropic caches the prompt prefix up to each block marked with `cache_control`.
+At most 4 blocks can be marked, and a breakpoint only finds earlier cache writes
+within ~20 blocks before it. To get the most cache reads across agent turns:
+
+1. The system prompt is always a breakpoint (it is identical for every turn of a run)
+2. The next breakpoint goes at the end of the longest stable prefix: the last
+   persisted message before any per-turn temporary messages (those have no message_id)
+3. The remaining breakpoints step back from there every BREAKPOINT_SPACING messages,
+   so turns that added many tool results still find the previous turn's cache write
+
+Every turn also records `cache_read_input_tokens` / `cache_creation_input_tokens`,
+so the cache hit rate can be measured.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from utils.logger import logger
+
+MAX_BREAKPOINTS = 4  # Anthropic limit on cache_control blocks per request
+BREAKPOINT_SPACING = 15  # Messages between breakpoints; below the ~20 block lookback
+
+# Process-wide totals for hit-rate reporting
+_totals = {"turns": 0, "prompt_tokens": 0, "cache_read_tokens": 0, "cache_creation_tokens": 0}
+
+
+def _is_cacheable(message: Dict[str, Any]) -> bool:
+    """Whether a breakpoint can go on this message (it needs text content to carry cache_control)."""
+    if message.get("role") not in ("system", "user", "assistant"):
+        return False
+    content = message.get("content")
+    if isinstance(content, str):
+        return bool(content)
+    if isinstance(content, list):
+        return any(isinstance(block, dict) and block.get("type") == "text" for block in content)
+    return False
+
+
+def _stable_prefix_end(messages: List[Dict[str, Any]]) -> int:
+    """Index of the last message in the stable prefix (persisted messages before any temporary one)."""
+    has_persisted = any(msg.get("message_id") for msg in messages[1:])
+    if not has_persisted:
+        # Not a thread conversation (e.g. a utility call): the whole prompt is the prefix
+        return len(messages) - 1
+    for i in range(1, len(messages)):
+        if not messages[i].get("message_id"):
+            return i - 1
+    return len(messages) - 1
+
+
+def plan_cache_breakpoints(messages: List[Dict[str, Any]]) -> List[int]:
+    """Return the message indexes that should carry cache_control, system prompt first."""
+    if not messages:
+        return []
+
+    breakpoints = []
+    if messages[0].get("role") == "system" and _is_cacheable(messages[0]):
+        breakpoints.append(0)
+
+    index = _stable_prefix_end(messages)
+    while index > 0 and len(breakpoints) < MAX_BREAKPOINTS:
+        # Tool messages / content-less assistant tool calls can't carry the marker; use the closest earlier one
+        candidate = index
+        while candidate > 0 and not _is_cacheable(messages[candidate]):
+            candidate -= 1
+        if candidate <= 0:
+            break
+        if candidate not in breakpoints:
+            breakpoints.append(candidate)
+        index = candidate - BREAKPOINT_SPACING
+
+    return breakpoints
+
+
+def _strip_cache_control(message: Dict[str, Any]):
+    content = message.get("content")
+    if isinstance(content, list):
+        for block in content:
+            if isinstance(block, dict):
+                block.pop("cache_control", None)
+
+
+def _mark_last_text_block(message: Dict[str, Any]):
+    content = message.get("content")
+    if isinstance(content, str):
+        message["content"] = [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+        return
+    for block in reversed(content):
+        if isinstance(block, dict) and block.get("type") == "text":
+            block["cache_control"] = {"type": "ephemeral"}
+            return
+
+
+def apply_cache_breakpoints(messages: List[Dict[str, Any]]) -> List[int]:
+    """Mark the planned breakpoints in place (clearing any others); returns the indexes used."""
+    for message in messages:
+        _strip_cache_control(message)
+    breakpoints = plan_cache_breakpoints(messages)
+    for index in breakpoints:
+        _mark_last_text_block(messages[index])
+    logger.debug(f"Prompt cache breakpoints at message indexes {sorted(breakpoints)} of {len(messages)}")
+    return breakpoints
+
+
+def _field(obj: Any, name: str) -> Any:
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def extract_cache_usage(usage: Any) -> Dict[str, int]:
+    """Pull cache read/creation token counts out of a LiteLLM usage object or dict."""
+    if usage is None:
+        return {}
+    cache_read = _field(usage, "cache_read_input_tokens")
+    if cache_read is None:
+        # OpenAI-style usage reports cached prompt tokens under prompt_tokens_details
+        details = _field(usage, "prompt_tokens_details")
+        if details is not None:
+            cache_read = _field(details, "cached_tokens")
+    cache_creation = _field(usage, "cache_creation_input_tokens")
+
+    result = {}
+    if isinstance(cache_read, int):
+        result["cache_read_input_tokens"] = cache_read
+    if isinstance(cache_creation, int):
+        result["cache_creation_input_tokens"] = cache_creation
+    return result
+
+
+def record_cache_usage(model: str, usage: Dict[str, Any], thread_id: Optional[str] = None) -> Optional[float]:
+    """Log one turn's prompt cache usage and add it to the process totals; returns the hit rate."""
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    cache_read = usage.get("cache_read_input_tokens") or 0
+    cache_creation = usage.get("cache_creation_input_tokens") or 0
+    if not prompt_tokens:
+        return None
+
+    _totals["turns"] += 1
+    _totals["prompt_tokens"] += prompt_tokens
+    _totals["cache_read_tokens"] += cache_read
+    _totals["cache_creation_tokens"] += cache_creation
+
+    hit_rate = cache_read / prompt_tokens
+    logger.info(
+        f"Prompt cache for {model}{f' (thread {thread_id})' if thread_id else ''}: "
+        f"read {cache_read}, written {cache_creation}, prompt {prompt_tokens} tokens ({hit_rate:.0%} hit rate)"
+    )
+    return hit_rate
+
+
+def get_prompt_cache_metrics() -> Dict[str, Any]:
+    """Aggregate prompt cache usage for this process."""
+    prompt_tokens = _totals["prompt_tokens"]
+    return {
+        **_totals,
+        "hit_rate": round(_totals["cache_read_tokens"] / prompt_tokens, 3) if prompt_tokens else 0.0,
+    }
@@ -0,0 +1,185 @@
+"""
+Run leases and checkpoints, so agent runs survive a worker crash.
+
+The worker running an agent run holds `agent_run_lock:{id}` as a lease. The lease
+expires after RUN_LEASE_TTL seconds unless the worker keeps renewing it. This
+replaces the old 24h lock that outlived crashed workers. Every leased run is also
+tracked in the `agent_run_leases` set.
+
+`agent_run_checkpoint:{id}` stores a hash with two fields:
+- run: tier, account id and arguments, to enqueue the run again
+- state: a RunCheckpoint, saved after every completed LLM/tool turn (iterations
+  done, auto-continues done, last persisted message)
+
+The worker janitor finds leased runs whose lease has expired and enqueues them
+again. The new worker discards the interrupted turn's messages and continues
+from the checkpoint, so completed turns are not redone.
+"""
+
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+LOCK_KEY_PREFIX = "agent_run_lock:"
+CHECKPOINT_KEY_PREFIX = "agent_run_checkpoint:"
+LEASED_RUNS_KEY = "agent_run_leases"
+JANITOR_LOCK_KEY = "agent_run_janitor"
+CHECKPOINT_TTL = redis.REDIS_KEY_TTL
+
+# Only the lease holder may renew or release its lease
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RunCheckpoint:
+    """Progress of an agent run, as of its last completed turn."""
+
+    def __init__(self, agent_run_id: str, state: Optional[Dict[str, Any]] = None):
+        state = state or {}
+        self.agent_run_id = agent_run_id
+        self.iteration_count: int = state.get("iteration_count", 0)  # Completed run_agent iterations
+        self.auto_continue_count: int = state.get("auto_continue_count", 0)  # Completed turns of the current iteration
+        self.last_message_id: Optional[str] = state.get("last_message_id")
+        self.last_message_created_at: Optional[str] = state.get("last_message_created_at")
+        self.continue_execution: bool = state.get("continue_execution", True)
+        self.resume_count: int = state.get("resume_count", 0)
+
+    @property
+    def is_resumed(self) -> bool:
+        return self.resume_count > 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "iteration_count": self.iteration_count,
+            "auto_continue_count": self.auto_continue_count,
+            "last_message_id": self.last_message_id,
+            "last_message_created_at": self.last_message_created_at,
+            "continue_execution": self.continue_execution,
+            "resume_count": self.resume_count,
+            "updated_at": time.time(),
+        }
+
+    def track_message(self, message: Dict[str, Any]):
+        """Remember the latest persisted message the run has yielded."""
+        # Status messages are written behind; their yielded created_at is the worker's
+        # clock, not the stored value, so it can't anchor the resume cleanup
+        if message.get("type") == "status":
+            return
+        if message.get("message_id") and message.get("created_at"):
+            self.last_message_id = message["message_id"]
+            self.last_message_created_at = message["created_at"]
+
+    async def save(self):
+        key = f"{CHECKPOINT_KEY_PREFIX}{self.agent_run_id}"
+        try:
+            redis_client = await redis.get_client()
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hset(key, "state", json.dumps(self.as_dict()))
+            pipe.expire(key, CHECKPOINT_TTL)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to save checkpoint for agent run {self.agent_run_id}: {e}")
+
+    @classmethod
+    async def load(cls, agent_run_id: str) -> "RunCheckpoint":
+        try:
+            redis_client = await redis.get_client()
+            raw = await redis_client.hget(f"{CHECKPOINT_KEY_PREFIX}{agent_run_id}", "state")
+            return cls(agent_run_id, json.loads(raw) if raw else None)
+        except Exception as e:
+            logger.warning(f"Failed to load checkpoint for agent run {agent_run_id}: {e}")
+            return cls(agent_run_id)
+
+
+async def register_run(agent_run_id: str, tier: str, account_id: str, run_kwargs: Dict[str, Any]):
+    """Store what's needed to enqueue the run again if its worker dies."""
+    key = f"{CHECKPOINT_KEY_PREFIX}{agent_run_id}"
+    redis_client = await redis.get_client()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hset(key, "run", json.dumps({"tier": tier, "account_id": account_id, "kwargs": run_kwargs}))
+    pipe.expire(key, CHECKPOINT_TTL)
+    await pipe.execute()
+
+
+async def get_registered_run(agent_run_id: str) -> Optional[Dict[str, Any]]:
+    redis_client = await redis.get_client()
+    raw = await redis_client.hget(f"{CHECKPOINT_KEY_PREFIX}{agent_run_id}", "run")
+    return json.loads(raw) if raw else None
+
+
+async def acquire_lease(agent_run_id: str, instance_id: str) -> bool:
+    """Take the run's lease; False if another worker holds it."""
+    acquired = await redis.set(f"{LOCK_KEY_PREFIX}{agent_run_id}", instance_id, nx=True, ex=config.RUN_LEASE_TTL)
+    if acquired:
+        redis_client = await redis.get_client()
+        await redis_client.sadd(LEASED_RUNS_KEY, agent_run_id)
+    return bool(acquired)
+
+
+async def renew_lease(agent_run_id: str, instance_id: str) -> bool:
+    """Extend the run's lease; False if this worker no longer holds it."""
+    redis_client = await redis.get_client()
+    renewed = await redis_client.eval(
+        _RENEW_SCRIPT, 1, f"{LOCK_KEY_PREFIX}{agent_run_id}", instance_id, config.RUN_LEASE_TTL
+    )
+    return bool(renewed)
+
+
+async def release_lease(agent_run_id: str, instance_id: str, finished: bool):
+    """Release the run's lease.
+
+    Args:
+        agent_run_id: ID of the agent run
+        instance_id: Worker holding the lease
+        finished: Whether the run reached a final status. If not (e.g. the worker is
+            shutting down), the run stays tracked so the janitor resumes it.
+    """
+    try:
+        redis_client = await redis.get_client()
+        await redis_client.eval(_RELEASE_SCRIPT, 1, f"{LOCK_KEY_PREFIX}{agent_run_id}", instance_id)
+        if finished:
+            await redis_client.srem(LEASED_RUNS_KEY, agent_run_id)
+            await redis_client.delete(f"{CHECKPOINT_KEY_PREFIX}{agent_run_id}")
+    except Exception as e:
+        logger.warning(f"Failed to release lease of agent run {agent_run_id}: {e}")
+
+
+async def claim_expired_runs() -> List[str]:
+    """Runs whose lease expired, claimed by this caller (each run is returned to one caller only)."""
+    redis_client = await redis.get_client()
+    expired = []
+    for agent_run_id in await redis_client.smembers(LEASED_RUNS_KEY):
+        if await redis_client.exists(f"{LOCK_KEY_PREFIX}{agent_run_id}"):
+            continue
+        # The run is re-added to the set once a worker takes its lease again
+        if await redis_client.srem(LEASED_RUNS_KEY, agent_run_id):
+            expired.append(agent_run_id)
+    return expired
+
+
+async def mark_resumed(agent_run_id: str) -> RunCheckpoint:
+    """Count a resume of the run in its checkpoint."""
+    checkpoint = await RunCheckpoint.load(agent_run_id)
+    checkpoint.resume_count += 1
+    await checkpoint.save()
+    return checkpoint
+
+
+async def forget_run(agent_run_id: str):
+    redis_client = await redis.get_client()
+    await redis_client.delete(f"{CHECKPOINT_KEY_PREFIX}{agent_run_id}")
@@ -0,0 +1,209 @@
+"""
+Tiered, per-account fair queue of pending agent runs.
+
+Runs used to go straight onto the single dramatiq queue in arrival order, so a
+burst of free-tier runs delayed paying customers. Now the API pushes each run's
+arguments into a Redis queue for its subscription tier and sends a dramatiq
+message that carries no run. A worker that receives the message and has a free
+run slot pops the best pending run:
+
+- tiers are picked by weighted priority (TIER_WEIGHTS). Lower tiers still get
+  a share, so they never starve
+- within a tier, accounts are served round-robin (one run per account per
+  turn), so one account can't monopolize workers
+
+Each tier has:
+- run_queue:{tier}:accounts     ring of account ids with pending runs
+- run_queue:{tier}:account:{id} that account's pending runs (JSON)
+- run_queue:{tier}:pending      number of pending runs, for queue-depth metrics
+
+Dequeuing is reliable: the same script that pops a run records it in
+run_queue:processing (payload) and run_queue:processing_deadlines (deadline).
+The run is acknowledged (ack_run) once its worker has gone for the run's lease;
+from then on services/run_checkpoints.py covers crashes. If the worker dies
+before that, the deadline passes, and the janitor puts the run back in its
+queue (requeue_unclaimed_runs).
+"""
+
+import json
+import random
+import time
+from typing import Any, Dict, Optional
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+KEY_PREFIX = "run_queue:"
+PROCESSING_KEY = f"{KEY_PREFIX}processing"
+PROCESSING_DEADLINES_KEY = f"{KEY_PREFIX}processing_deadlines"
+
+# Relative share of worker slots each tier gets while several tiers have pending runs
+TIER_WEIGHTS = {"paid": 4, "free": 1}
+DEFAULT_TIER = "free"
+
+# Append a run to its account's queue, adding the account to the ring if it had none pending
+_ENQUEUE_SCRIPT = """
+local length = redis.call('RPUSH', KEYS[2], ARGV[2])
+if length == 1 then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+redis.call('INCR', KEYS[3])
+return length
+"""
+
+# Pop the next account from the ring and its oldest run; the account goes back to
+# the end of the ring while it has more runs pending. The run is recorded as being
+# processed until it is acknowledged
+_DEQUEUE_SCRIPT = """
+local account_id = redis.call('LPOP', KEYS[1])
+if not account_id then
+    return false
+end
+local account_key = ARGV[1] .. account_id
+local payload = redis.call('LPOP', account_key)
+if redis.call('LLEN', account_key) > 0 then
+    redis.call('RPUSH', KEYS[1], account_id)
+end
+if payload then
+    redis.call('DECR', KEYS[2])
+    local agent_run_id = cjson.decode(payload)['kwargs']['agent_run_id']
+    redis.call('HSET', KEYS[3], agent_run_id, payload)
+    redis.call('ZADD', KEYS[4], ARGV[2], agent_run_id)
+end
+return payload
+"""
+
+# Put an unacknowledged run back in its account's queue, unless it was acknowledged
+# or requeued by someone else in the meantime
+_REQUEUE_SCRIPT = """
+if redis.call('ZREM', KEYS[4], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HDEL', KEYS[5], ARGV[1])
+if redis.call('LPUSH', KEYS[2], ARGV[3]) == 1 then
+    redis.call('RPUSH', KEYS[1], ARGV[2])
+end
+redis.call('INCR', KEYS[3])
+return 1
+"""
+
+
+def get_run_queue_tier(subscription: Optional[Dict[str, Any]]) -> str:
+    """Queue tier for a subscription as returned by check_billing_status."""
+    plan_name = ((subscription or {}).get("plan_name") or "").lower()
+    if not plan_name or plan_name == "free":
+        return "free"
+    return "paid"
+
+
+def _keys(tier: str):
+    return (
+        f"{KEY_PREFIX}{tier}:accounts",
+        f"{KEY_PREFIX}{tier}:account:",
+        f"{KEY_PREFIX}{tier}:pending",
+    )
+
+
+async def enqueue_run(tier: str, account_id: str, run_kwargs: Dict[str, Any]):
+    """Add a run to the queue of its tier.
+
+    Args:
+        tier: Queue tier (see get_run_queue_tier)
+        account_id: Account that started the run
+        run_kwargs: Keyword arguments for the run
+    """
+    if tier not in TIER_WEIGHTS:
+        tier = DEFAULT_TIER
+    ring_key, account_prefix, pending_key = _keys(tier)
+    payload = json.dumps({"kwargs": run_kwargs, "account_id": account_id, "enqueued_at": time.time(), "tier": tier})
+    redis_client = await redis.get_client()
+    await redis_client.eval(_ENQUEUE_SCRIPT, 3, ring_key, f"{account_prefix}{account_id}", pending_key, account_id, payload)
+    logger.debug(f"Queued agent run {run_kwargs.get('agent_run_id')} for account {account_id} in tier '{tier}'")
+
+
+async def dequeue_run() -> Optional[Dict[str, Any]]:
+    """Pop the next run by weighted tier priority and account round-robin.
+
+    Returns:
+        Dict with kwargs, account_id, enqueued_at and tier, or None if nothing is pending
+    """
+    redis_client = await redis.get_client()
+    tiers = list(TIER_WEIGHTS)
+    pending = await redis_client.mget([_keys(tier)[2] for tier in tiers])
+    candidates = [tier for tier, count in zip(tiers, pending) if count and int(count) > 0]
+
+    # Weighted pick first; fall back to the other tiers in priority order if it was already drained
+    order = []
+    if candidates:
+        first = random.choices(candidates, weights=[TIER_WEIGHTS[tier] for tier in candidates])[0]
+        order.append(first)
+    order += sorted((tier for tier in tiers if tier not in order), key=lambda tier: -TIER_WEIGHTS[tier])
+
+    for tier in order:
+        ring_key, account_prefix, pending_key = _keys(tier)
+        payload = await redis_client.eval(
+            _DEQUEUE_SCRIPT, 4, ring_key, pending_key, PROCESSING_KEY, PROCESSING_DEADLINES_KEY,
+            account_prefix, time.time() + config.RUN_CLAIM_TIMEOUT,
+        )
+        if payload:
+            run = json.loads(payload)
+            run["tier"] = tier
+            logger.info(
+                f"Dequeued agent run {run['kwargs'].get('agent_run_id')} from tier '{tier}' "
+                f"after {time.time() - run['enqueued_at']:.1f}s"
+            )
+            return run
+    return None
+
+
+async def ack_run(agent_run_id: str):
+    """Acknowledge a dequeued run: its worker has taken over (or dropped) the run."""
+    try:
+        redis_client = await redis.get_client()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zrem(PROCESSING_DEADLINES_KEY, agent_run_id)
+        pipe.hdel(PROCESSING_KEY, agent_run_id)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to acknowledge dequeued agent run {agent_run_id}: {e}")
+
+
+async def requeue_unclaimed_runs() -> int:
+    """Put dequeued runs whose worker did not acknowledge them in time back in their queue.
+
+    Returns:
+        Number of runs requeued; each needs a run_next_agent_run message
+    """
+    redis_client = await redis.get_client()
+    requeued = 0
+    for agent_run_id in await redis_client.zrangebyscore(PROCESSING_DEADLINES_KEY, "-inf", time.time()):
+        payload = await redis_client.hget(PROCESSING_KEY, agent_run_id)
+        if not payload:
+            # Acknowledged since the scan, or the payload is gone
+            await redis_client.zrem(PROCESSING_DEADLINES_KEY, agent_run_id)
+            continue
+        run = json.loads(payload)
+        tier = run.get("tier", DEFAULT_TIER)
+        ring_key, account_prefix, pending_key = _keys(tier)
+        if await redis_client.eval(
+            _REQUEUE_SCRIPT, 5, ring_key, f"{account_prefix}{run['account_id']}", pending_key,
+            PROCESSING_DEADLINES_KEY, PROCESSING_KEY, agent_run_id, run["account_id"], payload,
+        ):
+            logger.warning(f"Agent run {agent_run_id} was dequeued but never started; queued it again in tier '{tier}'")
+            requeued += 1
+    return requeued
+
+
+async def get_queue_depths() -> Dict[str, Dict[str, int]]:
+    """Pending runs and accounts with pending runs, per tier."""
+    redis_client = await redis.get_client()
+    depths = {}
+    for tier in TIER_WEIGHTS:
+        ring_key, _, pending_key = _keys(tier)
+        pending = await redis_client.get(pending_key)
+        depths[tier] = {
+            "pending": max(0, int(pending or 0)),
+            "accounts": await redis_client.llen(ring_key),
+        }
+    return depths
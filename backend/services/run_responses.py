@@ -0,0 +1,85 @@
+"""
+Compaction of agent run responses for `agent_runs.responses`.
+
+The Redis response list of a run contains every streamed token chunk. Until now
+it was written into the agent run row in full, which made long runs tens of MB of
+JSONB. What is worth keeping is much smaller:
+
+- messages persisted during the run are already in `messages`; the row only
+  references them (message_id, type, created_at)
+- run-level status events (queued, resumed, completed, failed, error, ...) are
+  kept as they are
+- streaming chunks and other transient updates are dropped
+
+A summary entry records how many responses the run produced. When
+ARCHIVE_RUN_STREAMS is enabled, the raw stream is also uploaded to object storage
+gzip-compressed, and the summary records its path.
+"""
+
+import gzip
+from typing import Any, Dict, Iterable, List, Optional
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+RUN_STREAMS_BUCKET = "agent-run-streams"
+
+
+class CompactedResponses:
+    """Accumulates the compacted form of a run's responses as they are produced."""
+
+    def __init__(self):
+        self.entries: List[Dict[str, Any]] = []
+        self.total = 0
+        self.dropped = 0
+
+    def add(self, response: Dict[str, Any]):
+        self.total += 1
+        if response.get("message_id"):
+            self.entries.append({
+                "message_id": response["message_id"],
+                "type": response.get("type"),
+                "created_at": response.get("created_at"),
+            })
+        elif response.get("type") == "status" and "status" in response:
+            # Run-level status event; these are never stored in `messages`
+            self.entries.append(response)
+        else:
+            self.dropped += 1
+
+    def as_list(self, raw_stream_path: Optional[str] = None) -> List[Dict[str, Any]]:
+        summary = {"type": "run_summary", "total_responses": self.total, "dropped_responses": self.dropped}
+        if raw_stream_path:
+            summary["raw_stream_path"] = raw_stream_path
+        return self.entries + [summary]
+
+
+def compact_responses(responses: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Compact an already complete list of responses."""
+    compacted = CompactedResponses()
+    for response in responses:
+        compacted.add(response)
+    return compacted.as_list()
+
+
+async def archive_raw_stream(client, agent_run_id: str) -> Optional[str]:
+    """Upload the run's raw Redis response list to object storage, gzip-compressed.
+
+    Returns:
+        Storage path of the archive, or None if archiving is disabled or failed
+    """
+    if not config.ARCHIVE_RUN_STREAMS:
+        return None
+    try:
+        raw_responses = await redis.lrange(f"agent_run:{agent_run_id}:responses", 0, -1)
+        data = gzip.compress("\n".join(raw_responses).encode("utf-8"))
+        path = f"{agent_run_id}.jsonl.gz"
+        await client.storage.from_(RUN_STREAMS_BUCKET).upload(
+            path, data, {"content-type": "application/gzip", "upsert": "true"}
+        )
+        logger.debug(f"Archived {len(raw_responses)} responses of agent run {agent_run_id} ({len(data)} bytes)")
+        return f"{RUN_STREAMS_BUCKET}/{path}"
+    except Exception as e:
+        logger.warning(f"Failed to archive response stream of agent run {agent_run_id}: {e}")
+        return None
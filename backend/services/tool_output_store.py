@@ -0,0 +1,123 @@
+"""
+Offloading of large tool outputs to object storage.
+
+Scrapes, file dumps, command output and data provider JSON used to be stored in
+full in the tool result message. That made rows large and every turn reloaded
+them, only for the context compression to truncate them again.
+
+Outputs longer than TOOL_OUTPUT_OFFLOAD_THRESHOLD characters are stored gzip-compressed
+in a blob store (Supabase storage by default; see set_blob_store). The message
+keeps:
+- a preview of the first TOOL_OUTPUT_PREVIEW_CHARS characters
+- a note telling the model how to get the rest
+- an `output_ref` in its metadata, which ExpandMessageTool and the
+  /thread/{thread_id}/messages/{message_id}/output endpoint dereference
+
+ExpandMessageTool returns offloaded outputs in pages of at most
+TOOL_OUTPUT_OFFLOAD_THRESHOLD characters, and its results are never offloaded
+themselves; otherwise expanding would only produce another preview.
+"""
+
+import gzip
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+from services.supabase import DBConnection
+from utils.config import config
+from utils.logger import logger
+
+TOOL_OUTPUTS_BUCKET = "tool-outputs"
+
+# Functions whose results always stay inline (they read offloaded outputs back)
+NEVER_OFFLOADED = {"expand_message", "expand-message"}
+
+
+class BlobStore(ABC):
+    """Minimal interface of the storage that offloaded outputs are written to."""
+
+    @abstractmethod
+    async def put(self, path: str, data: bytes, content_type: str):
+        pass
+
+    @abstractmethod
+    async def get(self, path: str) -> bytes:
+        pass
+
+
+class SupabaseBlobStore(BlobStore):
+    """Blob store backed by a Supabase storage bucket."""
+
+    def __init__(self, bucket: str = TOOL_OUTPUTS_BUCKET):
+        self.bucket = bucket
+        self.db = DBConnection()
+
+    async def put(self, path: str, data: bytes, content_type: str):
+        client = await self.db.client
+        await client.storage.from_(self.bucket).upload(path, data, {"content-type": content_type, "upsert": "true"})
+
+    async def get(self, path: str) -> bytes:
+        client = await self.db.client
+        return await client.storage.from_(self.bucket).download(path)
+
+
+_blob_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    global _blob_store
+    if _blob_store is None:
+        _blob_store = SupabaseBlobStore()
+    return _blob_store
+
+
+def set_blob_store(store: BlobStore):
+    """Use a different blob store for offloaded outputs."""
+    global _blob_store
+    _blob_store = store
+
+
+def should_offload(output: str, function_name: Optional[str] = None) -> bool:
+    if function_name in NEVER_OFFLOADED:
+        return False
+    threshold = config.TOOL_OUTPUT_OFFLOAD_THRESHOLD
+    return bool(threshold) and len(output) > threshold
+
+
+def page_size() -> int:
+    """Characters of an offloaded output returned per expand-message call."""
+    return config.TOOL_OUTPUT_OFFLOAD_THRESHOLD or 20000
+
+
+async def offload_output(thread_id: str, message_id: str, output: str) -> Dict[str, Any]:
+    """Store a tool output in the blob store.
+
+    Args:
+        thread_id: Thread of the tool result message
+        message_id: ID the tool result message will be stored with
+        output: The full output
+
+    Returns:
+        The reference to keep in the message metadata as `output_ref`
+    """
+    path = f"{thread_id}/{message_id}.txt.gz"
+    data = gzip.compress(output.encode("utf-8"))
+    await get_blob_store().put(path, data, "application/gzip")
+    logger.info(f"Offloaded tool output of message {message_id} ({len(output)} chars, {len(data)} bytes stored)")
+    return {"path": path, "size": len(output)}
+
+
+def build_preview(output: str, message_id: str) -> str:
+    """The part of an offloaded output that stays in the message."""
+    preview_chars = config.TOOL_OUTPUT_PREVIEW_CHARS
+    return (
+        output[:preview_chars]
+        + f"\n\n... (output truncated, showing {preview_chars} of {len(output)} characters)"
+        + f"\n\nThe full output is stored separately, use the expand-message tool with message_id \"{message_id}\" to see it"
+        + f" ({page_size()} characters per call, pass start to read further)"
+    )
+
+
+async def load_output(output_ref: Dict[str, Any]) -> str:
+    """Full output referenced by a message's `output_ref`."""
+    data = await get_blob_store().get(output_ref["path"])
+    return gzip.decompress(data).decode("utf-8")
@@ -0,0 +1,5 @@
+-- Private bucket for archived raw response streams of agent runs (see services/run_responses.py).
+-- Only the service role writes and reads it.
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('agent-run-streams', 'agent-run-streams', false)
+ON CONFLICT (id) DO NOTHING; -- Avoid error if bucket already exists
@@ -0,0 +1,5 @@
+-- Private bucket for large tool outputs offloaded from messages (see services/tool_output_store.py).
+-- Only the service role writes and reads it; clients go through the API.
+INSERT INTO storage.buckets (id, name, public)
+VALUES ('tool-outputs', 'tool-outputs', false)
+ON CONFLICT (id) DO NOTHING; -- Avoid error if bucket already exists
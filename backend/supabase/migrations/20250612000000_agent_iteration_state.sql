@@ -0,0 +1,41 @@
+-- State the agent loop needs before each LLM call (see agent/iteration_state.py), in a
+-- single round trip instead of three queries:
+-- - type of the latest assistant/tool/user message
+-- - latest browser_state message
+-- - latest image_context message
+CREATE OR REPLACE FUNCTION get_agent_iteration_state(p_thread_id UUID)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'latest_message_type', (
+            SELECT m.type FROM messages m
+            WHERE m.thread_id = p_thread_id
+            AND m.type IN ('assistant', 'tool', 'user')
+            ORDER BY m.created_at DESC
+            LIMIT 1
+        ),
+        'browser_state', (
+            SELECT to_jsonb(m) FROM messages m
+            WHERE m.thread_id = p_thread_id
+            AND m.type = 'browser_state'
+            ORDER BY m.created_at DESC
+            LIMIT 1
+        ),
+        'image_context', (
+            SELECT to_jsonb(m) FROM messages m
+            WHERE m.thread_id = p_thread_id
+            AND m.type = 'image_context'
+            ORDER BY m.created_at DESC
+            LIMIT 1
+        )
+    );
+$$;
+
+-- Only the agent worker (service role) calls it
+REVOKE EXECUTE ON FUNCTION get_agent_iteration_state(UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION get_agent_iteration_state(UUID) TO service_role;
+
+-- Serves the "latest message of type X in thread" lookups above
+CREATE INDEX IF NOT EXISTS idx_messages_thread_type_created_at ON messages(thread_id, type, created_at DESC);
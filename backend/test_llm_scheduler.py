@@ -0,0 +1,53 @@
+"""
+Tests for the LLM scheduler's per-bucket dispatcher.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Add the backend directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.llm_scheduler import PRIORITY_HIGH, PRIORITY_LOW, BucketLimits, _Bucket
+
+
+@pytest.mark.asyncio
+async def test_high_priority_arrival_during_reserve():
+    """A request queued while the head's budget is being reserved must not strand either waiter."""
+    bucket = _Bucket("test", BucketLimits())
+    reserving = asyncio.Event()
+    finish_reserve = asyncio.Event()
+    reserved = []
+    refunded = []
+
+    async def reserve(tokens):
+        reserved.append(tokens)
+        if len(reserved) == 1:
+            reserving.set()
+            await finish_reserve.wait()
+        return 7, 0.0
+
+    async def refund(window, tokens):
+        refunded.append((window, tokens))
+
+    bucket._reserve = reserve
+    bucket.refund = refund
+
+    low = asyncio.create_task(bucket.acquire(PRIORITY_LOW, 10))
+    await reserving.wait()
+    high = asyncio.create_task(bucket.acquire(PRIORITY_HIGH, 20))
+    await asyncio.sleep(0)
+    finish_reserve.set()
+
+    try:
+        assert await asyncio.wait_for(high, timeout=1) == 7
+        assert await asyncio.wait_for(low, timeout=1) == 7
+        # The low-priority reservation made before the high-priority arrival is given back
+        assert refunded == [(7, 10)]
+        assert reserved == [10, 20, 10]
+        assert bucket.metrics.active == 2
+    finally:
+        bucket._dispatcher.cancel()
@@ -0,0 +1,213 @@
+"""
+Circuit breakers for LLM providers and third-party tool backends.
+
+Without a breaker, every request to a backend that is down pays the full retry
+schedule. Each named breaker moves between three states, and the state lives in
+Redis so all API instances and workers share it:
+
+- closed: calls go through. CIRCUIT_FAILURE_THRESHOLD backend failures within
+  CIRCUIT_FAILURE_WINDOW seconds open the circuit
+- open: calls fail fast with CircuitOpenError for the recovery timeout
+  (CIRCUIT_RECOVERY_TIMEOUT, doubling after each failed probe)
+- half-open: once the recovery timeout passes, one caller is let through as a
+  probe. If it succeeds the circuit closes; if it fails the circuit reopens
+
+Only backend failures count: timeouts, connection errors and 5xx responses.
+Client errors such as 4xx responses mean the backend is up. If Redis is
+unavailable, breakers fail open and let calls through.
+"""
+
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+KEY_PREFIX = "circuit:"
+PROBE_TIMEOUT = 60  # seconds a half-open probe may hold the circuit
+PROBE_RETRY_AFTER = 5  # retry-after reported to callers while a probe is in flight
+MAX_RECOVERY_TIMEOUT = 300
+STATE_CACHE_SECONDS = 1.0  # how long a process trusts its last read of the shared state
+STATE_TTL = 3600 * 24
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is temporarily unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """Default classification: timeouts, connection problems and 5xx responses."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError, ConnectionError))
+
+
+class CircuitBreaker:
+    """A named breaker whose state is shared through Redis."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: Optional[int] = None,
+        failure_window: Optional[int] = None,
+        recovery_timeout: Optional[int] = None,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold or config.CIRCUIT_FAILURE_THRESHOLD
+        self.failure_window = failure_window or config.CIRCUIT_FAILURE_WINDOW
+        self.recovery_timeout = recovery_timeout or config.CIRCUIT_RECOVERY_TIMEOUT
+        self._state_key = f"{KEY_PREFIX}{name}:state"
+        self._failures_key = f"{KEY_PREFIX}{name}:failures"
+        self._probe_key = f"{KEY_PREFIX}{name}:probe"
+        self._cached_state: Optional[Dict[str, Any]] = None
+        self._cached_at = 0.0
+        self.stats = {"rejected": 0, "failures": 0, "opened": 0, "closed": 0}
+
+    async def _read_state(self) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        if now - self._cached_at < STATE_CACHE_SECONDS:
+            return self._cached_state
+        raw = await redis.get(self._state_key)
+        self._cached_state = json.loads(raw) if raw else None
+        self._cached_at = now
+        return self._cached_state
+
+    def _invalidate(self):
+        self._cached_at = 0.0
+
+    async def state(self) -> str:
+        """Current state name: closed, open or half_open."""
+        try:
+            current = await self._read_state()
+        except Exception:
+            return "closed"
+        if not current:
+            return "closed"
+        elapsed = time.time() - current["opened_at"]
+        return "open" if elapsed < current["recovery"] else "half_open"
+
+    async def before_call(self) -> bool:
+        """
+        Check the circuit before calling the backend.
+
+        Returns True if this call is the half-open probe.
+        Raises CircuitOpenError while the circuit is open.
+        """
+        try:
+            current = await self._read_state()
+            if not current:
+                return False
+
+            elapsed = time.time() - current["opened_at"]
+            if elapsed < current["recovery"]:
+                self.stats["rejected"] += 1
+                raise CircuitOpenError(self.name, current["recovery"] - elapsed)
+
+            if await redis.set(self._probe_key, "1", ex=PROBE_TIMEOUT, nx=True):
+                logger.info(f"Circuit '{self.name}' half-open, sending probe request")
+                return True
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.debug(f"Circuit '{self.name}' state check failed, allowing call: {e}")
+            return False
+
+        self.stats["rejected"] += 1
+        raise CircuitOpenError(self.name, PROBE_RETRY_AFTER)
+
+    async def record_success(self, probe: bool = False):
+        """Record a successful call; a successful probe closes the circuit."""
+        if not probe:
+            return
+        try:
+            redis_client = await redis.get_client()
+            await redis_client.delete(self._state_key, self._failures_key, self._probe_key)
+            self._invalidate()
+            self.stats["closed"] += 1
+            logger.info(f"Circuit '{self.name}' closed, backend recovered")
+        except Exception as e:
+            logger.warning(f"Circuit '{self.name}' could not be closed: {e}")
+
+    async def record_failure(self, error: Optional[BaseException] = None, probe: bool = False):
+        """Record a backend failure, opening the circuit once the threshold is reached."""
+        self.stats["failures"] += 1
+        try:
+            if probe:
+                current = await self._read_state() or {}
+                recovery = min(current.get("recovery", self.recovery_timeout) * 2, MAX_RECOVERY_TIMEOUT)
+                await self._open(recovery, error, force=True)
+                await redis.delete(self._probe_key)
+                return
+
+            redis_client = await redis.get_client()
+            failures = await redis_client.incr(self._failures_key)
+            if failures == 1:
+                await redis_client.expire(self._failures_key, self.failure_window)
+            if failures >= self.failure_threshold:
+                await self._open(self.recovery_timeout, error)
+        except Exception as e:
+            logger.debug(f"Circuit '{self.name}' could not record failure: {e}")
+
+    async def _open(self, recovery: float, error: Optional[BaseException], force: bool = False):
+        state = json.dumps({"opened_at": time.time(), "recovery": recovery})
+        # Without force, keep the original opened_at if another caller already opened the circuit
+        opened = await redis.set(self._state_key, state, ex=STATE_TTL, nx=not force)
+        self._invalidate()
+        if opened:
+            self.stats["opened"] += 1
+            logger.warning(f"Circuit '{self.name}' opened for {recovery:.0f}s after backend failures: {error}")
+
+    @asynccontextmanager
+    async def guard(self, is_failure: Callable[[BaseException], bool] = is_backend_failure):
+        """Run the body under the breaker: fail fast while open, record the outcome otherwise."""
+        probe = await self.before_call()
+        try:
+            yield
+        except Exception as e:
+            if is_failure(e):
+                await self.record_failure(e, probe=probe)
+            else:
+                # The backend answered (e.g. a 4xx); it is up
+                await self.record_success(probe=probe)
+            raise
+        except BaseException:
+            if probe:
+                # Cancelled mid-probe; let the next caller probe instead
+                try:
+                    await redis.delete(self._probe_key)
+                except Exception:
+                    pass
+            raise
+        else:
+            await self.record_success(probe=probe)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """Get (or create) the process-local handle for the named breaker."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = CircuitBreaker(name, **kwargs)
+        _breakers[name] = breaker
+    return breaker
+
+
+async def get_circuit_states() -> Dict[str, Dict[str, Any]]:
+    """Shared state plus local counters for every breaker used in this process."""
+    return {
+        name: {"state": await breaker.state(), **breaker.stats}
+        for name, breaker in _breakers.items()
+    }
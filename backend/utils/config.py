@@ -97,6 +97,50 @@ class Configuration:
     LLM_RETRY_DELAY: float = 0.1
     LLM_ENABLE_FALLBACK: bool = True  # Enable fallback models on overload
 
+    # LLM request scheduling (see services/llm_scheduler.py); 0 means unlimited
+    LLM_SCHEDULER_ENABLED: bool = True
+    LLM_DEFAULT_RPM: int = 0
+    LLM_DEFAULT_TPM: int = 0
+    LLM_MAX_CONCURRENCY: int = 20  # In-flight requests per provider per process
+    LLM_RATE_LIMITS: Optional[str] = None  # JSON per provider/model, e.g. {"anthropic": {"rpm": 50, "tpm": 400000}}
+
+    # Circuit breakers for LLM providers and tool backends (see utils/circuit_breaker.py)
+    CIRCUIT_FAILURE_THRESHOLD: int = 5  # Backend failures within the window that open a circuit
+    CIRCUIT_FAILURE_WINDOW: int = 60
+    CIRCUIT_RECOVERY_TIMEOUT: int = 30  # Seconds a circuit stays open before a probe is allowed
+
+    # Streaming watchdog / hedging (see services/llm_streaming.py)
+    LLM_STREAM_TTFT_TIMEOUT: float = 120  # Seconds to wait for the first streamed chunk
+    LLM_STREAM_CHUNK_TIMEOUT: float = 90  # Max seconds between streamed chunks
+    LLM_HEDGE_DELAY: float = 0  # Start the fallback model after this many seconds without a first chunk; 0 disables
+
+    # Per-worker concurrency limits (see utils/worker_limits.py)
+    WORKER_MAX_ACTIVE_RUNS: int = 8
+    WORKER_MAX_LLM_STREAMS: int = 16
+    WORKER_MAX_SANDBOX_CALLS: int = 32
+    WORKER_METRICS_INTERVAL: int = 10  # Seconds between worker metrics snapshots
+
+    # Tool calls of one run that execute at once (see agentpress/tool_scheduler.py)
+    MAX_PARALLEL_TOOL_CALLS: int = 6
+
+    # Tool outputs longer than this (characters) are offloaded to object storage; 0 disables (see services/tool_output_store.py)
+    TOOL_OUTPUT_OFFLOAD_THRESHOLD: int = 20000
+    TOOL_OUTPUT_PREVIEW_CHARS: int = 2000
+
+    # Admission control for agent starts (see services/admission.py)
+    ADMISSION_CONTROL_ENABLED: bool = True
+    ADMISSION_MAX_WAIT_PAID: int = 600  # Reject new paid runs with 429 beyond this estimated queue wait (seconds)
+    ADMISSION_MAX_WAIT_FREE: int = 180
+
+    # Run leases and crash recovery (see services/run_checkpoints.py)
+    RUN_LEASE_TTL: int = 60  # Seconds a worker's run lock lives without renewal
+    RUN_JANITOR_INTERVAL: int = 30  # Seconds between scans for runs whose lease expired
+    RUN_MAX_RESUMES: int = 3  # A run that lost its worker this often is marked failed
+    RUN_CLAIM_TIMEOUT: int = 60  # Seconds a dequeued run may take to reach its lease before it is queued again
+
+    # Upload each run's raw response stream (gzip) to the agent-run-streams bucket
+    ARCHIVE_RUN_STREAMS: bool = False
+
     # Supabase configuration
     SUPABASE_URL: str
     SUPABASE_ANON_KEY: str
@@ -135,6 +179,10 @@ class Configuration:
         "prod_SV3rLT7uMPOEIr"  # Keep test product for staging
     )
 
+    # MCP configuration
+    MCP_SCHEMA_CACHE_TTL: int = 3600  # Seconds to reuse a server's discovered tool list
+    MCP_SERVER_INIT_TIMEOUT: int = 15  # Per-server deadline for connect + list_tools
+
     # Sandbox configuration
     SANDBOX_IMAGE_NAME = "kortix/suna:0.1.3"
     SANDBOX_ENTRYPOINT = (
@@ -193,6 +241,13 @@ class Configuration:
                         logger.warning(
                             f"Invalid value for {key}: {env_val}, using default"
                         )
+                elif expected_type == float:
+                    try:
+                        setattr(self, key, float(env_val))
+                    except ValueError:
+                        logger.warning(
+                            f"Invalid value for {key}: {env_val}, using default"
+                        )
                 elif expected_type == EnvMode:
                     # Already handled for ENV_MODE
                     pass
@@ -0,0 +1,59 @@
+"""
+Shared pooled HTTP clients.
+
+Creating an `httpx.AsyncClient` per request pays TCP/TLS setup every time.
+Tools that talk to the same upstream repeatedly get one long-lived client per
+name instead, so connections are kept alive and reused across calls and runs.
+"""
+
+import asyncio
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from utils.logger import logger
+
+DEFAULT_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+DEFAULT_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60)
+
+# name -> (client, event loop it was created on)
+_clients: Dict[str, Tuple[httpx.AsyncClient, asyncio.AbstractEventLoop]] = {}
+
+
+def get_shared_client(
+    name: str,
+    timeout: Optional[httpx.Timeout] = None,
+    limits: Optional[httpx.Limits] = None,
+    **kwargs,
+) -> httpx.AsyncClient:
+    """
+    Get (or lazily create) the pooled client registered under `name`.
+
+    Clients are bound to the event loop they were created on; a client whose
+    loop has changed or that was closed is replaced transparently.
+    """
+    loop = asyncio.get_running_loop()
+    existing = _clients.get(name)
+    if existing:
+        client, client_loop = existing
+        if not client.is_closed and client_loop is loop:
+            return client
+
+    client = httpx.AsyncClient(
+        timeout=timeout or DEFAULT_TIMEOUT,
+        limits=limits or DEFAULT_LIMITS,
+        **kwargs
+    )
+    _clients[name] = (client, loop)
+    logger.debug(f"Created shared HTTP client '{name}'")
+    return client
+
+
+async def close_all_clients():
+    """Close every shared client (call on shutdown)."""
+    for name, (client, _) in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"Error closing shared HTTP client '{name}': {e}")
+    _clients.clear()
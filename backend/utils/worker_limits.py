@@ -0,0 +1,335 @@
+"""
+Per-worker concurrency limits and resource accounting.
+
+Each worker process caps how much it takes on at once, so a burst of runs queues
+instead of overloading the event loop:
+
+- WORKER_MAX_ACTIVE_RUNS agent runs (further runs wait for a slot)
+- WORKER_MAX_LLM_STREAMS LLM streams being consumed
+- WORKER_MAX_SANDBOX_CALLS sandbox tool calls in flight
+
+For sizing workers, each process also tracks:
+- active and waiting runs
+- queue lag (enqueue to start)
+- event-loop time per run (time spent running the run's callbacks on the loop)
+- event-loop lag
+
+The worker publishes a snapshot to Redis every WORKER_METRICS_INTERVAL seconds.
+The admin metrics endpoint returns the snapshots of all live workers.
+It also keeps a small capacity record (run limit, active runs, average run duration)
+current on every run start and end. Admission control reads this record. All workers'
+records live in one hash (`worker_capacity`, field per worker) and carry a heartbeat,
+so the API reads them with a single HGETALL.
+"""
+
+import asyncio
+import json
+import time
+import weakref
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from services import redis
+from utils.config import config
+from utils.logger import logger
+
+METRICS_KEY_PREFIX = "worker_metrics:"
+CAPACITY_KEY = "worker_capacity"
+
+# agent_run_id of the run the current task belongs to (inherited by tasks it creates)
+_current_run: ContextVar[Optional[str]] = ContextVar("current_agent_run", default=None)
+
+
+class _Limit:
+    """An asyncio semaphore that keeps counters for reporting."""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.peak = 0
+        self.total = 0
+        self.wait_total = 0.0
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the seconds spent waiting."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - started
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        self.total += 1
+        self.wait_total += waited
+        if waited > 1:
+            logger.info(f"Waited {waited:.1f}s for a worker {self.name} slot ({self.active}/{self.limit} in use)")
+        return waited
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "peak": self.peak,
+            "total": self.total,
+            "avg_wait": round(self.wait_total / self.total, 3) if self.total else 0.0,
+        }
+
+
+run_limit = _Limit("run", config.WORKER_MAX_ACTIVE_RUNS)
+llm_stream_limit = _Limit("LLM stream", config.WORKER_MAX_LLM_STREAMS)
+sandbox_limit = _Limit("sandbox call", config.WORKER_MAX_SANDBOX_CALLS)
+
+_active_runs: Dict[str, Dict[str, Any]] = {}
+_run_totals = {"runs": 0, "loop_time": 0.0, "duration": 0.0, "queue_lag_total": 0.0, "queue_lag_samples": 0, "queue_lag_max": 0.0}
+_loop_stats = {"busy_time": 0.0, "lag": 0.0, "lag_max": 0.0}
+_instance_id: Optional[str] = None  # Set once the worker starts reporting
+
+
+@asynccontextmanager
+async def run_slot(agent_run_id: str, enqueued_at: Optional[float] = None):
+    """Hold one of the worker's run slots for the duration of an agent run.
+
+    Args:
+        agent_run_id: ID of the agent run
+        enqueued_at: Epoch seconds the run was enqueued, to report queue lag
+    """
+    async with run_limit.slot():
+        async with track_run(agent_run_id, enqueued_at) as stats:
+            yield stats
+
+
+@asynccontextmanager
+async def track_run(agent_run_id: str, enqueued_at: Optional[float] = None):
+    """Account queue lag and event-loop time to an agent run (the caller holds the run slot)."""
+    started = time.time()
+    queue_lag = max(0.0, started - enqueued_at) if enqueued_at else None
+    stats = {"started_at": started, "queue_lag": queue_lag, "loop_time": 0.0}
+    _active_runs[agent_run_id] = stats
+    await publish_capacity()
+    token = _current_run.set(agent_run_id)
+    try:
+        yield stats
+    finally:
+        _current_run.reset(token)
+        _active_runs.pop(agent_run_id, None)
+
+        duration = time.time() - started
+        _run_totals["runs"] += 1
+        _run_totals["loop_time"] += stats["loop_time"]
+        _run_totals["duration"] += duration
+        if queue_lag is not None:
+            _run_totals["queue_lag_total"] += queue_lag
+            _run_totals["queue_lag_samples"] += 1
+            _run_totals["queue_lag_max"] = max(_run_totals["queue_lag_max"], queue_lag)
+        logger.info(
+            f"Agent run {agent_run_id} used {stats['loop_time']:.2f}s of event-loop time over {duration:.1f}s"
+            + (f" (queued {queue_lag:.1f}s)" if queue_lag is not None else "")
+        )
+        await publish_capacity()
+
+
+def llm_stream_slot():
+    """Context manager holding one of the worker's LLM stream slots."""
+    return llm_stream_limit.slot()
+
+
+def sandbox_slot():
+    """Context manager holding one of the worker's sandbox call slots."""
+    return sandbox_limit.slot()
+
+
+def hold_llm_stream_slot(stream: AsyncGenerator) -> AsyncGenerator:
+    """Release an acquired LLM stream slot once `stream` is exhausted, closed or garbage collected."""
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            llm_stream_limit.release()
+
+    async def wrapper():
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            release()
+
+    wrapped = wrapper()
+    # A stream that is never iterated never runs its finally block
+    weakref.finalize(wrapped, release)
+    return wrapped
+
+
+def install_loop_timing():
+    """Time every event-loop callback and attribute it to the agent run it belongs to.
+
+    Patches asyncio's Handle so it applies to every loop in the process; only the
+    worker calls this.
+    """
+    handle_class = asyncio.events.Handle
+    if getattr(handle_class, "_worker_timing_installed", False):
+        return
+    original_run = handle_class._run
+
+    def _timed_run(self):
+        started = time.perf_counter()
+        try:
+            return original_run(self)
+        finally:
+            elapsed = time.perf_counter() - started
+            _loop_stats["busy_time"] += elapsed
+            context = self._context
+            run_id = context.get(_current_run) if context is not None else None
+            if run_id:
+                stats = _active_runs.get(run_id)
+                if stats is not None:
+                    stats["loop_time"] += elapsed
+
+    handle_class._run = _timed_run
+    handle_class._worker_timing_installed = True
+    logger.info("Installed per-run event-loop timing")
+
+
+def get_worker_metrics() -> Dict[str, Any]:
+    """Concurrency and resource usage of this worker process."""
+    now = time.time()
+    runs = _run_totals["runs"]
+    return {
+        "runs": run_limit.as_dict(),
+        "llm_streams": llm_stream_limit.as_dict(),
+        "sandbox_calls": sandbox_limit.as_dict(),
+        "active_runs": {
+            run_id: {
+                "running_for": round(now - stats["started_at"], 1),
+                "queue_lag": round(stats["queue_lag"], 3) if stats["queue_lag"] is not None else None,
+                "loop_time": round(stats["loop_time"], 3),
+            }
+            for run_id, stats in _active_runs.items()
+        },
+        "completed_runs": runs,
+        "avg_loop_time_per_run": round(_run_totals["loop_time"] / runs, 3) if runs else 0.0,
+        "avg_run_duration": _avg_run_duration() or 0.0,
+        "avg_queue_lag": round(_run_totals["queue_lag_total"] / _run_totals["queue_lag_samples"], 3) if _run_totals["queue_lag_samples"] else 0.0,
+        "max_queue_lag": round(_run_totals["queue_lag_max"], 3),
+        "loop_busy_time": round(_loop_stats["busy_time"], 3),
+        "loop_lag": round(_loop_stats["lag"], 4),
+        "loop_lag_max": round(_loop_stats["lag_max"], 4),
+    }
+
+
+async def _collect_snapshot(instance_id: str) -> Dict[str, Any]:
+    from services.llm_scheduler import get_scheduler_metrics
+    from services.llm_streaming import get_stream_metrics
+    from services.prompt_cache import get_prompt_cache_metrics
+    from utils.circuit_breaker import get_circuit_states
+
+    return {
+        "instance_id": instance_id,
+        "timestamp": time.time(),
+        "worker": get_worker_metrics(),
+        "llm_scheduler": get_scheduler_metrics(),
+        "llm_streams": get_stream_metrics(),
+        "prompt_cache": get_prompt_cache_metrics(),
+        "circuits": await get_circuit_states(),
+    }
+
+
+def _avg_run_duration() -> Optional[float]:
+    runs = _run_totals["runs"]
+    return round(_run_totals["duration"] / runs, 1) if runs else None
+
+
+async def publish_capacity():
+    """Write this worker's run capacity to Redis for admission control."""
+    if not _instance_id:
+        return
+    capacity = {
+        "instance_id": _instance_id,
+        "limit": run_limit.limit,
+        "active": len(_active_runs),
+        "avg_run_duration": _avg_run_duration(),
+        "heartbeat": time.time(),
+    }
+    try:
+        redis_client = await redis.get_client()
+        await redis_client.hset(CAPACITY_KEY, _instance_id, json.dumps(capacity))
+    except Exception as e:
+        logger.warning(f"Failed to publish worker capacity: {e}")
+
+
+async def get_worker_capacity() -> List[Dict[str, Any]]:
+    """Capacity records of every live worker; records of workers that stopped heartbeating are removed."""
+    redis_client = await redis.get_client()
+    stale_before = time.time() - config.WORKER_METRICS_INTERVAL * 3
+    records, stale = [], []
+    for instance_id, raw in (await redis_client.hgetall(CAPACITY_KEY)).items():
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            stale.append(instance_id)
+            continue
+        if record.get("heartbeat", 0) < stale_before:
+            stale.append(instance_id)
+        else:
+            records.append(record)
+    if stale:
+        await redis_client.hdel(CAPACITY_KEY, *stale)
+    return records
+
+
+async def report_metrics(instance_id: str):
+    """Publish this worker's metrics snapshot to Redis periodically; also samples event-loop lag."""
+    global _instance_id
+    _instance_id = instance_id
+    interval = config.WORKER_METRICS_INTERVAL
+    key = f"{METRICS_KEY_PREFIX}{instance_id}"
+    await publish_capacity()
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.monotonic() - started - interval)
+        _loop_stats["lag"] = lag
+        _loop_stats["lag_max"] = max(_loop_stats["lag_max"], lag)
+        await publish_capacity()
+        try:
+            snapshot = await _collect_snapshot(instance_id)
+            await redis.set(key, json.dumps(snapshot, default=str), ex=interval * 3)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Failed to publish worker metrics: {e}")
+
+
+async def get_all_worker_metrics() -> List[Dict[str, Any]]:
+    """Latest snapshots of every worker that reported recently."""
+    snapshots = []
+    for key in await redis.keys(f"{METRICS_KEY_PREFIX}*"):
+        raw = await redis.get(key)
+        if raw:
+            try:
+                snapshots.append(json.loads(raw))
+            except ValueError:
+                continue
+    return sorted(snapshots, key=lambda snapshot: snapshot.get("instance_id", ""))
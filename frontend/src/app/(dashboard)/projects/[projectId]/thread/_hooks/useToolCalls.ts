@@ -184,6 +184,7 @@ export function useToolCalls(
           } catch { }
         }
 
+        const resultMetadata = safeJsonParse<ParsedMetadata>(resultMessage.metadata, {});
         const toolIndex = historicalToolPairs.length;
         historicalToolPairs.push({
           assistantCall: {
@@ -195,6 +196,9 @@ export function useToolCalls(
             content: resultMessage.content,
             isSuccess: isSuccess,
             timestamp: resultMessage.created_at,
+            outputRef: resultMetadata.output_ref && resultMessage.message_id
+              ? { threadId: resultMessage.thread_id, messageId: resultMessage.message_id }
+              : undefined,
           },
         });
 
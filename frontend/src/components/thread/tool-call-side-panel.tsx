@@ -11,6 +11,8 @@ import { cn } from '@/lib/utils';
 import { useIsMobile } from '@/hooks/use-mobile';
 import { Button } from '@/components/ui/button';
 import { ToolView } from './tool-views/wrapper';
+import { withFullToolOutput } from './tool-views/utils';
+import { useMessageOutputQuery } from '@/hooks/react-query/threads/use-messages';
 
 export interface ToolCallInput {
   assistantCall: {
@@ -22,6 +24,8 @@ export interface ToolCallInput {
     content?: string;
     isSuccess?: boolean;
     timestamp?: string;
+    // Set when the output was offloaded and content only holds a preview
+    outputRef?: { threadId: string; messageId: string };
   };
   messages?: ApiMessageType[];
 }
@@ -204,6 +208,14 @@ export function ToolCallSidePanel({
   );
   const isStreaming = displayToolCall?.toolResult?.content === 'STREAMING';
 
+  // Large outputs are stored separately; the message only holds a preview
+  const outputRef = displayToolCall?.toolResult?.outputRef;
+  const { data: fullToolOutput } = useMessageOutputQuery(outputRef?.threadId, outputRef?.messageId);
+  const toolContent = React.useMemo(() => {
+    const content = displayToolCall?.toolResult?.content;
+    return content && fullToolOutput ? withFullToolOutput(content, fullToolOutput) : content;
+  }, [displayToolCall?.toolResult?.content, fullToolOutput]);
+
   // Extract actual success value from tool content with fallbacks
   const getActualSuccess = (toolCall: any): boolean => {
     const content = toolCall?.toolResult?.content;
@@ -590,7 +602,7 @@ export function ToolCallSidePanel({
       <ToolView
         name={displayToolCall.assistantCall.name}
         assistantContent={displayToolCall.assistantCall.content}
-        toolContent={displayToolCall.toolResult?.content}
+        toolContent={toolContent}
         assistantTimestamp={displayToolCall.assistantCall.timestamp}
         toolTimestamp={displayToolCall.toolResult?.timestamp}
         isSuccess={isSuccess}
@@ -1545,4 +1545,30 @@ export function extractToolData(content: any): {
     url: null,
     query: null,
   };
-}
\ No newline at end of file
+}
+
+// Put the full output of an offloaded tool result back into its message content,
+// keeping the shape the tool views parse (plain content or structured tool_execution)
+export function withFullToolOutput(toolContent: string, fullOutput: string): string {
+  try {
+    const message = JSON.parse(toolContent);
+    if (!message || typeof message.content !== 'string') return toolContent;
+
+    let output: any = fullOutput;
+    try {
+      output = JSON.parse(fullOutput);
+    } catch { }
+
+    try {
+      const structured = JSON.parse(message.content);
+      if (structured?.tool_execution?.result) {
+        structured.tool_execution.result.output = output;
+        return JSON.stringify({ ...message, content: JSON.stringify(structured) });
+      }
+    } catch { }
+
+    return JSON.stringify({ ...message, content: fullOutput });
+  } catch {
+    return toolContent;
+  }
+}
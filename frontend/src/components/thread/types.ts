@@ -40,6 +40,7 @@ export interface ParsedMetadata {
   assistant_message_id?: string; // Link tool results/statuses back
   linked_tool_result_message_id?: string; // Link status to tool result
   parsing_details?: any;
+  output_ref?: { path: string; size: number }; // Tool output stored outside the message
   [key: string]: any; // Allow other properties
 }
 
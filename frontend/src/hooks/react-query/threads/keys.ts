@@ -4,6 +4,7 @@ export const threadKeys = createQueryKeys({
   all: ['threads'] as const,
   details: (threadId: string) => ['thread', threadId] as const,
   messages: (threadId: string) => ['thread', threadId, 'messages'] as const,
+  messageOutput: (threadId: string, messageId: string) => ['thread', threadId, 'messages', messageId, 'output'] as const,
   project: (projectId: string) => ['project', projectId] as const,
   publicProjects: () => ['public-projects'] as const,
   agentRuns: (threadId: string) => ['thread', threadId, 'agent-runs'] as const,
@@ -1,6 +1,6 @@
 import { createMutationHook, createQueryHook } from "@/hooks/use-query";
 import { threadKeys } from "./keys";
-import { addUserMessage, getMessages } from "@/lib/api";
+import { addUserMessage, getMessageOutput, getMessages } from "@/lib/api";
 
 export const useMessagesQuery = (threadId: string) =>
   createQueryHook(
@@ -22,3 +22,15 @@ export const useAddUserMessageMutation = () =>
       message: string;
     }) => addUserMessage(threadId, message)
   )();
+
+// Full output of a tool result whose output was offloaded to storage; it never changes
+export const useMessageOutputQuery = (threadId?: string, messageId?: string) =>
+  createQueryHook(
+    threadKeys.messageOutput(threadId ?? '', messageId ?? ''),
+    () => getMessageOutput(threadId!, messageId!),
+    {
+      enabled: !!threadId && !!messageId,
+      retry: 1,
+      staleTime: Infinity,
+    }
+  )();
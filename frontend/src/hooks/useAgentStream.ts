@@ -263,6 +263,19 @@ export function useAgentStream(
       // --- Check for error messages first ---
       try {
         const jsonData = JSON.parse(processedData);
+        // Run-level statuses published before/around the run (see services/admission.py
+        // and run_agent_background.py); they have no status_type
+        if (jsonData.type === 'status' && jsonData.status === 'queued') {
+          toast.info(jsonData.message || 'Waiting for an available worker', {
+            id: `agent-queued-${currentRunIdRef.current}`,
+            duration: Infinity,
+          });
+          return;
+        }
+        if (jsonData.type === 'status' && jsonData.status === 'resumed') {
+          toast.info(jsonData.message || 'Resuming the agent run');
+          return;
+        }
         if (jsonData.status === 'error') {
           console.error('[useAgentStream] Received error status message:', jsonData);
           const errorMessage = jsonData.message || 'Unknown error occurred';
@@ -292,7 +305,10 @@ export function useAgentStream(
       );
 
       // Update status to streaming if we receive a valid message
-      if (status !== 'streaming') updateStatus('streaming');
+      if (status !== 'streaming') {
+        toast.dismiss(`agent-queued-${currentRunIdRef.current}`);
+        updateStatus('streaming');
+      }
 
       switch (message.type) {
         case 'assistant':
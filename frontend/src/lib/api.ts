@@ -29,6 +29,35 @@ export class BillingError extends Error {
   }
 }
 
+// Raised when the backend rejects an agent start because all workers are busy (429)
+export class AgentCapacityError extends Error {
+  status = 429;
+  retryAfter: number; // Seconds until a retry is likely to be admitted
+
+  constructor(retryAfter: number, message?: string) {
+    super(
+      message ||
+        `All agent workers are busy. Please try again in about ${retryAfter}s.`,
+    );
+    this.name = 'AgentCapacityError';
+    this.retryAfter = retryAfter;
+    Object.setPrototypeOf(this, AgentCapacityError.prototype);
+  }
+}
+
+const parseAgentCapacityError = async (
+  response: Response,
+): Promise<AgentCapacityError> => {
+  const errorData = await response.json().catch(() => null);
+  const detail = errorData?.detail || {};
+  // The body carries the hint too; Retry-After isn't readable cross-origin unless exposed
+  const retryAfter =
+    Number(detail.retry_after) ||
+    Number(response.headers.get('Retry-After')) ||
+    30;
+  return new AgentCapacityError(retryAfter, detail.message);
+};
+
 export class NoAccessTokenAvailableError extends Error {
   constructor(message?: string, options?: { cause?: Error }) {
     super(message || 'No access token available', options);
@@ -594,6 +623,10 @@ export const startAgent = async (
     });
 
     if (!response.ok) {
+      if (response.status === 429) {
+        throw await parseAgentCapacityError(response);
+      }
+
       // Check for 402 Payment Required first
       if (response.status === 402) {
         try {
@@ -810,6 +843,38 @@ export const getAgentRuns = async (threadId: string): Promise<AgentRun[]> => {
   }
 };
 
+// Full output of a tool result message whose output was offloaded to storage
+// (the message itself only holds a preview and metadata.output_ref)
+export const getMessageOutput = async (
+  threadId: string,
+  messageId: string,
+): Promise<string> => {
+  const supabase = createClient();
+  const {
+    data: { session },
+  } = await supabase.auth.getSession();
+
+  if (!session?.access_token) {
+    throw new NoAccessTokenAvailableError();
+  }
+
+  const response = await fetch(
+    `${API_URL}/thread/${threadId}/messages/${messageId}/output`,
+    {
+      headers: {
+        Authorization: `Bearer ${session.access_token}`,
+      },
+    },
+  );
+
+  if (!response.ok) {
+    throw new Error(`Error getting message output: ${response.statusText}`);
+  }
+
+  const data = await response.json();
+  return data.output;
+};
+
 export const streamAgent = (
   agentRunId: string,
   callbacks: {
@@ -1437,6 +1502,10 @@ export const initiateAgent = async (
     });
 
     if (!response.ok) {
+      if (response.status === 429) {
+        throw await parseAgentCapacityError(response);
+      }
+
       const errorText = await response
         .text()
         .catch(() => 'No error details available');